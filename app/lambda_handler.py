@@ -0,0 +1,36 @@
+"""
+AWS Lambda entry point.
+
+Only the FastAPI app and its routers are imported here. pandas is imported on the first
+parse request and the gRPC fleet routing client on the first solve, both are then kept
+for the lifetime of the warm container. Tenant profiles are preloaded during init.
+
+Scheduled EventBridge events (source "aws.events") run the ETA cache warmer instead of
+an HTTP request, e.g. a rule with `cron(0/20 21-23 * * ? *)` (01:00-04:00 UAE time).
+"""
+import logging
+
+from mangum import Mangum
+
+from app.main import app
+from app.models.cache.shared_storage import is_shared
+from app.models.tenants.tenant_registry import get_tenant_registry
+
+# Lifespan events are off under Mangum, preload hot tenants during the init phase instead
+get_tenant_registry().preload()
+
+http_handler = Mangum(app, lifespan="off")
+
+if not is_shared():
+    # Each container has its own /tmp, a follow-up request usually lands on another one
+    logging.warning("SHARED_STORAGE_DIR is not set, exports, stored plans, captures, profiles, solve stats, "
+                    "tenant usage, the ETA cache and the leg history are per container")
+
+
+def handler(event, context):
+    if isinstance(event, dict) and event.get("source") == "aws.events":
+        # Imported here, HTTP invocations never need the warmer
+        from app.services.v1.scheduling.eta_warmer import get_eta_warmer
+        detail = event.get("detail") or {}
+        return get_eta_warmer().run(force=bool(detail.get("force")))
+    return http_handler(event, context)
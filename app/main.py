@@ -1,49 +1,42 @@
 from dotenv import load_dotenv
 from fastapi import FastAPI
-from starlette.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
-from google.cloud import optimization_v1
-import json
 import os
-from fastapi import File, UploadFile, HTTPException
 import logging
-from typing import List, Dict
-import requests
 from .services.v1.files.parsers.files_parser_service import router as router_files_parser
 from .services.v1.geo.vrp.cfr_service import router as cfr_router
+from .services.v1.debug.profiler_service import router as profiler_router
+from .services.v1.geo.vrp.plan_export_service import router as plan_export_router
+from .services.v1.geo.vrp.plan_store_service import router as plan_store_router
+from .services.v1.geo.eta_warm_service import router as eta_warm_router
+from .services.v1.files.uploads import UploadLimitMiddleware
+from .models.tenants.tenant_registry import get_tenant_registry
+
+# Heavy dependencies (pandas, the optimization gRPC client) are imported lazily by the
+# services that need them, so importing this module stays cheap on a Lambda cold start.
 
 app = FastAPI()
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Oversized uploads are rejected while streaming, before they are spooled
+app.add_middleware(UploadLimitMiddleware)
+
+# Static files are optional, the Lambda image does not ship a static directory
+if os.path.isdir("static"):
+    app.mount("/static", StaticFiles(directory="static"), name="static")
 
-os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "google_key.json"
+os.environ.setdefault("GOOGLE_APPLICATION_CREDENTIALS", "google_key.json")
 
 logger = logging.getLogger(__name__)
 app.include_router(router_files_parser)
 app.include_router(cfr_router)
+app.include_router(profiler_router)
+app.include_router(plan_export_router)
+app.include_router(plan_store_router)
+app.include_router(eta_warm_router)
 load_dotenv(".env")
 
 
-
-
-
-
-
-
-def call_eta_api(start_lat, start_lon, stop_lat, stop_lon, country):
-    endpoint = "_enver_"
-#     headers = {
-#         'Accept': 'application/json',
-#         'Content-Type': 'application/json',
-#     }
-#     query_params = {
-#         'country': country,
-#         'start_lon': start_lon,
-#         'stop_lon': stop_lon,
-#         'start_lat': start_lat,
-#         'stop_lat': stop_lat,
-#         'source': 'mobile',
-#         'action': 'GetAll'
-    }
-    response = requests.get(endpoint, headers=headers, params=query_params)
-    return response.json()
+@app.on_event("startup")
+def preload_tenants():
+    # Hot tenants are loaded before the first request is served
+    get_tenant_registry().preload()
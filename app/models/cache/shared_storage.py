@@ -0,0 +1,16 @@
+import os
+
+# Directory every instance sees (e.g. an EFS mount on Lambda). Stored plans, exports,
+# captures, profiles, the leg history, solve stats, tenant usage and the ETA cache default
+# to it when set, they stay in the container's /tmp otherwise and only that container can
+# read them back.
+SHARED_STORAGE_DIR = os.getenv("SHARED_STORAGE_DIR")
+
+
+def storage_path(name, local_default):
+    """Default location of a store: `name` under SHARED_STORAGE_DIR when set, `local_default` otherwise."""
+    return os.path.join(SHARED_STORAGE_DIR, name) if SHARED_STORAGE_DIR else local_default
+
+
+def is_shared() -> bool:
+    return bool(SHARED_STORAGE_DIR)
@@ -0,0 +1,177 @@
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+class TieredCache:
+    """
+    Two-tier cache: a bounded in-memory LRU in front of an optional directory on disk.
+
+    Values are stored pickled in both tiers, so every `get` returns a fresh copy that the
+    caller may mutate, and the memory tier is bounded by bytes rather than item count.
+    Disk entries are evicted least recently used first once `max_disk_bytes` is exceeded.
+    """
+
+    def __init__(self, name, max_memory_bytes, disk_dir=None, max_disk_bytes=None, ttl_seconds=None):
+        self.name = name
+        self.max_memory_bytes = max_memory_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl_seconds = ttl_seconds
+
+        self._memory = OrderedDict()  # key -> (stored_at, pickled value)
+        self._memory_bytes = 0
+        self._disk_bytes = None
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and not self._expired(entry[0]):
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return pickle.loads(entry[1])
+
+        blob, stored_at = self._read_disk(key)
+        if blob is None:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        # Promote to memory so the next hit does not touch the disk, it expires with the disk entry
+        with self._lock:
+            self.hits += 1
+            self._store_memory(key, stored_at, blob)
+        return pickle.loads(blob)
+
+    def set(self, key, value):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._store_memory(key, time.time(), blob)
+        self._write_disk(key, blob)
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and not self._expired(entry[0]):
+                return True
+        path = self._path(key)
+        return path is not None and os.path.exists(path) and not self._expired(os.path.getmtime(path))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "name": self.name,
+                "memory_items": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_bytes": self._disk_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def _expired(self, stored_at):
+        return self.ttl_seconds is not None and time.time() - stored_at > self.ttl_seconds
+
+    def _store_memory(self, key, stored_at, blob):
+        # Caller holds the lock
+        if len(blob) > self.max_memory_bytes:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= len(previous[1])
+        self._memory[key] = (stored_at, blob)
+        self._memory_bytes += len(blob)
+        while self._memory_bytes > self.max_memory_bytes:
+            _, (_, evicted) = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _path(self, key):
+        if not self.disk_dir:
+            return None
+        digest = hashlib.sha256(str(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.disk_dir, f"{digest}.pkl")
+
+    def _read_disk(self, key):
+        """The entry's pickled value and write time, (None, None) when missing or expired."""
+        path = self._path(key)
+        if path is None:
+            return None, None
+        try:
+            stored_at = os.path.getmtime(path)
+            if self._expired(stored_at):
+                os.remove(path)
+                return None, None
+            with open(path, "rb") as file:
+                blob = file.read()
+            # Reads count as use for LRU eviction, keep the write time for the TTL
+            os.utime(path, (time.time(), stored_at))
+            return blob, stored_at
+        except FileNotFoundError:
+            return None, None
+        except OSError as exc:
+            logging.warning(f"Cache {self.name}: could not read {path}: {exc}")
+            return None, None
+
+    def _write_disk(self, key, blob):
+        path = self._path(key)
+        if path is None:
+            return
+        try:
+            # Write then rename, readers never see a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as file:
+                file.write(blob)
+            os.replace(tmp_path, path)
+        except OSError as exc:
+            logging.warning(f"Cache {self.name}: could not write {path}: {exc}")
+            return
+
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = self._scan_disk_bytes()
+            else:
+                self._disk_bytes += len(blob)
+            over_limit = self.max_disk_bytes is not None and self._disk_bytes > self.max_disk_bytes
+        if over_limit:
+            self._evict_disk()
+
+    def _scan_disk_bytes(self):
+        total = 0
+        for entry in os.scandir(self.disk_dir):
+            if entry.name.endswith(".pkl"):
+                total += entry.stat().st_size
+        return total
+
+    def _evict_disk(self):
+        # Least recently used (by access time) first, down to 90% of the limit
+        entries = []
+        for entry in os.scandir(self.disk_dir):
+            if entry.name.endswith(".pkl"):
+                stat = entry.stat()
+                entries.append((stat.st_atime, stat.st_size, entry.path))
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries)
+        target = self.max_disk_bytes * 0.9
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+        with self._lock:
+            self._disk_bytes = total
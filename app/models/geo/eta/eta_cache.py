@@ -0,0 +1,27 @@
+import os
+from functools import lru_cache
+
+from app.models.cache.shared_storage import storage_path
+from app.models.cache.tiered_cache import TieredCache
+
+# "off" always calls the ETA service, cached legs are reused across requests otherwise
+ETA_CACHE = os.getenv("ETA_CACHE", "on") != "off"
+ETA_CACHE_MEMORY_BYTES = int(os.getenv("ETA_CACHE_MEMORY_BYTES", str(128 * 1024 * 1024)))
+# On shared storage a leg fetched (or warmed) by one container is a hit for every other one
+ETA_CACHE_DIR = os.getenv("ETA_CACHE_DIR", storage_path("eta_cache", "/tmp/eta_cache"))
+ETA_CACHE_MAX_BYTES = int(os.getenv("ETA_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+# Roads change slowly, a week old leg is still a good answer
+ETA_CACHE_TTL_SECONDS = float(os.getenv("ETA_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+# ~0.1 m, the same point from two uploads maps to the same key
+COORDINATE_DECIMALS = 6
+
+
+@lru_cache(maxsize=None)
+def get_eta_cache() -> TieredCache:
+    return TieredCache("eta", ETA_CACHE_MEMORY_BYTES, ETA_CACHE_DIR, ETA_CACHE_MAX_BYTES, ETA_CACHE_TTL_SECONDS)
+
+
+def leg_cache_key(start_lat, start_lng, stop_lat, stop_lng, country) -> str:
+    coordinates = ",".join(f"{float(value):.{COORDINATE_DECIMALS}f}"
+                           for value in (start_lat, start_lng, stop_lat, stop_lng))
+    return f"{country}:{coordinates}"
@@ -0,0 +1,178 @@
+import json
+import logging
+import os
+from collections import defaultdict, deque
+from functools import lru_cache
+
+ETA_ENDPOINT = os.getenv("ETA_ENDPOINT", "ennv")
+# "auto" tries route requests and falls back to per-leg calls if the service rejects them, "off" never batches
+ETA_BATCH_MODE = os.getenv("ETA_BATCH_MODE", "auto")
+# Legs per route request, long routes are split into chunks of this many legs
+ETA_BATCH_MAX_LEGS = int(os.getenv("ETA_BATCH_MAX_LEGS", "25"))
+# Keep one pooled connection per ETA worker thread (requests defaults to 10)
+ETA_CONNECTIONS = int(os.getenv("ETA_WORKERS", "16"))
+# Per-request timeout, a stalled leg must not hold a worker forever
+ETA_CALL_TIMEOUT_SECONDS = float(os.getenv("ETA_CALL_TIMEOUT_SECONDS", "10"))
+
+# Statuses meaning the service does not know the route action (as opposed to a failed request)
+UNSUPPORTED_STATUSES = (400, 404, 405, 501)
+
+
+class BatchUnsupported(Exception):
+    pass
+
+
+def _point(item):
+    return float(item.get('lat', item.get('latitude'))), float(item.get('lng', item.get('longitude')))
+
+
+def split_geometry(points, waypoints, waypoint_indexes=None) -> list:
+    """
+    Split one route geometry into per-leg point lists. Leg `k` runs from waypoint `k` to
+    waypoint `k + 1`, both ends included like a per-leg response. Without the indexes from
+    the service, each waypoint is matched to the closest following geometry point.
+    """
+    if waypoint_indexes is None:
+        waypoint_indexes = []
+        start = 0
+        coordinates = [_point(point) for point in points]
+        for lat, lng in waypoints:
+            best = min(range(start, len(coordinates)),
+                       key=lambda i: (coordinates[i][0] - lat) ** 2 + (coordinates[i][1] - lng) ** 2,
+                       default=start)
+            waypoint_indexes.append(best)
+            start = best
+
+    return [points[waypoint_indexes[k]:waypoint_indexes[k + 1] + 1] for k in range(len(waypoints) - 1)]
+
+
+class EtaClient:
+    """
+    Client of the ETA service. `leg` fetches the directions between two points, `route`
+    fetches a whole waypoint sequence in one request and returns one `directions_data`
+    response per leg. Route requests are switched off for the process the first time the
+    service rejects one, callers then fall back to `leg`.
+    """
+
+    def __init__(self, endpoint=None, session=None, batch_mode=None):
+        self.endpoint = endpoint or ETA_ENDPOINT
+        self.batch_mode = batch_mode or ETA_BATCH_MODE
+        self._session = session
+        self.batch_supported = self.batch_mode != "off"
+
+    @property
+    def session(self):
+        if self._session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            self._session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=ETA_CONNECTIONS, pool_maxsize=ETA_CONNECTIONS)
+            self._session.mount("http://", adapter)
+            self._session.mount("https://", adapter)
+        return self._session
+
+    def leg(self, start_lat, start_lon, stop_lat, stop_lon, country, timeout=None):
+        headers = {
+            'Accept': 'application/json',
+            'Content-Type': 'application/json',
+        }
+        query_params = {
+            'country': country,
+            'start_lon': start_lon,
+            'stop_lon': stop_lon,
+            'start_lat': start_lat,
+            'stop_lat': stop_lat,
+            'source': 'mobile',
+            'action': 'GetAll'
+        }
+        response = self.session.get(self.endpoint, headers=headers, params=query_params,
+                                    timeout=timeout or ETA_CALL_TIMEOUT_SECONDS)
+        return json.loads(response.text)
+
+    def route(self, waypoints, country, timeout=None) -> list:
+        """Directions for every consecutive pair of `waypoints` ((lat, lng) tuples) in one request."""
+        if not self.batch_supported:
+            raise BatchUnsupported()
+
+        body = {
+            'country': country,
+            'source': 'mobile',
+            'action': 'GetRoute',
+            'waypoints': [{'lat': lat, 'lng': lng} for lat, lng in waypoints],
+        }
+        response = self.session.post(self.endpoint, json=body, headers={'Accept': 'application/json'},
+                                     timeout=timeout or ETA_CALL_TIMEOUT_SECONDS)
+        if response.status_code in UNSUPPORTED_STATUSES:
+            self.disable_batching(f"status {response.status_code}")
+        response.raise_for_status()
+        payload = json.loads(response.text)
+
+        leg_count = len(waypoints) - 1
+        if isinstance(payload.get('legs'), list) and len(payload['legs']) == leg_count:
+            return payload['legs']
+
+        directions_data = payload.get('directions_data')
+        if isinstance(directions_data, str):
+            directions_data = json.loads(directions_data)
+        if not isinstance(directions_data, list) or not directions_data:
+            self.disable_batching("no legs or directions_data in the response")
+
+        legs = split_geometry(directions_data, waypoints, payload.get('waypoint_indexes'))
+        return [{'directions_data': points} for points in legs]
+
+    def disable_batching(self, reason):
+        if self.batch_supported:
+            logging.warning(f"ETA route requests not supported ({reason}), using per-leg calls")
+        self.batch_supported = False
+        raise BatchUnsupported(reason)
+
+
+@lru_cache(maxsize=None)
+def get_eta_client() -> EtaClient:
+    # Shared client so ETA calls reuse connections across requests
+    return EtaClient()
+
+
+def chunk_route_legs(legs, max_legs=None) -> list:
+    """
+    Group legs ((start_lat, start_lng, stop_lat, stop_lng) in route order) into waypoint
+    sequences. A chunk ends when the next leg does not start where the previous one
+    stopped (a skipped or already fetched leg) or when it holds `max_legs` legs.
+    """
+    max_legs = max_legs or ETA_BATCH_MAX_LEGS
+    chunks = []
+    current = []
+    for leg in legs:
+        start, stop = (leg[0], leg[1]), (leg[2], leg[3])
+        if current and (current[-1] != start or len(current) > max_legs):
+            chunks.append(current)
+            current = []
+        if not current:
+            current.append(start)
+        current.append(stop)
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def chain_legs(legs) -> list:
+    """
+    Order legs ((start_lat, start_lng, stop_lat, stop_lng), any order) into chains where
+    each leg starts where the previous one stopped. A full matrix of legs then goes out as
+    a few long route requests instead of one request per leg.
+    """
+    outgoing = defaultdict(deque)
+    for leg in legs:
+        outgoing[(leg[0], leg[1])].append(leg)
+
+    chains = []
+    for start in list(outgoing):
+        while outgoing[start]:
+            chain = []
+            point = start
+            while outgoing.get(point):
+                leg = outgoing[point].popleft()
+                chain.append(leg)
+                point = (leg[2], leg[3])
+            chains.append(chain)
+    return chains
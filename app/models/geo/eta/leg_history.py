@@ -0,0 +1,115 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from collections import Counter
+from functools import lru_cache
+
+from app.models.cache.shared_storage import storage_path
+from app.models.geo.eta.eta_cache import COORDINATE_DECIMALS
+
+# Legs of recent plans, one JSON line per solve in one file per container, read by the ETA
+# cache warmer. Only on shared storage does the warmer see the solves of every container.
+ETA_LEG_HISTORY_DIR = os.getenv("ETA_LEG_HISTORY_DIR", storage_path("eta_leg_history", "/tmp/eta_leg_history"))
+# Solves older than this no longer count towards a leg's frequency
+ETA_LEG_HISTORY_DAYS = float(os.getenv("ETA_LEG_HISTORY_DAYS", "14"))
+# A container's file is compacted (old solves dropped) once it grows past this size
+ETA_LEG_HISTORY_MAX_BYTES = int(os.getenv("ETA_LEG_HISTORY_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+def _rounded(leg):
+    return tuple(round(float(value), COORDINATE_DECIMALS) for value in leg)
+
+
+class LegHistory:
+    """
+    Which legs recent plans needed: the depot -> customer leg of every record and every
+    leg driven between stops. Each solve appends one line to this container's file,
+    frequencies are counted over every file of the directory for the last
+    ETA_LEG_HISTORY_DAYS when the warmer asks for them.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory if directory is not None else ETA_LEG_HISTORY_DIR
+        # Appended by this process only, None turns recording off
+        self.path = os.path.join(self.directory, f"{socket.gethostname()}-{os.getpid()}.jsonl") \
+            if self.directory else None
+        self._lock = threading.Lock()
+
+    def record(self, legs, country="uae"):
+        """Append the distinct legs ((start_lat, start_lng, stop_lat, stop_lng)) of one solve."""
+        if not self.path:
+            return
+        legs = sorted({_rounded(leg) for leg in legs})
+        if not legs:
+            return
+        line = json.dumps({"at": time.time(), "country": country, "legs": legs})
+        with self._lock:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                with open(self.path, 'a') as file:
+                    file.write(line + "\n")
+            except OSError as e:
+                logging.warning(f"Could not record leg history to {self.path}: {e}")
+
+    def _files(self):
+        if not self.directory or not os.path.isdir(self.directory):
+            return []
+        return [entry.path for entry in os.scandir(self.directory) if entry.name.endswith(".jsonl")]
+
+    def _entries(self, since, paths=None):
+        for path in paths if paths is not None else self._files():
+            try:
+                with open(path, 'r') as file:
+                    lines = file.readlines()
+            except OSError:
+                # Deleted by another container's compaction
+                continue
+            for line in lines:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get("at", 0) >= since:
+                    yield entry
+
+    def frequent_legs(self, min_count=1, limit=None) -> list:
+        """[((start_lat, start_lng, stop_lat, stop_lng, country), solves)] most frequent first."""
+        since = time.time() - ETA_LEG_HISTORY_DAYS * 24 * 3600
+        counts = Counter()
+        with self._lock:
+            for entry in self._entries(since):
+                country = entry.get("country", "uae")
+                counts.update((*leg, country) for leg in entry["legs"])
+        return [(leg, count) for leg, count in counts.most_common(limit) if count >= min_count]
+
+    def compact(self):
+        """
+        Delete the files of containers that recorded nothing in ETA_LEG_HISTORY_DAYS and drop
+        the old solves of this container's file once it is over ETA_LEG_HISTORY_MAX_BYTES.
+        """
+        since = time.time() - ETA_LEG_HISTORY_DAYS * 24 * 3600
+        for path in self._files():
+            try:
+                if path != self.path and os.path.getmtime(path) < since:
+                    os.remove(path)
+            except OSError:
+                pass
+        if not self.path or not os.path.exists(self.path) or os.path.getsize(self.path) <= ETA_LEG_HISTORY_MAX_BYTES:
+            return
+        with self._lock:
+            lines = [json.dumps(entry) for entry in self._entries(since, [self.path])]
+            # Still too large, keep the most recent half
+            while len(lines) > 1 and sum(len(line) + 1 for line in lines) > ETA_LEG_HISTORY_MAX_BYTES:
+                lines = lines[len(lines) // 2:]
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as file:
+                file.writelines(line + "\n" for line in lines)
+            os.replace(tmp_path, self.path)
+
+
+@lru_cache(maxsize=None)
+def get_leg_history() -> LegHistory:
+    return LegHistory()
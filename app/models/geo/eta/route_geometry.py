@@ -0,0 +1,131 @@
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+import zlib
+
+from app.models.geo.eta.eta_cache import get_eta_cache, leg_cache_key, ETA_CACHE
+from app.models.geo.eta.eta_client import get_eta_client, chunk_route_legs, BatchUnsupported
+from app.models.geo.geo_math import estimated_leg
+
+# Signs geometry tokens, must be the same on every instance that serves /api/v1/geometry.
+# Lazy geometry is unavailable without it: a per-process secret would only verify on the
+# instance that issued the token, and the next request usually lands on another one.
+GEOMETRY_TOKEN_SECRET = os.getenv("GEOMETRY_TOKEN_SECRET")
+GEOMETRY_TOKEN_TTL_SECONDS = float(os.getenv("GEOMETRY_TOKEN_TTL_SECONDS", str(24 * 3600)))
+
+
+class InvalidGeometryToken(Exception):
+    pass
+
+
+class GeometryTokensDisabled(Exception):
+    """GEOMETRY_TOKEN_SECRET is not set, no geometry token can be issued."""
+
+
+def tokens_enabled() -> bool:
+    return bool(GEOMETRY_TOKEN_SECRET)
+
+
+def _signature(body: bytes) -> str:
+    digest = hmac.new(GEOMETRY_TOKEN_SECRET.encode("utf-8"), body, hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:18]).decode("ascii")
+
+
+def geometry_token(points, country="uae") -> str:
+    """
+    Signed, self-contained token for the geometry of one route: the route's stops as
+    (lat, lng) in driving order. No server state, any instance with the same secret can
+    resolve it until it expires.
+    """
+    if not tokens_enabled():
+        raise GeometryTokensDisabled("GEOMETRY_TOKEN_SECRET is not set")
+    payload = {"c": country, "p": [[float(lat), float(lng)] for lat, lng in points],
+               "e": int(time.time() + GEOMETRY_TOKEN_TTL_SECONDS)}
+    body = base64.urlsafe_b64encode(zlib.compress(json.dumps(payload, separators=(",", ":")).encode("utf-8")))
+    return f"{body.decode('ascii')}.{_signature(body)}"
+
+
+def read_geometry_token(token: str):
+    """(points, country) of a token, InvalidGeometryToken when it is forged, damaged or expired."""
+    if not tokens_enabled():
+        raise InvalidGeometryToken("geometry tokens are disabled")
+    body, _, signature = token.partition(".")
+    if not body or not hmac.compare_digest(_signature(body.encode("ascii")), signature):
+        raise InvalidGeometryToken("bad signature")
+    try:
+        payload = json.loads(zlib.decompress(base64.urlsafe_b64decode(body.encode("ascii"))))
+    except (ValueError, zlib.error):
+        raise InvalidGeometryToken("malformed")
+    if payload.get("e", 0) < time.time():
+        raise InvalidGeometryToken("expired")
+    return [tuple(point) for point in payload["p"]], payload["c"]
+
+
+def route_geometry(points, country="uae", executor=None, timeout=None) -> dict:
+    """
+    Directions of every leg between consecutive distinct stops of a route, from the ETA
+    cache when possible. Legs that cannot be fetched get a straight-line estimate.
+    `from`/`to` are stop indexes, the legs splice between the route's steps.
+    """
+    cache = get_eta_cache() if ETA_CACHE else None
+    legs = [(index, index + 1, (*points[index], *points[index + 1]))
+            for index in range(len(points) - 1) if points[index] != points[index + 1]]
+
+    responses = {}
+    for _, _, leg in legs:
+        response = cache.get(leg_cache_key(*leg, country)) if cache is not None else None
+        if response is not None:
+            responses[leg] = response
+
+    missing = [leg for _, _, leg in legs if leg not in responses]
+    fetched = _fetch(missing, country, executor, timeout)
+    for leg, response in fetched.items():
+        responses[leg] = response
+        if cache is not None:
+            cache.set(leg_cache_key(*leg, country), response)
+
+    result = []
+    degraded = 0
+    for start, stop, leg in legs:
+        response = responses.get(leg)
+        if response is None:
+            response = estimated_leg(*leg)
+            degraded += 1
+        directions_data = response.get('directions_data', [])
+        if isinstance(directions_data, str):
+            directions_data = json.loads(directions_data)
+        result.append({"from": start, "to": stop, "directions_data": directions_data})
+    return {"legs": result, "degraded_legs": degraded}
+
+
+def _fetch(legs, country, executor, timeout) -> dict:
+    # One route request per chunk of consecutive legs, per-leg calls when the service has no routes
+    if not legs:
+        return {}
+    client = get_eta_client()
+    fetched = {}
+    failed = []
+    for waypoints in chunk_route_legs(legs):
+        chunk = [(*waypoints[k], *waypoints[k + 1]) for k in range(len(waypoints) - 1)]
+        try:
+            fetched.update(zip(chunk, client.route(waypoints, country, timeout=timeout)))
+        except BatchUnsupported:
+            failed.extend(chunk)
+        except Exception as exc:
+            logging.warning(f"ETA route request failed, retrying per leg: {exc}")
+            failed.extend(chunk)
+
+    def fetch_leg(leg):
+        try:
+            return leg, client.leg(*leg, country, timeout=timeout)
+        except Exception as exc:
+            logging.warning(f"ETA call failed for leg {leg}: {exc}")
+            return leg, None
+
+    outcomes = executor.map(fetch_leg, failed) if executor is not None else map(fetch_leg, failed)
+    fetched.update((leg, response) for leg, response in outcomes if response is not None)
+    return fetched
@@ -0,0 +1,63 @@
+import math
+import os
+
+EARTH_RADIUS_METERS = 6371008.8
+# Average road speed assumed for estimated legs
+FALLBACK_SPEED_KMH = float(os.getenv("ETA_FALLBACK_SPEED_KMH", "40"))
+# Roads are longer than the great circle, rough urban detour factor
+DETOUR_FACTOR = 1.3
+
+
+def haversine_meters(start_lat, start_lng, stop_lat, stop_lng) -> float:
+    lat1, lng1, lat2, lng2 = map(math.radians, (start_lat, start_lng, stop_lat, stop_lng))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_METERS * math.asin(math.sqrt(a))
+
+
+def estimated_leg(start_lat, start_lng, stop_lat, stop_lng) -> dict:
+    """
+    Straight-line stand-in for an ETA response, used when the real directions did not
+    arrive in time. Shaped like an ETA response and marked `degraded`.
+    """
+    distance = haversine_meters(start_lat, start_lng, stop_lat, stop_lng) * DETOUR_FACTOR
+    return {
+        'directions_data': [
+            {'lat': start_lat, 'lng': start_lng, 'degraded': True},
+            {'lat': stop_lat, 'lng': stop_lng, 'degraded': True},
+        ],
+        'distance_meters': round(distance),
+        'duration_seconds': round(distance / (FALLBACK_SPEED_KMH / 3.6)),
+        'degraded': True,
+    }
+
+
+def _number(value, unit=""):
+    # ETA services answer with numbers or protobuf-style strings ("123s")
+    try:
+        return float(value.rstrip(unit) if isinstance(value, str) and unit else value)
+    except (TypeError, ValueError):
+        return None
+
+
+def leg_metrics(response, start_lat, start_lng, stop_lat, stop_lng) -> tuple:
+    """
+    (duration seconds, distance meters) of an ETA response. Uses the duration/distance the
+    service returned when present. Otherwise the distance is the length of the returned
+    geometry (straight line with detour without one), driven at FALLBACK_SPEED_KMH.
+    """
+    duration = next((_number(response[key], "s") for key in ('duration_seconds', 'duration', 'eta')
+                     if key in response), None)
+    distance = next((_number(response[key]) for key in ('distance_meters', 'distance') if key in response), None)
+
+    if distance is None:
+        points = response.get('directions_data') or []
+        if isinstance(points, list) and len(points) > 1:
+            coordinates = [(float(point.get('lat', point.get('latitude'))),
+                            float(point.get('lng', point.get('longitude')))) for point in points]
+            distance = sum(haversine_meters(*start, *stop) for start, stop in zip(coordinates, coordinates[1:]))
+        else:
+            distance = haversine_meters(start_lat, start_lng, stop_lat, stop_lng) * DETOUR_FACTOR
+    if duration is None:
+        duration = distance / (FALLBACK_SPEED_KMH / 3.6)
+    return duration, distance
@@ -3,28 +3,132 @@ import logging
 import os
 import time
 
-import requests
 from datetime import datetime, timedelta, date
 
-from google.cloud import optimization_v1
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
 
 from functools import lru_cache
 
+from app.models.geo.eta.eta_client import get_eta_client, chunk_route_legs, chain_legs, BatchUnsupported, \
+    ETA_CALL_TIMEOUT_SECONDS
+from app.models.geo.eta.eta_cache import get_eta_cache, leg_cache_key, ETA_CACHE
+from app.models.geo.eta.leg_history import get_leg_history
+from app.models.geo.eta.route_geometry import geometry_token, tokens_enabled
+from app.models.geo.geo_math import estimated_leg, leg_metrics
 from app.models.geo.vrp.cfr.vehicle import Vehicle
 from app.models.geo.vrp.cfr.shipment import Shipment
+from app.models.geo.vrp.cfr.route_columns import RouteColumns
+from app.models.geo.vrp.cfr.location_table import LocationTable, LOCATION_TAG_PREFIX
+from app.models.geo.vrp.cfr.exclusive_customers import ExclusiveCustomerIndex
+from app.models.geo.vrp.cfr.consolidation import ShipmentConsolidation, SHIPMENT_CONSOLIDATION
+from app.services.v1.debug.profiler import profiled
+from app.services.v1.scheduling.deadline import DeadlineExceeded, MIN_SOLVER_SECONDS, ETA_RESERVE_SECONDS
+from app.services.v1.scheduling.solve_budget import get_tier, get_solve_budget_model
+
+
+# Solve with duration/distance matrices built from ETA legs instead of the solver's own routing
+ETA_MATRICES = os.getenv("ETA_MATRICES", "off") == "on"
+# Largest matrix (locations x stop locations) built, larger plans use the solver's routing. Rows
+# include every distinct vehicle start: a 300-shipment upload with ~110 generated vehicles and
+# ~150 stop locations is ~(110 + 150) x 150 = 39,000 legs, mostly served by the ETA cache
+ETA_MATRIX_MAX_LEGS = int(os.getenv("ETA_MATRIX_MAX_LEGS", "50000"))
+# Longest the matrix legs may take to fetch, legs still missing then are straight-line estimates
+ETA_MATRIX_MAX_SECONDS = float(os.getenv("ETA_MATRIX_MAX_SECONDS", "20"))
+# "full" maps every route with its polylines, "lazy" returns a geometry token per route instead
+GEOMETRY_MODE = os.getenv("GEOMETRY_MODE", "full")
+
+if GEOMETRY_MODE == "lazy" and not tokens_enabled():
+    # Every plan would carry tokens no other instance can verify
+    raise RuntimeError("GEOMETRY_MODE=lazy needs GEOMETRY_TOKEN_SECRET")
+
+
+@lru_cache(maxsize=None)
+def get_optimization_module():
+    # Imported on the first solve only, the gRPC stack dominates cold start time
+    from google.cloud import optimization_v1
+    return optimization_v1
+
+
+@lru_cache(maxsize=None)
+def get_fleet_routing_client():
+    # One client (and gRPC channel) per warm container
+    return get_optimization_module().FleetRoutingClient()
+
+
+@lru_cache(maxsize=None)
+def load_template(template_path):
+    # Templates are read once per warm container, callers must treat the result as read-only
+    with open(template_path, 'r') as file:
+        return json.load(file)
+
+
+# Fields the solver must not get when the model has duration matrices
+VISIT_LOCATION_FIELDS = ("arrivalLocation", "arrivalWaypoint")
+VEHICLE_LOCATION_FIELDS = ("startLocation", "startWaypoint", "endLocation", "endWaypoint")
+
+
+def drop_locations(shipment_payload, vehicle_payload):
+    """Remove the visit and vehicle locations of a model that travels by its duration matrices."""
+    for shipment in shipment_payload:
+        for visit in shipment.get('pickups', []) + shipment.get('deliveries', []):
+            for field in VISIT_LOCATION_FIELDS:
+                visit.pop(field, None)
+    for vehicle in vehicle_payload:
+        for field in VEHICLE_LOCATION_FIELDS:
+            vehicle.pop(field, None)
 
 
 class CFR:
 
-    def __init__(self, template_path, data):
+    def __init__(self, template_path, data, template_content=None, eta_executor=None, consolidate=None,
+                 deadline=None, tier=None, matrices=None, geometry=None, fleet=None):
         self.template_path = template_path
         self.data = data
+        # Generated Fleet of data['vehicles'] (optimize-file), the solver vehicles render from its columns
+        self.fleet = fleet
+        # Already loaded template (e.g. from the tenant registry), read from template_path otherwise
+        self.template_content = template_content
+        # Shared ETA pool (the scheduler's concurrency budget), a private pool is used when missing
+        self.eta_executor = eta_executor
+        # Deduplicated pickup/dropoff/vehicle locations, built on first use
+        self.location_table = None
+        # Merge identical records into one solver shipment (SHIPMENT_CONSOLIDATION by default)
+        self.consolidate = SHIPMENT_CONSOLIDATION if consolidate is None else consolidate
+        self.consolidation = None
+        # Request deadline, the solver and the ETA phase get what is left of it
+        self.deadline = deadline
+        # Latency tier (interactive / standard / overnight), sets the solver timeout and search mode
+        self.tier = get_tier(tier)
+        # Build the duration/distance matrices from ETA legs before solving (ETA_MATRICES by default)
+        self.matrices = ETA_MATRICES if matrices is None else matrices
+        # Whether the matrices were built or why not, returned as X-Eta-Matrices
+        self.matrix_status = None
+        # (sources, destinations) of the matrices once their legs are fetched
+        self.matrix_locations = None
+        # ETA responses fetched or read from the cache by this request, keyed like direction_key
+        self.leg_responses = {}
+        # "lazy" maps stops only, each route gets a token to fetch its polylines later (GEOMETRY_MODE by default)
+        self.lazy_geometry = (geometry or GEOMETRY_MODE) == "lazy"
+        # Legs filled with straight-line estimates because their directions did not arrive
+        self.degraded_legs = 0
+        # Seconds spent per stage (payload, solve, directions, map), reported as Server-Timing
+        self.timings = {}
+        # Sampled traffic capture (see debug/capture.py), records the solver payload and response
+        self.capture = None
+        # False leaves the stop points in place of the geometry tokens, signed by the serving
+        # process when the mapping runs on the process pool (see cfr/offload.py)
+        self.sign_geometry = True
 
     def get_template_content(self):
-        with open(self.template_path, 'r') as file:
-            template_content = json.load(file)
-        return template_content
+        if self.template_content is not None:
+            return self.template_content
+        return load_template(self.template_path)
+
+    def get_location_table(self):
+        if self.location_table is None:
+            self.location_table = LocationTable.from_data(self.data)
+            logging.info(f"Location table: {len(self.location_table)} unique locations")
+        return self.location_table
 
     def extract_models(self):
         models = []
@@ -44,30 +148,42 @@ class CFR:
         # Return the model_payload
         return model_payload
 
+    def get_exclusive_index(self):
+        # Cached per distinct exclusive customer list, shared with the parser
+        return ExclusiveCustomerIndex.for_customers(self.data.get("exclusive_customers", []))
+
     def prepare_exclusive(self):
-        for record in self.data["records"]:
-            if record["exclusive"]:
-                record["shipment_type"] = record["customer"]
-            else:
-                record["shipment_type"] = "general"
+        records = self.data["records"]
+        shipment_types = self.get_exclusive_index().shipment_types(
+            [record["customer"] for record in records], [record["exclusive"] for record in records])
+        for record, shipment_type in zip(records, shipment_types):
+            record["shipment_type"] = shipment_type
 
     def create_incompatibilities(self):
-        types = ["general"] + [customer["customer"] for customer in self.data["exclusive_customers"]]
-        incompatibility_mode = "NOT_IN_SAME_VEHICLE_SIMULTANEOUSLY"
-
-        return {
-            "types": types,
-            "incompatibility_mode": incompatibility_mode
-        }
+        return self.get_exclusive_index().incompatibilities()
 
     def prepare_payload(self):
+        started = time.perf_counter()
+        if self.deadline is not None:
+            self.deadline.check("prepare_payload")
         self.prepare_exclusive()
+        # Tags records and vehicles with their location index before the templates are resolved
+        self.get_location_table()
         incompatibilities = self.create_incompatibilities()
 
         logging.info(incompatibilities)
 
+        # The solver sees the consolidated records, the mapping expands them back
+        solver_data = self.data
+        if self.consolidate:
+            self.consolidation = ShipmentConsolidation(self.data['records'], self.data.get('vehicles', []))
+            solver_data = {**self.data, 'records': self.consolidation.records}
+        if self.fleet is not None:
+            self.fleet.tag_locations(self.get_location_table())
+            solver_data = {**solver_data, 'vehicles': self.fleet}
+
         models = self.extract_models()
-        model_objects = self.create_model_objects(models, self.data, self.get_template_content())
+        model_objects = self.create_model_objects(models, solver_data, self.get_template_content())
 
         merged_payload = {}
 
@@ -119,6 +235,18 @@ class CFR:
         merged_payload["globalEndTime"] = end_time_iso
         merged_payload["shipmentTypeIncompatibilities"] = incompatibilities
 
+        if self.matrices:
+            # The solver plans with our ETA legs instead of its own routing
+            started_matrices = time.perf_counter()
+            matrices = self.create_duration_matrices(merged_payload.get("shipments", []),
+                                                     merged_payload.get("vehicles", []))
+            if matrices is not None:
+                merged_payload.update(matrices)
+                # The API rejects locations next to duration matrices, the tags place the visits
+                drop_locations(merged_payload.get("shipments", []), merged_payload.get("vehicles", []))
+            self.timings["matrices"] = time.perf_counter() - started_matrices
+
+        self.timings["payload"] = time.perf_counter() - started - self.timings.get("matrices", 0)
         # Wrap the merged payload within a 'model' object
         return self.model_parse(merged_payload)
 
@@ -160,31 +288,103 @@ class CFR:
 
     def callCFR(self, cfr_payload: dict) -> dict:
         """Call the sync api for fleet routing."""
-        fleet_routing_client = optimization_v1.FleetRoutingClient()
+        optimized_response = self.solve(cfr_payload)
+
+        started = time.perf_counter()
+        # Map the optimization response
+        mapped_response = self.map_optimization_response(optimized_response, self.data)
+        # Directions are fetched during the mapping, "map" is the rest of it
+        self.timings["map"] = time.perf_counter() - started - self.timings.get("directions", 0)
+
+        return mapped_response
+
+    def solve(self, cfr_payload, counts=None) -> dict:
+        """
+        Send the payload to Fleet Routing, returns the optimization response as a dict.
+        `cfr_payload` may come already serialized (a JSON string, with its (shipments,
+        vehicles) `counts`) from an offloaded stage, it is then never parsed here.
+        """
+        optimization_v1 = get_optimization_module()
+        fleet_routing_client = get_fleet_routing_client()
+        serialized = isinstance(cfr_payload, str)
+
+        if self.capture is not None:
+            self.capture.record_payload(json.loads(cfr_payload) if serialized else cfr_payload)
+
+        # Solver time from the plan size and the tier, within what is left of the request deadline
+
+        if serialized:
+            shipment_count, vehicle_count = counts
+        else:
+            model = cfr_payload.get("model", {})
+            shipment_count = len(model.get("shipments", []))
+            vehicle_count = len(model.get("vehicles", []))
+        budget_model = get_solve_budget_model()
+        solver_timeout = budget_model.plan(self.tier, shipment_count, vehicle_count)
+        if self.deadline is not None:
+            # Keeping time back for directions
+            solver_timeout = self.deadline.solver_budget(cap=solver_timeout)
+        # The solver returns its best solution by the payload timeout (earlier with RETURN_FAST)
+        options = {"timeout": f"{solver_timeout:.3f}s", "searchMode": self.tier.search_mode}
+        logging.info(f"Solving {shipment_count} shipments / {vehicle_count} vehicles in tier {self.tier.name}: "
+                     f"timeout {solver_timeout:.1f}s, {self.tier.search_mode}")
 
         # Convert the data dictionary to a JSON string
-        data_json = json.dumps(cfr_payload)
+        if serialized:
+            # The options are spliced into the serialized object, the payload has neither key
+            data_json = f"{json.dumps(options)[:-1]}, {cfr_payload.lstrip()[1:]}"
+        else:
+            data_json = json.dumps({**cfr_payload, **options})
 
         # Convert the JSON string to the OptimizeToursRequest object
         fleet_routing_request = optimization_v1.OptimizeToursRequest.from_json(data_json)
 
+        started = time.perf_counter()
         # Send the request and get the response.
         # Fleet Routing will return a response by the earliest of the `timeout`
         # field in the request payload and the gRPC timeout specified below.
-        response = fleet_routing_client.optimize_tours(request=fleet_routing_request, timeout=100)
+        response = fleet_routing_client.optimize_tours(request=fleet_routing_request,
+                                                       timeout=self.grpc_timeout(solver_timeout))
         # Convert response to JSON format.
         response_json = optimization_v1.OptimizeToursResponse.to_json(response)
         optimized_response = json.loads(response_json)
-        # Map the optimization response
-        mapped_response = self.map_optimization_response(optimized_response, self.data)
-
-
-        return mapped_response
-
-    def map_optimization_response(self, response: dict, data) -> dict[str, list[dict]]:
-
-        prepared_directions = self.prepare_directions(response, data)
+        self.timings["solve"] = time.perf_counter() - started
+        if self.capture is not None:
+            self.capture.record_response(optimized_response)
+        # Every solve feeds the budget model
+        objective = optimized_response.get("metrics", {}).get("totalCost", optimized_response.get("totalCost"))
+        budget_model.record(self.tier.name, shipment_count, vehicle_count, solver_timeout, self.timings["solve"],
+                            objective)
+        return optimized_response
+
+    def grpc_timeout(self, solver_timeout):
+        # A little longer than the solve itself so the response still makes it back
+        if self.deadline is None:
+            return solver_timeout
+        return max(solver_timeout, min(solver_timeout + 5, self.deadline.remaining()))
+
+    def eta_timeout(self):
+        if self.deadline is None:
+            return ETA_CALL_TIMEOUT_SECONDS
+        return max(0.1, min(ETA_CALL_TIMEOUT_SECONDS, self.deadline.remaining()))
+
+    def eta_wait_timeout(self):
+        # How long to wait for outstanding ETA calls, None waits for all of them
+        return self.deadline.remaining() if self.deadline is not None else None
+
+    def map_optimization_response(self, response: dict, data, directions=None) -> dict[str, list[dict]]:
+        """`directions` are the already fetched legs (see prepare_directions), fetched here when missing."""
+
+        prepared_directions = {}
+        if not self.lazy_geometry:
+            started = time.perf_counter()
+            if directions is None:
+                directions = self.prepare_directions(response, data)
+            prepared_directions = self.index_directions(directions)
+            self.timings["directions"] = time.perf_counter() - started
         result = {}
+        # Legs of the geometry tokens, lazy mode never plans directions
+        lazy_legs = set()
 
         # Create dictionaries to map order names to pickup/dropoff locations and vehicle labels to initial locations
         order_locations = {
@@ -208,15 +408,25 @@ class CFR:
 
         totalMetrics = response.get('metrics', [])
 
+        # Solver counts merged shipments once, clients count the original records
+        assigned_extra = 0
+        skipped_extra = 0
+        if self.consolidation is not None:
+            assigned_extra = self.consolidation.extra_shipments(
+                visit.get('shipmentLabel') for route in response.get('routes', [])
+                for visit in route.get('visits', []) if visit.get('isPickup', False))
+            skipped_extra = self.consolidation.extra_shipments(
+                skipped.get('label') for skipped in response.get('skippedShipments', []))
+
         totalMetrics = {
-            "number_of_assigned_shipments": totalMetrics['aggregatedRouteMetrics']['performedShipmentCount'],
+            "number_of_assigned_shipments": totalMetrics['aggregatedRouteMetrics']['performedShipmentCount'] + assigned_extra,
             "total_travel_duration": int(totalMetrics['aggregatedRouteMetrics']['travelDuration'][:-1]),
             "total_wait_duration": int(totalMetrics['aggregatedRouteMetrics']['waitDuration'][:-1]),
             "total_load_duration": int(totalMetrics['aggregatedRouteMetrics']['visitDuration'][:-1]),
             "total_duration": int(totalMetrics['aggregatedRouteMetrics']['totalDuration'][:-1]),
             "total_distance": totalMetrics['aggregatedRouteMetrics']['travelDistanceMeters'],
             "total_used_vehicles": totalMetrics['usedVehicleCount'],
-            "total_skipped_shipments": totalMetrics['skippedMandatoryShipmentCount'],
+            "total_skipped_shipments": totalMetrics['skippedMandatoryShipmentCount'] + skipped_extra,
             "earliest_vehicle_start_time": totalMetrics['earliestVehicleStartTime'],
             "latest_vehicle_end_time": totalMetrics['latestVehicleEndTime'],
         }
@@ -225,22 +435,13 @@ class CFR:
             vehicle_label = route['vehicleLabel']
             visits = route.get('visits', [])
             metricsPerVeh = route.get('metrics', [])
-            transitions = route.get('transitions', [])
-
-            if transitions:  # Check if transitions is not empty
-                # prepare first transition
-                transitions[0]["travelDuration"] = "0s"
-                transitions[0]["travelDistanceMeters"] = 0
-                transitions[0]["waitDuration"] = "0s"
-                transitions[0]["totalDuration"] = "0s"
-                transitions[0]["startTime"] = visits[0]['startTime']
-
-            for i, visit in enumerate(visits):
-                visit['id'] = i
 
             if not visits:
                 continue
 
+            # Visits and transitions as arrays, arrival times are computed in one vectorized pass
+            route_columns = RouteColumns(route)
+
             steps = []
 
             # Add the driver's initial location as the first step
@@ -248,51 +449,19 @@ class CFR:
             if initial_location:
                 steps.append({'action_type': 'start', 'lat': initial_location['lat'], 'lng': initial_location['lng']})
 
-            # Process each visit
-            for visit in visits:
-                action_type = 'pickup' if visit.get('isPickup', True) else 'dropoff'
-                order_name = visit.get('shipmentLabel', '')
-
-                # add any attribute from data
-                location = order_locations.get(order_name, {}).get(action_type)
-                customer = order_locations.get(order_name, {}).get("customer")
-                exclusive = order_locations.get(order_name, {}).get("exclusive")
-                check_in_time = order_locations.get(order_name, {}).get("check_in_time")
-
-                transition_start_time = datetime.strptime(transitions[visit.get("id")]["startTime"],
-                                                          "%Y-%m-%dT%H:%M:%SZ")
-
-                # Extract travel duration in seconds and convert to int
-                travel_duration_seconds = int(
-                    transitions[visit.get("id")]["travelDuration"][:-1])  # remove the "s" suffix
-
-                # Add travel duration to start time
-                arrival_time = transition_start_time + timedelta(seconds=travel_duration_seconds)
-
-                # Convert arrival time back to string in the same format
-                arrival_time = arrival_time.strftime("%Y-%m-%dT%H:%M:%SZ")
-
-                if location:
-                    steps.append({
-                        'action_type': action_type,
-                        'arrival_time': arrival_time,
-                        'waiting_duration': int(transitions[visit.get("id")]["waitDuration"][:-1]),
-                        'checkin_time': visit.get('startTime', ''),
-                        'checkin_duration': int(check_in_time),
-                        'departure_time': transitions[visit.get("id") + 1]["startTime"],
-                        'load': int(visit.get('demands', [{"value": ""}])[0].get('value', '')),
-                        'order_name': order_name,
-                        'lat': location['lat'],
-                        'lng': location['lng'],
-                        'customer': customer,
-                        'exclusive': exclusive,
-                        'distance': transitions[visit.get("id")]["travelDistanceMeters"],
-                    })
+            # Per-step dicts are only built here, at serialization time
+            visit_steps = route_columns.steps(order_locations)
+            shipment_count = metricsPerVeh['performedShipmentCount']
+            if self.consolidation is not None:
+                shipment_count += self.consolidation.extra_shipments(
+                    step['order_name'] for step in visit_steps if step['action_type'] == 'pickup')
+                visit_steps = self.consolidation.expand_steps(visit_steps)
+            steps.extend(visit_steps)
 
             result[vehicle_label] = {
                 'start_time': route['vehicleStartTime'],
                 'end_time': route['vehicleEndTime'],
-                'number_of_shipments': metricsPerVeh['performedShipmentCount'],
+                'number_of_shipments': shipment_count,
                 'travel_duration': int(metricsPerVeh['travelDuration'][:-1]),
                 'wait_duration': int(metricsPerVeh['waitDuration'][:-1]),
                 'load_duration': int(metricsPerVeh['visitDuration'][:-1]),
@@ -301,8 +470,22 @@ class CFR:
                 'steps': steps
             }
 
+            if self.lazy_geometry:
+                # Stops only, the polylines are fetched with the geometry token when the route is opened
+                pickup_index = next(
+                    (index for index, item in enumerate(steps) if item.get('action_type') == 'pickup'), None)
+                if pickup_index is not None:
+                    steps = steps[pickup_index:]
+                result[vehicle_label]['steps'] = steps
+                points = [(float(step['lat']), float(step['lng'])) for step in steps]
+                result[vehicle_label]['geometry_token'] = geometry_token(points) if self.sign_geometry else points
+                # Fetched when the route is opened, the warmer should have them cached
+                lazy_legs.update((*start, *stop) for start, stop in zip(points, points[1:]) if start != stop)
+                continue
+
             # Complete the loop by logging latitude and longitude for each step
             ordered_array = []
+            route_degraded_legs = 0
             for i in range(len(steps)):
                 if i < len(steps) - 1:
                     start_step = steps[i]
@@ -321,6 +504,9 @@ class CFR:
 
                     eta_response = self.find_direction(start_lat, start_lon, stop_lat, stop_lon, prepared_directions)
 
+                    if eta_response.get('degraded'):
+                        route_degraded_legs += 1
+
                     # Check if eta_response contains the expected key
                     if 'directions_data' in eta_response:
                         # Extract directions_data
@@ -357,10 +543,21 @@ class CFR:
                 ordered_array = ordered_array[pickup_index:]
 
             result[vehicle_label]['steps'] = ordered_array
+            if route_degraded_legs:
+                # Some legs are straight-line estimates, the directions did not arrive in time
+                result[vehicle_label]['degraded_legs'] = route_degraded_legs
 
+        if self.lazy_geometry and self.sign_geometry:
+            # Unsigned tokens are recorded by the process that signs them
+            self.record_leg_history(lazy_legs, data)
         return result
 
     def prepare_directions(self, response: dict, data):
+        eta_calls, route_legs = self.plan_directions(response, data)
+        return self.fetch_legs(eta_calls, route_legs)
+
+    def plan_directions(self, response: dict, data):
+        """The distinct legs the routes drive, and each route's new legs in driving order."""
 
         # Mapping
         order_locations = {record['label']: {'pickup': record['pickup'], 'dropoff': record['dropoff']}
@@ -368,7 +565,12 @@ class CFR:
         vehicle_locations = {vehicle['label']: {'lat': vehicle['lat'], 'lng': vehicle['lng']}
                              for vehicle in data.get('vehicles', [])}
 
-        eta_calls = []
+        location_table = self.get_location_table()
+        # One ETA call per distinct (location, location) leg, shared by every route that drives it
+        eta_calls = {}
+        leg_count = 0
+        # New legs of each route in driving order, batched into route requests
+        route_legs = []
 
         for route in response.get('routes', []):
             vehicle_label = route['vehicleLabel']
@@ -401,6 +603,7 @@ class CFR:
                     })
 
             # Schedule ETA API calls in threads
+            legs = []
             for i in range(len(steps) - 1):
                 start_step = steps[i]
                 stop_step = steps[i + 1]
@@ -411,34 +614,278 @@ class CFR:
                 country = "uae"
 
                 if (start_lat, start_lon) != (stop_lat, stop_lon):
-                    eta_calls.append((start_lat, start_lon, stop_lat, stop_lon, country))
+                    leg_count += 1
+                    leg = location_table.leg(start_lat, start_lon, stop_lat, stop_lon)
+                    if leg is None:
+                        leg = (start_lat, start_lon, stop_lat, stop_lon)
+                    if leg not in eta_calls:
+                        eta_calls[leg] = (start_lat, start_lon, stop_lat, stop_lon, country)
+                        legs.append((start_lat, start_lon, stop_lat, stop_lon))
+            route_legs.append(legs)
+
+        logging.info(f"ETA legs: {len(eta_calls)} unique of {leg_count}")
+        self.record_leg_history([call[:4] for call in eta_calls.values()], data)
+        return list(eta_calls.values()), route_legs
+
+    def record_leg_history(self, driven_legs, data):
+        # Remembered for the ETA cache warmer: the depot -> customer leg of every record and the driven legs
+        get_leg_history().record(list(driven_legs) + [
+            (record['pickup']['lat'], record['pickup']['lng'], record['dropoff']['lat'], record['dropoff']['lng'])
+            for record in data.get('records', [])])
+
+    def fetch_legs(self, eta_calls, route_legs=None):
+        """
+        Directions of every leg in `eta_calls`: legs already fetched by this request (e.g.
+        for the matrices) and cached legs are reused, the rest is fetched in parallel and
+        cached. `route_legs` gives the driving order for route requests, without it the
+        missing legs are chained into routes.
+        """
+        all_responses, missing = self.cached_directions(eta_calls)
+        logging.info(f"ETA legs: {len(all_responses)} cached, {len(missing)} to fetch")
+        if not missing:
+            return all_responses
+
+        if route_legs is None:
+            route_legs = chain_legs([call[:4] for call in missing])
+        elif len(missing) < len(eta_calls):
+            missing_keys = {self.direction_key(*call[:4]) for call in missing}
+            route_legs = [[leg for leg in legs if self.direction_key(*leg) in missing_keys] for legs in route_legs]
 
         # Execute all ETA API calls in parallel
-        all_responses = []
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            future_to_eta = {
-                executor.submit(self.call_eta_api, start_lat, start_lon, stop_lat, stop_lon, country): (
-                    start_lat, start_lon, stop_lat, stop_lon)
-                for start_lat, start_lon, stop_lat, stop_lon, country in eta_calls
-            }
-
-            for future in as_completed(future_to_eta):
-                start_lat, start_lon, stop_lat, stop_lon = future_to_eta[future]
-                try:
-                    response = future.result()
-                    all_responses.append({
+        if self.eta_executor is not None:
+            fetched = self.fetch_directions(self.eta_executor, missing, route_legs)
+        else:
+            executor = ThreadPoolExecutor(max_workers=10)
+            try:
+                fetched = self.fetch_directions(executor, missing, route_legs)
+            finally:
+                # Do not wait for stalled calls past the deadline, their results are not used
+                executor.shutdown(wait=self.deadline is None, cancel_futures=True)
+
+        fetched = self.fill_missing_directions(missing, fetched)
+        self.store_directions(fetched)
+        return all_responses + fetched
+
+    def cached_directions(self, eta_calls):
+        """(directions found in this request or the ETA cache, calls still to fetch)."""
+        cache = get_eta_cache() if ETA_CACHE else None
+        found = []
+        missing = []
+        for start_lat, start_lon, stop_lat, stop_lon, country in eta_calls:
+            key = self.direction_key(start_lat, start_lon, stop_lat, stop_lon)
+            direction = self.leg_responses.get(key)
+            if direction is None and cache is not None:
+                response = cache.get(leg_cache_key(start_lat, start_lon, stop_lat, stop_lon, country))
+                if response is not None:
+                    direction = self.leg_responses[key] = {
                         "start_lat": start_lat,
                         "end_lat": stop_lat,
                         "start_lng": start_lon,
                         "end_lng": stop_lon,
                         "response": response
-                    })
-                except Exception as exc:
-                    print(f'API call generated an exception: {exc}')
+                    }
+            if direction is None:
+                missing.append((start_lat, start_lon, stop_lat, stop_lon, country))
+            else:
+                found.append(direction)
+        return found, missing
+
+    def store_directions(self, directions, country="uae"):
+        cache = get_eta_cache() if ETA_CACHE else None
+        for direction in directions:
+            self.leg_responses[self.direction_key(direction["start_lat"], direction["start_lng"],
+                                                  direction["end_lat"], direction["end_lng"])] = direction
+            # Straight-line estimates are only good for this request
+            if cache is not None and not direction["response"].get('degraded'):
+                cache.set(leg_cache_key(direction["start_lat"], direction["start_lng"],
+                                        direction["end_lat"], direction["end_lng"], country), direction["response"])
+
+    def fetch_matrix_legs(self) -> bool:
+        """
+        Fetch the legs of the duration matrices into `leg_responses` under their own
+        budget and set `matrix_locations`. False when the matrix would be too large.
+        """
+        location_table = self.get_location_table()
+        sources = list(range(len(location_table)))
+        destinations = sorted({int(record[field][len(LOCATION_TAG_PREFIX):]) for record in self.data['records']
+                               for field in ('pickup_location', 'dropoff_location')})
+        size = f"{len(sources)}x{len(destinations)}"
+        if len(sources) * len(destinations) > ETA_MATRIX_MAX_LEGS:
+            logging.warning(f"Duration matrix of {size} locations is over ETA_MATRIX_MAX_LEGS, "
+                            f"the solver computes its own travel times")
+            self.matrix_status = f"skipped; {size} over ETA_MATRIX_MAX_LEGS"
+            return False
+
+        points = location_table.points
+        eta_calls = [(*points[source], *points[destination], "uae")
+                     for source in sources for destination in destinations if source != destination]
+        request_deadline = self.deadline
+        if request_deadline is not None:
+            # The legs get their own budget, the solver and the directions keep theirs
+            self.deadline = request_deadline.stage(cap=ETA_MATRIX_MAX_SECONDS,
+                                                   reserve=MIN_SOLVER_SECONDS + ETA_RESERVE_SECONDS)
+        degraded_before = self.degraded_legs
+        try:
+            self.fetch_legs(eta_calls)
+        finally:
+            self.deadline = request_deadline
+        estimated = self.degraded_legs - degraded_before
+        self.matrix_status = f"built; {size}" + (f", {estimated} legs estimated" if estimated else "")
+        self.matrix_locations = (sources, destinations)
+        return True
+
+    def create_duration_matrices(self, shipment_payload, vehicle_payload):
+        """
+        Duration/distance matrix over the location table, from cached or freshly fetched ETA
+        legs, so the solver plans with the same travel times the plan is mapped with. Rows
+        are every location (vehicles start anywhere), columns the pickup/dropoff locations.
+        None when the template has no location tags or the matrix would be too large.
+        """
+        tagged = (all(visit.get('tags') for shipment in shipment_payload
+                      for visit in shipment.get('pickups', []) + shipment.get('deliveries', []))
+                  and all(vehicle.get('startTags') for vehicle in vehicle_payload))
+        if not tagged:
+            logging.warning("Template has no location tags, the solver computes its own travel times")
+            self.matrix_status = "skipped; no location tags"
+            return None
+
+        # Already fetched by the serving process when the payload is built on the process pool
+        if self.matrix_locations is None and not self.fetch_matrix_legs():
+            return None
+        sources, destinations = self.matrix_locations
+        location_table = self.get_location_table()
+        points = location_table.points
+        directions = self.index_directions(self.leg_responses.values())
+
+        rows = []
+        for source in sources:
+            durations = []
+            meters = []
+            for destination in destinations:
+                if source == destination:
+                    duration, distance = 0, 0
+                else:
+                    leg = (*points[source], *points[destination])
+                    duration, distance = leg_metrics(self.find_direction(*leg, directions), *leg)
+                durations.append(f"{round(duration)}s")
+                meters.append(round(distance))
+            rows.append({"durations": durations, "meters": meters})
 
+        return {
+            "durationDistanceMatrices": [{"rows": rows}],
+            "durationDistanceMatrixSrcTags": [location_table.tag(source) for source in sources],
+            "durationDistanceMatrixDstTags": [location_table.tag(destination) for destination in destinations],
+        }
+
+    def fill_missing_directions(self, eta_calls, all_responses):
+        # Legs that failed or ran out of time get a straight-line estimate, marked degraded
+        fetched = {self.direction_key(direction["start_lat"], direction["start_lng"],
+                                      direction["end_lat"], direction["end_lng"])
+                   for direction in all_responses}
+        for start_lat, start_lon, stop_lat, stop_lon, country in eta_calls:
+            if self.direction_key(start_lat, start_lon, stop_lat, stop_lon) in fetched:
+                continue
+            self.degraded_legs += 1
+            all_responses.append({
+                "start_lat": start_lat,
+                "end_lat": stop_lat,
+                "start_lng": start_lon,
+                "end_lng": stop_lon,
+                "response": estimated_leg(start_lat, start_lon, stop_lat, stop_lon)
+            })
+        if self.degraded_legs:
+            logging.warning(f"ETA degraded: {self.degraded_legs} of {len(eta_calls)} legs estimated")
         return all_responses
 
+    def fetch_directions(self, executor, eta_calls, route_legs):
+        # One request per chunk of a route when the ETA service supports it, one per leg otherwise
+        eta_client = get_eta_client()
+        if not eta_client.batch_supported:
+            return self.collect_eta_responses(executor, eta_calls)
+
+        chunks = [chunk for legs in route_legs for chunk in chunk_route_legs(legs)]
+        all_responses, failed_calls = self.collect_route_responses(executor, eta_client, chunks, "uae")
+        if failed_calls and not (self.deadline is not None and self.deadline.expired()):
+            all_responses.extend(self.collect_eta_responses(executor, failed_calls))
+        return all_responses
+
+    def collect_route_responses(self, executor, eta_client, chunks, country):
+        all_responses = []
+        failed_calls = []
+        future_to_chunk = {
+            executor.submit(profiled(eta_client.route), waypoints, country, self.eta_timeout()): waypoints
+            for waypoints in chunks
+        }
+
+        for future, waypoints in self.completed(future_to_chunk):
+            try:
+                responses = future.result()
+            except Exception as exc:
+                if not isinstance(exc, BatchUnsupported):
+                    logging.warning(f"ETA route request failed, retrying per leg: {exc}")
+                # Retried with per-leg calls once every chunk is back
+                failed_calls.extend((*waypoints[k], *waypoints[k + 1], country) for k in range(len(waypoints) - 1))
+                continue
+            for k, response in enumerate(responses):
+                all_responses.append({
+                    "start_lat": waypoints[k][0],
+                    "end_lat": waypoints[k + 1][0],
+                    "start_lng": waypoints[k][1],
+                    "end_lng": waypoints[k + 1][1],
+                    "response": response
+                })
+        return all_responses, failed_calls
+
+    def collect_eta_responses(self, executor, eta_calls):
+        all_responses = []
+        future_to_eta = {
+            executor.submit(profiled(self.call_eta_api), start_lat, start_lon, stop_lat, stop_lon, country): (
+                start_lat, start_lon, stop_lat, stop_lon)
+            for start_lat, start_lon, stop_lat, stop_lon, country in eta_calls
+        }
+
+        for future, (start_lat, start_lon, stop_lat, stop_lon) in self.completed(future_to_eta):
+            try:
+                response = future.result()
+                all_responses.append({
+                    "start_lat": start_lat,
+                    "end_lat": stop_lat,
+                    "start_lng": start_lon,
+                    "end_lng": stop_lon,
+                    "response": response
+                })
+            except Exception as exc:
+                print(f'API call generated an exception: {exc}')
+        return all_responses
+
+    def direction_key(self, start_lat, start_lon, stop_lat, stop_lon):
+        # (location index, location index), raw coordinates for points outside the table
+        leg = self.get_location_table().leg(start_lat, start_lon, stop_lat, stop_lon)
+        return leg if leg is not None else (start_lat, start_lon, stop_lat, stop_lon)
+
+    def completed(self, futures):
+        """Yield (future, key) as calls finish, stop at the deadline and cancel the calls not started."""
+        try:
+            for future in as_completed(futures, timeout=self.eta_wait_timeout()):
+                yield future, futures[future]
+        except FuturesTimeoutError:
+            pending = [future for future in futures if not future.done()]
+            for future in pending:
+                future.cancel()
+            logging.warning(f"ETA deadline reached with {len(pending)} calls outstanding")
+
+    def index_directions(self, prepared_directions):
+        # Key the fetched legs by location indexes so each lookup is O(1) instead of a scan
+        indexed = {}
+        for direction in prepared_directions:
+            key = self.direction_key(direction["start_lat"], direction["start_lng"],
+                                     direction["end_lat"], direction["end_lng"])
+            indexed.setdefault(key, direction["response"])
+        return indexed
+
     def find_direction(self, start_lat, start_lon, stop_lat, stop_lon, prepared_directions=[]):
+        if isinstance(prepared_directions, dict):
+            return prepared_directions.get(self.direction_key(start_lat, start_lon, stop_lat, stop_lon))
         # Iterate through each direction in prepared_directions
         for direction in prepared_directions:
             # Check if the start and stop coordinates match the current direction
@@ -452,23 +899,7 @@ class CFR:
         return None
 
     def call_eta_api(self, start_lat, start_lon, stop_lat, stop_lon, country):
-
-        endpoint = "ennv"
-        headers = {
-            'Accept': 'application/json',
-            'Content-Type': 'application/json',
-        }
-        query_params = {
-            'country': country,
-            'start_lon': start_lon,
-            'stop_lon': stop_lon,
-            'start_lat': start_lat,
-            'stop_lat': stop_lat,
-            'source': 'mobile',
-            'action': 'GetAll'
-        }
-        response = requests.get(endpoint, headers=headers, params=query_params)
-        return json.loads(response.text)
+        return get_eta_client().leg(start_lat, start_lon, stop_lat, stop_lon, country, timeout=self.eta_timeout())
 
     def match_vehicles_types(self, cfr_payload):
         updated_cfr_payload = json.loads(json.dumps(cfr_payload))  # Deep copy to avoid modifying original payload
@@ -0,0 +1,144 @@
+import json
+import re
+from functools import lru_cache
+
+PLACEHOLDER = re.compile(r'{{(.*?)}}')
+# A row without the field, its placeholder is left in place like the string resolver did
+MISSING = object()
+
+
+def to_number(value):
+    """Numeric-looking strings become int (whole values) or float, anything else is kept."""
+    try:
+        float_val = float(value)
+        if float_val.is_integer():
+            return int(float_val)
+        return float_val
+    except ValueError:
+        return value
+
+
+class RecordColumns:
+    """
+    Column view of a list of records, keyed by dotted path ("pickup.lat"). Only the
+    columns a template asks for are extracted, each once.
+    """
+
+    def __init__(self, records):
+        self.records = records
+        self._columns = {}
+
+    def __len__(self):
+        return len(self.records)
+
+    def get(self, path):
+        column = self._columns.get(path)
+        if column is None:
+            keys = path.split('.')
+            column = self._columns[path] = [_resolve(record, keys) for record in self.records]
+        return column
+
+
+def as_columns(data):
+    """A column source for `CompiledTemplate.render`: Fleet/RecordColumns as they are, records wrapped."""
+    return data if hasattr(data, 'get') else RecordColumns(data)
+
+
+def _resolve(record, keys):
+    value = record
+    for key in keys:
+        if not isinstance(value, dict) or key not in value:
+            return MISSING
+        value = value[key]
+    # The string resolver only substituted leaves, a nested dict is never substituted whole
+    return MISSING if isinstance(value, dict) else value
+
+
+class CompiledTemplate:
+    """
+    A payload template element (e.g. one shipment) compiled once into a tree of small
+    functions, one per node, called once per row.
+
+    Rendering reads whole columns instead of flattening every record into a dict, each
+    placeholder column is stringified and converted once, and no JSON dump/regex/load
+    happens per element. Output matches the string resolver Shipment/Vehicle used:
+    placeholders become `str(value)` and numeric-looking strings become numbers.
+    """
+
+    def __init__(self, element):
+        self.element = element
+        # One entry per placeholder: (kind, placeholder text or full string, field, fixed row)
+        self._variables = []
+        self._build = self._compile(element)
+
+    def render(self, columns, row_count: int) -> list:
+        """`columns` is a RecordColumns, a Fleet or any mapping of dotted path -> list of values."""
+        values = []
+        for kind, text, field, fixed_row in self._variables:
+            column = columns.get(field) if field is not None else None
+            if column is None:
+                column = [MISSING] * row_count
+            if fixed_row is not None:
+                value = column[fixed_row] if fixed_row < len(column) else MISSING
+                column = [value] * row_count
+            if kind == "value":
+                # The whole string was the placeholder, converted once per value
+                values.append([text if value is MISSING else to_number(str(value)) for value in column])
+            else:
+                values.append([text if value is MISSING else str(value) for value in column])
+        build = self._build
+        return [build(values, row) for row in range(row_count)]
+
+    def _variable(self, kind, text, placeholder) -> int:
+        field, fixed_row = self._lookup(placeholder)
+        self._variables.append((kind, text, field, fixed_row))
+        return len(self._variables) - 1
+
+    def _compile(self, node):
+        if isinstance(node, dict):
+            items = [(key, self._compile(value)) for key, value in node.items()]
+            return lambda values, row: {key: build(values, row) for key, build in items}
+        if isinstance(node, list):
+            builds = [self._compile(item) for item in node]
+            return lambda values, row: [build(values, row) for build in builds]
+        if not isinstance(node, str):
+            return lambda values, row: node
+
+        parts = PLACEHOLDER.split(node)
+        if len(parts) == 1:
+            # "NaN"/"Infinity" become floats like in the string resolver
+            constant = to_number(node)
+            return lambda values, row: constant
+        if len(parts) == 3 and parts[0] == "" and parts[2] == "":
+            index = self._variable("value", node, parts[1])
+            return lambda values, row: values[index][row]
+
+        # Literal text and placeholders alternate, placeholders sit at odd positions
+        pieces = [(False, part) if position % 2 == 0 else
+                  (True, self._variable("text", f"{{{{{part}}}}}", part))
+                  for position, part in enumerate(parts) if part or position % 2]
+        return lambda values, row: to_number("".join(values[piece][row] if is_variable else piece
+                                                     for is_variable, piece in pieces))
+
+    @staticmethod
+    def _lookup(placeholder):
+        # "records.*.pickup.lat" -> ("pickup.lat", None), "records.0.label" -> ("label", 0)
+        components = placeholder.split('.')
+        if len(components) < 3:
+            return None, None
+        index, field = components[1], '.'.join(components[2:])
+        if index == '*':
+            return field, None
+        if index.isdigit():
+            return field, int(index)
+        return None, None
+
+
+@lru_cache(maxsize=64)
+def _compile_json(element_json):
+    return CompiledTemplate(json.loads(element_json))
+
+
+def compile_template(element) -> CompiledTemplate:
+    # Templates come from the tenant registry, the compiled form is kept per distinct element
+    return _compile_json(json.dumps(element))
@@ -0,0 +1,121 @@
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+# Consolidate shipments unless the request says otherwise
+SHIPMENT_CONSOLIDATION = os.getenv("SHIPMENT_CONSOLIDATION", "0") in ("1", "true")
+
+
+def _number(value):
+    number = float(value or 0)
+    return int(number) if number.is_integer() else number
+
+
+def _parse_time(value):
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def _format_time(value):
+    return value.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def consolidation_key(record):
+    # Records that can be carried as one shipment: same stops, customer, vehicle type and window
+    return (
+        float(record['pickup']['lat']), float(record['pickup']['lng']),
+        float(record['dropoff']['lat']), float(record['dropoff']['lng']),
+        record.get('customer'),
+        record.get('required_vehicle_type'),
+        record.get('shipment_type'),
+        record['time_window']['from'], record['time_window']['to'],
+        record.get('check_in_time'),
+    )
+
+
+class ShipmentConsolidation:
+    """
+    Merge records with the same pickup, dropoff, customer, vehicle type and time window
+    into one solver shipment, as long as the summed capacity fits the largest vehicle of
+    that type. A merged shipment keeps the label of its first record and its visit lasts
+    the summed check-in time of its records, so the solver plans the same load duration
+    as for the separate records. `expand_steps` turns its visits back into one step per
+    original record, served one after the other.
+    """
+
+    def __init__(self, records, vehicles):
+        max_load = defaultdict(float)
+        for vehicle in vehicles:
+            max_load[vehicle['type']] = max(max_load[vehicle['type']], float(vehicle['capacity']))
+
+        # key -> list of bins, each bin is [load, records]
+        groups = defaultdict(list)
+        order = []
+        for record in records:
+            key = consolidation_key(record)
+            capacity = float(record.get('capacity') or 0)
+            limit = max_load.get(record.get('required_vehicle_type'), 0)
+            for bin_ in groups[key]:
+                if bin_[0] + capacity <= limit:
+                    bin_[0] += capacity
+                    bin_[1].append(record)
+                    break
+            else:
+                bin_ = [capacity, [record]]
+                groups[key].append(bin_)
+                order.append(bin_)
+
+        self.records = []
+        self.members = {}
+        for load, members in order:
+            first = members[0]
+            if len(members) == 1:
+                self.records.append(first)
+                continue
+            merged = dict(first)
+            merged['capacity'] = _number(load)
+            merged['check_in_time'] = _number(sum(float(member.get('check_in_time') or 0) for member in members))
+            self.records.append(merged)
+            self.members[first['label']] = members
+
+        logging.info(f"Shipment consolidation: {len(records)} records -> {len(self.records)} shipments")
+
+    def extra_shipments(self, labels) -> int:
+        """How many original records the given solver shipments stand for beyond one each."""
+        return sum(len(self.members[label]) - 1 for label in labels if label in self.members)
+
+    def expand_steps(self, steps) -> list:
+        """
+        Replace every visit of a merged shipment with one step per original record. The
+        records are checked in back to back within the merged visit: the first arrives
+        with the vehicle, the next ones start when the previous one is done.
+        """
+        expanded = []
+        for step in steps:
+            members = self.members.get(step.get('order_name'))
+            if not members:
+                expanded.append(step)
+                continue
+            visit_start = _parse_time(step['checkin_time'])
+            offset = 0
+            for index, record in enumerate(members):
+                duration = int(float(record.get('check_in_time') or 0))
+                checkin_time = _format_time(visit_start + timedelta(seconds=offset))
+                offset += duration
+                last = index == len(members) - 1
+                expanded.append({
+                    **step,
+                    'arrival_time': step['arrival_time'] if index == 0 else checkin_time,
+                    'waiting_duration': step['waiting_duration'] if index == 0 else 0,
+                    'checkin_time': checkin_time,
+                    'checkin_duration': duration,
+                    'departure_time': step['departure_time'] if last else _format_time(
+                        visit_start + timedelta(seconds=offset)),
+                    'order_name': record['label'],
+                    'load': int(float(record.get('capacity') or 0)),
+                    'customer': record.get('customer'),
+                    'exclusive': record.get('exclusive'),
+                    # The leg is driven once, by the first of the merged records
+                    'distance': step['distance'] if index == 0 else 0,
+                })
+        return expanded
@@ -0,0 +1,66 @@
+from functools import lru_cache
+
+GENERAL_SHIPMENT_TYPE = "general"
+INCOMPATIBILITY_MODE = "NOT_IN_SAME_VEHICLE_SIMULTANEOUSLY"
+
+
+def normalize_customers(customers):
+    """Customer names as a NumPy string array, stripped and lower-cased."""
+    import numpy as np
+    values = np.array(["" if customer is None else str(customer) for customer in customers], dtype=str)
+    if len(values) == 0:
+        return values
+    return np.char.lower(np.char.strip(values))
+
+
+class ExclusiveCustomerIndex:
+    """
+    Normalized set of exclusive customers, shared by the parser (exclusive flags) and
+    CFR (shipment types and incompatibilities). Lookups run as one `np.isin` over the
+    customer column, so they stay flat as the exclusive list grows.
+    """
+
+    def __init__(self, customer_keys):
+        # Keys are normalized and unique, in sheet order
+        import numpy as np
+        self.keys = np.array(customer_keys, dtype=str)
+        self.types = [GENERAL_SHIPMENT_TYPE] + list(customer_keys)
+        self._incompatibilities = {
+            "types": self.types,
+            "incompatibility_mode": INCOMPATIBILITY_MODE,
+        }
+
+    @classmethod
+    def for_customers(cls, exclusive_customers):
+        keys = normalize_customers(customer_info.get('customer') for customer_info in exclusive_customers or [])
+        return _index_for_keys(tuple(dict.fromkeys(key for key in keys.tolist() if key)))
+
+    def flags(self, customers):
+        """Boolean array, True where the customer is exclusive."""
+        import numpy as np
+        return np.isin(normalize_customers(customers), self.keys)
+
+    def apply(self, records) -> list:
+        """Set the `exclusive` flag of every record from its customer."""
+        flags = self.flags([record.get('customer') for record in records]).tolist()
+        for record, flag in zip(records, flags):
+            record['exclusive'] = flag
+        return records
+
+    def shipment_types(self, customers, exclusive) -> list:
+        """The customer's own type for exclusive records, "general" for the rest."""
+        import numpy as np
+        exclusive = np.asarray(exclusive, dtype=bool)
+        if len(exclusive) == 0:
+            return []
+        return np.where(exclusive, normalize_customers(customers), GENERAL_SHIPMENT_TYPE).tolist()
+
+    def incompatibilities(self) -> dict:
+        # Shared by every request with the same exclusive list, callers must treat it as read-only
+        return self._incompatibilities
+
+
+@lru_cache(maxsize=64)
+def _index_for_keys(customer_keys):
+    # Built once per distinct exclusive list, repeat uploads and solves of a tenant reuse it
+    return ExclusiveCustomerIndex(customer_keys)
@@ -0,0 +1,128 @@
+import hashlib
+
+from app.models.geo.vrp.cfr.fleet_sizing import size_fleet
+
+EARTH_RADIUS_KM = 6378.1
+REGULAR_COST = 1
+ON_DEMAND_COST = 1000
+COLUMNS = ("type", "capacity", "label", "display_name", "on_demand", "cost", "lat", "lng")
+
+
+def make_rng(seed=None):
+    # Deterministic mode passes the workbook hash, anything else gets fresh entropy
+    import numpy as np
+    if seed is None:
+        return np.random.default_rng()
+    return np.random.default_rng(int(hashlib.sha256(str(seed).encode("utf-8")).hexdigest(), 16))
+
+
+def nearby_points(lats, lngs, max_distance_in_meters, rng) -> tuple:
+    """Move every point a random distance (up to the maximum) in a random direction, all at once."""
+    import numpy as np
+    count = len(lats)
+    distance = rng.uniform(0, max_distance_in_meters, count) / 1000 / EARTH_RADIUS_KM
+    bearing = rng.uniform(0, 2 * np.pi, count)
+
+    lat1 = np.radians(lats)
+    lng1 = np.radians(lngs)
+    lat2 = np.arcsin(np.sin(lat1) * np.cos(distance) + np.cos(lat1) * np.sin(distance) * np.cos(bearing))
+    lng2 = lng1 + np.arctan2(np.sin(bearing) * np.sin(distance) * np.cos(lat1),
+                             np.cos(distance) - np.sin(lat1) * np.sin(lat2))
+    return np.degrees(lat2), np.degrees(lng2)
+
+
+def allocate(total: int, weights):
+    """Split `total` into integer counts proportional to `weights` (largest remainder)."""
+    import numpy as np
+    if total <= 0 or len(weights) == 0:
+        return np.zeros(len(weights), dtype=np.int64)
+    shares = weights / weights.sum() * total
+    counts = np.floor(shares).astype(np.int64)
+    remainder = total - counts.sum()
+    if remainder:
+        counts[np.argsort(-(shares - counts), kind="stable")[:remainder]] += 1
+    return counts
+
+
+class Fleet:
+    """
+    Generated vehicles as columns (one NumPy array per field). `to_records` gives the
+    list of vehicle dicts the parse endpoint returns, `get` serves the columns to the
+    compiled vehicle template (same interface as RecordColumns) so optimize-file builds
+    the solver vehicles without going through per-vehicle dicts.
+    """
+
+    def __init__(self, columns: dict):
+        self.columns = columns
+        self._lists = {}
+
+    def __len__(self):
+        return len(self.columns["label"])
+
+    def get(self, path):
+        column = self._lists.get(path)
+        if column is None and path in self.columns:
+            # Python values, stringified like the values of the vehicle dicts
+            column = self._lists[path] = self.columns[path].tolist()
+        return column
+
+    def tag_locations(self, location_table):
+        """`start_location` tag of every vehicle, like LocationTable.from_data gives the vehicle dicts."""
+        import numpy as np
+        tags = [location_table.tag(location_table.add(lat, lng))
+                for lat, lng in zip(self.columns["lat"].tolist(), self.columns["lng"].tolist())]
+        self.columns["start_location"] = np.array(tags, dtype=object)
+        self._lists.pop("start_location", None)
+
+    def to_records(self) -> list:
+        values = [self.columns[name].tolist() for name in COLUMNS]
+        return [dict(zip(COLUMNS, row)) for row in zip(*values)]
+
+    @classmethod
+    def generate(cls, shipments, max_distance_in_meters, vehicle_types, seed=None):
+        """
+        Size the fleet from the demand, then place each type's vehicles near the pickup
+        depots in proportion to how many of that type's shipments each depot has.
+        """
+        import numpy as np
+        rng = make_rng(seed)
+        fleet = size_fleet(shipments, vehicle_types)
+
+        pickups = np.array([(float(s['pickup']['lat']), float(s['pickup']['lng'])) for s in shipments],
+                           dtype=np.float64).reshape(-1, 2)
+        required = np.array([s.get('required_vehicle_type') for s in shipments], dtype=object)
+        depots, depot_of_shipment = np.unique(pickups, axis=0, return_inverse=True)
+        depot_of_shipment = depot_of_shipment.reshape(-1)
+        all_demand = np.bincount(depot_of_shipment, minlength=len(depots)).astype(np.float64)
+
+        parts = {name: [] for name in ("type", "capacity", "on_demand", "cost", "depot")}
+        for vehicle_type in vehicle_types:
+            sized = fleet[vehicle_type["name"]]
+            if not sized["regular"] and not sized["on_demand"]:
+                continue
+            demand = np.bincount(depot_of_shipment[required == vehicle_type["name"]],
+                                 minlength=len(depots)).astype(np.float64)
+            if not demand.any():
+                demand = all_demand
+            for on_demand, count in ((False, sized["regular"]), (True, sized["on_demand"])):
+                depot = np.repeat(np.arange(len(depots)), allocate(count, demand))
+                parts["type"].append(np.full(count, vehicle_type["name"], dtype=object))
+                parts["capacity"].append(np.full(count, vehicle_type["capacity"]))
+                parts["on_demand"].append(np.full(count, on_demand, dtype=bool))
+                parts["cost"].append(np.full(count, ON_DEMAND_COST if on_demand else REGULAR_COST, dtype=np.int64))
+                parts["depot"].append(depot)
+
+        if not parts["type"] or len(depots) == 0:
+            return cls({name: np.zeros(0, dtype=object) for name in COLUMNS})
+
+        columns = {name: np.concatenate(arrays) for name, arrays in parts.items()}
+        depot = columns.pop("depot")
+        lats, lngs = nearby_points(depots[depot, 0], depots[depot, 1], max_distance_in_meters, rng)
+
+        ids = np.char.mod("%08x", rng.integers(0, 2 ** 32, len(depot), dtype=np.uint64))
+        names = columns["type"].astype(str)
+        columns["label"] = np.char.add(np.char.add(names, "_"), ids)
+        columns["display_name"] = np.char.add("vehicle_", columns["label"])
+        columns["lat"] = lats
+        columns["lng"] = lngs
+        return cls(columns)
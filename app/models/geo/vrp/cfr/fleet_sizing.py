@@ -0,0 +1,115 @@
+import logging
+import math
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+# Size the fleet from the records, set FLEET_SIZING=0 to always offer the full demo fleet
+FLEET_SIZING = os.getenv("FLEET_SIZING", "1") in ("1", "true")
+# On-demand vehicles offered per regular vehicle when the demand could use them
+ON_DEMAND_FACTOR = 3
+# prepare_payload starts the global horizon this long before the earliest time window
+HORIZON_LEAD = timedelta(hours=4)
+
+
+def _parse_time(value):
+    return datetime.fromisoformat(value[:-1] if value.endswith('Z') else value)
+
+
+def _number(value) -> float:
+    # Missing, empty or non-numeric cells count as 0, like an empty load demand
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return 0.0
+    return number if math.isfinite(number) else 0.0
+
+
+def planning_start(records):
+    """Start of the global horizon prepare_payload gives the solver for these records, None without time windows."""
+    windows = [record.get('time_window') for record in records if record.get('time_window')]
+    if not windows:
+        return None
+    return min(_parse_time(window['from']) for window in windows) - HORIZON_LEAD
+
+
+def fleet_bounds(records, vehicle_types) -> dict:
+    """
+    Lower and upper bound on the vehicles of each type a plan can use.
+
+    Shipments only go on their `required_vehicle_type`, and a vehicle without shipments
+    is unused, so a type never needs more vehicles than it has shipments (upper bound).
+
+    The lower bound is the largest of:
+    - time: every shipment costs a pickup and a delivery check-in on one vehicle, all of
+      it between the horizon start and the type's latest time window end (its span), so
+      the type needs its total check-in time divided by that span;
+    - capacity: a vehicle carries at most its type's capacity per trip and a trip takes
+      at least the shortest pickup plus delivery check-in, so over the span it moves at
+      most capacity x trips, and the type needs its total capacity divided by that.
+    """
+    start = planning_start(records)
+    shipments = defaultdict(int)
+    service_seconds = defaultdict(float)
+    load = defaultdict(float)
+    trip_seconds = {}
+    ends = {}
+    for record in records:
+        vehicle_type = record.get('required_vehicle_type')
+        shipments[vehicle_type] += 1
+        check_ins = 2 * _number(record.get('check_in_time'))
+        service_seconds[vehicle_type] += check_ins
+        load[vehicle_type] += _number(record.get('capacity'))
+        trip_seconds[vehicle_type] = min(trip_seconds.get(vehicle_type, check_ins), check_ins)
+        if record.get('time_window'):
+            end = _parse_time(record['time_window']['to'])
+            ends[vehicle_type] = max(ends.get(vehicle_type, end), end)
+
+    bounds = {}
+    for vehicle_type in vehicle_types:
+        name = vehicle_type["name"]
+        upper = shipments.get(name, 0)
+        if upper == 0:
+            bounds[name] = {"lower": 0, "upper": 0}
+            continue
+        lower = 1
+        span = (ends[name] - start).total_seconds() if name in ends else 0
+        if span > 0:
+            lower = max(lower, math.ceil(service_seconds[name] / span))
+            capacity = _number(vehicle_type.get("capacity"))
+            if capacity > 0 and trip_seconds[name] > 0:
+                trips = max(1, math.floor(span / trip_seconds[name]))
+                lower = max(lower, math.ceil(load[name] / (capacity * trips)))
+        bounds[name] = {"lower": min(lower, upper), "upper": upper}
+    return bounds
+
+
+def size_fleet(records, vehicle_types) -> dict:
+    """
+    Regular and on-demand vehicle counts to offer per type: regular vehicles first (they
+    are cheaper), then on-demand vehicles up to the upper bound. Types nobody asks for get
+    no vehicles. With FLEET_SIZING off every type gets its full demo fleet.
+
+    Only the upper bound removes vehicles, and it only trims types with fewer shipments
+    than their demo fleet (regular plus on-demand) offers, i.e. small plans. Large plans
+    keep the full fleet: the lower bound only warns when even the full fleet is too small.
+    """
+    sized = {}
+    bounds = fleet_bounds(records, vehicle_types) if FLEET_SIZING else {}
+    for vehicle_type in vehicle_types:
+        name = vehicle_type["name"]
+        regular = vehicle_type["demo_count"]
+        on_demand = vehicle_type["demo_count"] * ON_DEMAND_FACTOR
+        if name in bounds:
+            lower, upper = bounds[name]["lower"], bounds[name]["upper"]
+            if lower > regular + on_demand:
+                logging.warning(f"Fleet sizing: type {name} needs at least {lower} vehicles, "
+                                f"only {regular + on_demand} can be offered")
+            regular = min(regular, upper)
+            on_demand = min(on_demand, upper - regular)
+        sized[name] = {"regular": regular, "on_demand": on_demand}
+
+    if bounds:
+        logging.info(f"Fleet sizing: {sum(s['regular'] + s['on_demand'] for s in sized.values())} vehicles offered, "
+                     f"bounds {bounds}")
+    return sized
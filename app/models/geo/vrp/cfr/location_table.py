@@ -0,0 +1,56 @@
+LOCATION_TAG_PREFIX = "loc_"
+
+
+class LocationTable:
+    """
+    Deduplicated (lat, lng) points of one solve, each with a stable index.
+
+    Most records share a handful of warehouse pickups and repeat customer dropoffs, so
+    shipments and vehicles carry a location tag (`loc_<index>`) and ETA legs are keyed by
+    (location index, location index) instead of raw coordinates.
+    """
+
+    def __init__(self):
+        self._indexes = {}
+        self.points = []
+
+    def __len__(self):
+        return len(self.points)
+
+    def add(self, lat, lng) -> int:
+        key = (float(lat), float(lng))
+        index = self._indexes.get(key)
+        if index is None:
+            index = len(self.points)
+            self._indexes[key] = index
+            self.points.append(key)
+        return index
+
+    def index_of(self, lat, lng):
+        return self._indexes.get((float(lat), float(lng)))
+
+    def tag(self, index) -> str:
+        return f"{LOCATION_TAG_PREFIX}{index}"
+
+    def leg(self, start_lat, start_lng, stop_lat, stop_lng):
+        """(start index, stop index) of a leg, None when either end is not in the table."""
+        start = self.index_of(start_lat, start_lng)
+        stop = self.index_of(stop_lat, stop_lng)
+        if start is None or stop is None:
+            return None
+        return start, stop
+
+    @classmethod
+    def from_data(cls, data):
+        """
+        Build the table from the records and vehicles of a request. Each record gets
+        `pickup_location`/`dropoff_location` tags and each vehicle a `start_location` tag,
+        which the CFR template turns into visit `tags` and vehicle `startTags`.
+        """
+        table = cls()
+        for record in data.get('records', []):
+            record['pickup_location'] = table.tag(table.add(record['pickup']['lat'], record['pickup']['lng']))
+            record['dropoff_location'] = table.tag(table.add(record['dropoff']['lat'], record['dropoff']['lng']))
+        for vehicle in data.get('vehicles', []):
+            vehicle['start_location'] = table.tag(table.add(vehicle['lat'], vehicle['lng']))
+        return table
@@ -0,0 +1,144 @@
+"""
+Run the CPU-bound stages of a solve (payload building with vehicle type matching, and
+response mapping) on the process pool, so concurrent requests use every core instead of
+sharing the serving process's GIL.
+
+Each stage gets only what it needs. The payload stage gets the request data and the
+solve options (the template is read from its path in the worker) and returns the solver
+payload already serialized, which the serving process sends without parsing, plus a
+compact mapping state: the record fields the mapping reads, the vehicle start points and
+the consolidation. The mapping stage gets that state, the solver response and the
+directions.
+
+Everything that talks to other services stays on the serving process: the gRPC solve,
+every ETA call (the matrix legs are fetched before the payload stage, the route legs
+after the solve, both on the scheduler's shared ETA pool and within the request
+deadline) and the signing of geometry tokens. Leg planning is a single pass over the
+solver's visits and runs there as well.
+"""
+import copy
+import json
+import os
+import pickle
+import time
+
+from app.models.geo.eta.route_geometry import geometry_token
+
+# "on" runs the CPU-bound stages on the process pool, "off" runs everything on the solver thread
+CFR_PROCESS_OFFLOAD = os.getenv("CFR_PROCESS_OFFLOAD", "off") == "on"
+
+PICKLE_PROTOCOL = pickle.HIGHEST_PROTOCOL
+
+# Record fields map_optimization_response reads
+MAPPING_FIELDS = ("pickup", "dropoff", "label", "display_name", "required_vehicle_type", "time_window",
+                  "customer", "capacity", "exclusive", "check_in_time")
+
+
+def template_tagged(template) -> bool:
+    """Whether the template's visits and vehicles carry location tags, the matrices need them."""
+    model = template.get("model", {})
+    return (all(visit.get("tags") for shipment in model.get("shipments", [])
+                for visit in shipment.get("pickups", []) + shipment.get("deliveries", []))
+            and all(vehicle.get("startTags") for vehicle in model.get("vehicles", [])))
+
+
+def stage_inputs(cfr) -> dict:
+    """What the payload stage needs from the serving process's CFR object."""
+    return {
+        "template_path": cfr.template_path,
+        # Workers read the template from its path, only a template without one (replays) is sent
+        "template_content": None if cfr.template_path else cfr.get_template_content(),
+        "data": cfr.data,
+        "fleet": cfr.fleet,
+        "consolidate": cfr.consolidate,
+        "deadline": cfr.deadline,
+        "tier": cfr.tier.name,
+        "matrices": cfr.matrices,
+        "geometry": "lazy" if cfr.lazy_geometry else "full",
+        # The matrix legs, fetched by the serving process
+        "leg_responses": cfr.leg_responses,
+        "matrix_locations": cfr.matrix_locations,
+        "matrix_status": cfr.matrix_status,
+    }
+
+
+def mapping_state(cfr) -> bytes:
+    """The records, vehicles and consolidation of a prepared CFR, reduced to what the mapping reads."""
+    compact = {id(record): {field: record[field] for field in MAPPING_FIELDS} for record in cfr.data["records"]}
+    consolidation = None
+    if cfr.consolidation is not None:
+        consolidation = copy.copy(cfr.consolidation)
+        # The merged solver shipments are only needed for the payload
+        consolidation.records = []
+        consolidation.members = {label: [compact[id(record)] for record in members]
+                                 for label, members in cfr.consolidation.members.items()}
+    vehicles = [{"label": vehicle["label"], "lat": vehicle["lat"], "lng": vehicle["lng"]}
+                for vehicle in cfr.data.get("vehicles", [])]
+    return pickle.dumps({"records": list(compact.values()), "vehicles": vehicles, "consolidation": consolidation},
+                        protocol=PICKLE_PROTOCOL)
+
+
+def prepare_stage(inputs: dict):
+    """Worker: the serialized solver payload, its (shipments, vehicles) counts and the mapping state."""
+    from app.models.geo.vrp.cfr.cfr import CFR
+
+    cfr = CFR(inputs["template_path"], inputs["data"], template_content=inputs["template_content"],
+              consolidate=inputs["consolidate"], deadline=inputs["deadline"], tier=inputs["tier"],
+              matrices=inputs["matrices"], geometry=inputs["geometry"], fleet=inputs["fleet"])
+    cfr.leg_responses = inputs["leg_responses"]
+    cfr.matrix_locations = inputs["matrix_locations"]
+    cfr.matrix_status = inputs["matrix_status"]
+    payload = cfr.match_vehicles_types(cfr.prepare_payload())
+    model = payload["model"]
+    counts = (len(model.get("shipments", [])), len(model.get("vehicles", [])))
+    return json.dumps(payload), counts, mapping_state(cfr), cfr.timings, cfr.matrix_status
+
+
+def map_stage(state: bytes, location_table, response: dict, directions, geometry):
+    """Worker: the mapped plan, with the stop points in place of geometry tokens."""
+    from app.models.geo.vrp.cfr.cfr import CFR
+
+    started = time.perf_counter()
+    state = pickle.loads(state)
+    cfr = CFR(None, {"records": state["records"], "vehicles": state["vehicles"]}, geometry=geometry)
+    cfr.consolidation = state["consolidation"]
+    cfr.location_table = location_table
+    cfr.sign_geometry = False
+    result = cfr.map_optimization_response(response, cfr.data, directions)
+    return result, time.perf_counter() - started
+
+
+def run_offloaded(cfr, pool) -> dict:
+    """Same result as `cfr.callCFR(cfr.match_vehicles_types(cfr.prepare_payload()))`, run from a solver thread."""
+    matrix_seconds = 0.0
+    if cfr.matrices and template_tagged(cfr.get_template_content()):
+        # On this process's shared ETA pool, the worker finds the legs in leg_responses
+        started = time.perf_counter()
+        cfr.fetch_matrix_legs()
+        matrix_seconds = time.perf_counter() - started
+
+    payload, counts, state, timings, cfr.matrix_status = pool.submit(prepare_stage, stage_inputs(cfr)).result()
+    cfr.timings.update(timings)
+    if cfr.matrices:
+        cfr.timings["matrices"] = cfr.timings.get("matrices", 0) + matrix_seconds
+
+    response = cfr.solve(payload, counts)
+
+    directions = None
+    if not cfr.lazy_geometry:
+        started = time.perf_counter()
+        directions = cfr.fetch_legs(*cfr.plan_directions(response, cfr.data))
+        cfr.timings["directions"] = time.perf_counter() - started
+
+    result, cfr.timings["map"] = pool.submit(map_stage, state, cfr.get_location_table(), response, directions,
+                                             "lazy" if cfr.lazy_geometry else "full").result()
+    if cfr.lazy_geometry:
+        # Signed here, the token secret stays with the serving process
+        lazy_legs = set()
+        for route in result.values():
+            if isinstance(route, dict) and "geometry_token" in route:
+                points = route["geometry_token"]
+                route["geometry_token"] = geometry_token(points)
+                lazy_legs.update((*start, *stop) for start, stop in zip(points, points[1:]) if start != stop)
+        cfr.record_leg_history(lazy_legs, cfr.data)
+    return result
@@ -0,0 +1,164 @@
+import hashlib
+import os
+import re
+import threading
+import time
+import uuid
+from functools import lru_cache
+
+from app.models.cache.shared_storage import storage_path
+from app.models.cache.tiered_cache import TieredCache
+from app.services.v1.http.responses import dumps
+
+# Optimized plans kept server-side so polling clients can revalidate and fetch deltas
+PLAN_STORE_MEMORY_BYTES = int(os.getenv("PLAN_STORE_MEMORY_BYTES", str(256 * 1024 * 1024)))
+# Every instance must see the same directory for polling to work across instances
+PLAN_STORE_DIR = os.getenv("PLAN_STORE_DIR", storage_path("plan_store", "/tmp/plan_store"))
+PLAN_STORE_MAX_BYTES = int(os.getenv("PLAN_STORE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+# A dispatch day, plans older than this are gone
+PLAN_STORE_TTL_SECONDS = float(os.getenv("PLAN_STORE_TTL_SECONDS", str(3 * 24 * 3600)))
+# Versions of a plan a delta can start from, older ones need a full fetch
+PLAN_STORE_MAX_VERSIONS = int(os.getenv("PLAN_STORE_MAX_VERSIONS", "20"))
+
+PLAN_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class PlanVersionGone(Exception):
+    """The requested version expired or was never stored."""
+
+
+def plan_etag(body: bytes) -> str:
+    # Hash of the stored body, equal plans share an ETag whichever instance stored them
+    return f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+def steps_splice(old_steps, new_steps):
+    """
+    Smallest single splice turning `old_steps` into `new_steps`: the common prefix and
+    suffix are kept, `steps[start:start + delete] = insert` gives the new list. None when
+    the steps are equal.
+    """
+    if old_steps == new_steps:
+        return None
+    limit = min(len(old_steps), len(new_steps))
+    start = 0
+    while start < limit and old_steps[start] == new_steps[start]:
+        start += 1
+    end = 0
+    while end < limit - start and old_steps[-1 - end] == new_steps[-1 - end]:
+        end += 1
+    return {"start": start, "delete": len(old_steps) - start - end, "insert": new_steps[start:len(new_steps) - end]}
+
+
+def plan_delta(old_plan, new_plan) -> dict:
+    """
+    Vehicles added, removed and changed between two mapped plans. Changed vehicles carry
+    only the route fields that differ and a splice of their steps.
+    """
+    added = {}
+    changed = {}
+    for vehicle, route in new_plan.items():
+        previous = old_plan.get(vehicle)
+        if previous is None:
+            added[vehicle] = route
+            continue
+        if previous == route:
+            continue
+        fields = {key: value for key, value in route.items() if key != "steps" and previous.get(key) != value}
+        removed_fields = [key for key in previous if key not in route]
+        change = {"fields": fields}
+        if removed_fields:
+            change["removed_fields"] = removed_fields
+        splice = steps_splice(previous.get("steps", []), route.get("steps", []))
+        if splice is not None:
+            change["steps"] = splice
+        changed[vehicle] = change
+    removed = [vehicle for vehicle in old_plan if vehicle not in new_plan]
+    return {"added": added, "changed": changed, "removed": removed,
+            "unchanged": len(new_plan) - len(added) - len(changed)}
+
+
+class PlanStore:
+    """
+    Versioned mapped plans per tenant on a TieredCache. Each save of a plan id is a new
+    immutable version, stored with its serialized JSON so full fetches skip serialization.
+    A small head entry (latest version, retained versions and their ETags) answers
+    conditional requests without loading the plan.
+
+    Heads are always read from disk, never from this process's memory, so a save by
+    another instance sharing PLAN_STORE_DIR is seen on the next request. Version numbers
+    are the save time in milliseconds (or the last version + 1), so they never restart
+    for a plan id, even one saved again after its head expired. Saves are serialized per
+    process only, two instances saving the same plan id in the same millisecond get the
+    same version.
+    Without a shared PLAN_STORE_DIR (e.g. Lambda without SHARED_STORAGE_DIR) a plan is
+    only known to the instance that stored it.
+    """
+
+    def __init__(self, cache=None, max_versions=None, heads=None):
+        self.cache = cache or TieredCache("plans", PLAN_STORE_MEMORY_BYTES, PLAN_STORE_DIR, PLAN_STORE_MAX_BYTES,
+                                          PLAN_STORE_TTL_SECONDS)
+        # No memory tier, the latest version may have been saved by another instance
+        self.heads = heads or TieredCache("plan_heads", 0, os.path.join(PLAN_STORE_DIR, "heads"),
+                                          ttl_seconds=PLAN_STORE_TTL_SECONDS)
+        self.max_versions = max_versions or PLAN_STORE_MAX_VERSIONS
+        self._lock = threading.Lock()
+
+    def _head_key(self, tenant_id, plan_id):
+        return f"plan:{tenant_id}:{plan_id}:head"
+
+    def _version_key(self, tenant_id, plan_id, version):
+        return f"plan:{tenant_id}:{plan_id}:v{version}"
+
+    def save(self, tenant_id, plan, body: bytes, plan_id=None) -> dict:
+        """Store `plan` (and its serialized `body`) as the next version, returns the new head."""
+        plan_id = plan_id or uuid.uuid4().hex
+        etag = plan_etag(body)
+        with self._lock:
+            head = self.heads.get(self._head_key(tenant_id, plan_id)) or {"plan_id": plan_id, "versions": [],
+                                                                          "etags": {}}
+            # Save time in milliseconds, past the last version when clocks disagree or saves are faster
+            last = head["versions"][-1] if head["versions"] else 0
+            version = max(last + 1, int(time.time() * 1000))
+            self.cache.set(self._version_key(tenant_id, plan_id, version),
+                           {"version": version, "plan": plan, "body": body, "etag": etag})
+            head["versions"] = (head["versions"] + [version])[-self.max_versions:]
+            head["etags"] = {kept: head["etags"].get(kept, etag) for kept in head["versions"]}
+            head["version"] = version
+            head["etag"] = etag
+            head["updated_at"] = time.time()
+            self.heads.set(self._head_key(tenant_id, plan_id), head)
+        return head
+
+    def head(self, tenant_id, plan_id):
+        """Latest version metadata, None for an unknown or expired plan."""
+        return self.heads.get(self._head_key(tenant_id, plan_id))
+
+    def get(self, tenant_id, plan_id, version) -> dict:
+        entry = self.cache.get(self._version_key(tenant_id, plan_id, version))
+        if entry is None:
+            raise PlanVersionGone(f"version {version} of plan {plan_id} is not available")
+        return entry
+
+    def delta(self, tenant_id, plan_id, since, version) -> dict:
+        old = self.get(tenant_id, plan_id, since)
+        new = self.get(tenant_id, plan_id, version)
+        return {"plan_id": plan_id, "from_version": since, "version": version,
+                **plan_delta(old["plan"], new["plan"])}
+
+    def delta_body(self, tenant_id, plan_id, since, version) -> bytes:
+        """Serialized delta, computed once per version pair for all the clients polling the plan."""
+        key = f"plan:{tenant_id}:{plan_id}:delta:{since}-{version}"
+        body = self.cache.get(key)
+        if body is None:
+            body = dumps(self.delta(tenant_id, plan_id, since, version))
+            self.cache.set(key, body)
+        return body
+
+    def stats(self) -> dict:
+        return self.cache.stats()
+
+
+@lru_cache(maxsize=None)
+def get_plan_store() -> PlanStore:
+    return PlanStore()
@@ -0,0 +1,154 @@
+import os
+
+from app.models.geo.vrp.cfr.route_columns import parse_timestamps
+
+TABLE_NAMES = ("vehicles", "steps", "legs", "totals")
+EXTENSIONS = {"parquet": "parquet", "arrow": "arrow"}
+
+
+def _pyarrow():
+    # pyarrow is only needed when a plan is exported
+    import pyarrow
+    return pyarrow
+
+
+def _timestamps(pa, values):
+    # Missing times (e.g. the start step has none) become nulls
+    import numpy as np
+    present = np.array([bool(value) for value in values], dtype=bool)
+    epoch = np.zeros(len(values), dtype=np.int64)
+    if present.any():
+        epoch[present] = parse_timestamps([value for value in values if value])
+    return pa.array(epoch, type=pa.timestamp("s", tz="UTC"), mask=~present)
+
+
+def _point(item):
+    # ETA geometry points use lat/lng, fall back to latitude/longitude
+    return item.get('lat', item.get('latitude')), item.get('lng', item.get('longitude'))
+
+
+def build_plan_tables(plan: dict) -> dict:
+    """
+    Flatten a mapped plan (vehicle -> steps with polyline points in between) into the
+    vehicles, steps, legs and totals tables. Numeric columns are fixed-width arrays.
+    """
+    import numpy as np
+    pa = _pyarrow()
+
+    vehicle_labels = list(plan.keys())
+    routes = [plan[label] for label in vehicle_labels]
+
+    vehicles = pa.table({
+        "vehicle_label": pa.array(vehicle_labels, type=pa.string()),
+        "start_time": _timestamps(pa, [route.get('start_time') for route in routes]),
+        "end_time": _timestamps(pa, [route.get('end_time') for route in routes]),
+        "number_of_shipments": np.array([route.get('number_of_shipments', 0) for route in routes], dtype=np.int32),
+        "travel_duration": np.array([route.get('travel_duration', 0) for route in routes], dtype=np.int64),
+        "wait_duration": np.array([route.get('wait_duration', 0) for route in routes], dtype=np.int64),
+        "load_duration": np.array([route.get('load_duration', 0) for route in routes], dtype=np.int64),
+        "total_duration": np.array([route.get('total_duration', 0) for route in routes], dtype=np.int64),
+        "total_distance": np.array([route.get('total_distance', 0) for route in routes], dtype=np.float64),
+    })
+
+    steps = {key: [] for key in ("vehicle_label", "step_index", "sequence", "action_type", "order_name",
+                                 "customer", "exclusive", "lat", "lng", "arrival_time", "checkin_time",
+                                 "departure_time", "waiting_duration", "checkin_duration", "load", "distance")}
+    legs = {key: [] for key in ("vehicle_label", "leg_index", "point_index", "lat", "lng")}
+
+    for vehicle_label, route in zip(vehicle_labels, routes):
+        step_index = -1
+        point_index = 0
+        for sequence, item in enumerate(route.get('steps', [])):
+            if 'action_type' in item:
+                step_index += 1
+                point_index = 0
+                steps["vehicle_label"].append(vehicle_label)
+                steps["step_index"].append(step_index)
+                steps["sequence"].append(sequence)
+                steps["action_type"].append(item['action_type'])
+                steps["order_name"].append(item.get('order_name'))
+                steps["customer"].append(item.get('customer'))
+                steps["exclusive"].append(bool(item.get('exclusive')))
+                steps["lat"].append(item['lat'])
+                steps["lng"].append(item['lng'])
+                steps["arrival_time"].append(item.get('arrival_time'))
+                steps["checkin_time"].append(item.get('checkin_time'))
+                steps["departure_time"].append(item.get('departure_time'))
+                steps["waiting_duration"].append(item.get('waiting_duration', 0))
+                steps["checkin_duration"].append(item.get('checkin_duration', 0))
+                steps["load"].append(item.get('load', 0))
+                steps["distance"].append(item.get('distance', 0))
+            else:
+                # Polyline point of the leg leaving the previous step
+                lat, lng = _point(item)
+                legs["vehicle_label"].append(vehicle_label)
+                legs["leg_index"].append(step_index)
+                legs["point_index"].append(point_index)
+                legs["lat"].append(lat)
+                legs["lng"].append(lng)
+                point_index += 1
+
+    steps_table = pa.table({
+        "vehicle_label": pa.array(steps["vehicle_label"], type=pa.string()).dictionary_encode(),
+        "step_index": np.array(steps["step_index"], dtype=np.int32),
+        "sequence": np.array(steps["sequence"], dtype=np.int32),
+        "action_type": pa.array(steps["action_type"], type=pa.string()).dictionary_encode(),
+        "order_name": pa.array(steps["order_name"], type=pa.string()),
+        "customer": pa.array(steps["customer"], type=pa.string()).dictionary_encode(),
+        "exclusive": np.array(steps["exclusive"], dtype=bool),
+        "lat": np.array(steps["lat"], dtype=np.float64),
+        "lng": np.array(steps["lng"], dtype=np.float64),
+        "arrival_time": _timestamps(pa, steps["arrival_time"]),
+        "checkin_time": _timestamps(pa, steps["checkin_time"]),
+        "departure_time": _timestamps(pa, steps["departure_time"]),
+        "waiting_duration": np.array(steps["waiting_duration"], dtype=np.int64),
+        "checkin_duration": np.array(steps["checkin_duration"], dtype=np.int64),
+        "load": np.array(steps["load"], dtype=np.int64),
+        "distance": np.array(steps["distance"], dtype=np.float64),
+    })
+
+    legs_table = pa.table({
+        "vehicle_label": pa.array(legs["vehicle_label"], type=pa.string()).dictionary_encode(),
+        "leg_index": np.array(legs["leg_index"], dtype=np.int32),
+        "point_index": np.array(legs["point_index"], dtype=np.int32),
+        "lat": np.array(legs["lat"], dtype=np.float64),
+        "lng": np.array(legs["lng"], dtype=np.float64),
+    })
+
+    totals = pa.table({
+        "vehicles": np.array([vehicles.num_rows], dtype=np.int32),
+        "used_vehicles": np.array([int((vehicles["number_of_shipments"].to_numpy() > 0).sum())], dtype=np.int32),
+        "shipments": np.array([int(vehicles["number_of_shipments"].to_numpy().sum())], dtype=np.int64),
+        "steps": np.array([steps_table.num_rows], dtype=np.int64),
+        "travel_duration": np.array([int(vehicles["travel_duration"].to_numpy().sum())], dtype=np.int64),
+        "wait_duration": np.array([int(vehicles["wait_duration"].to_numpy().sum())], dtype=np.int64),
+        "load_duration": np.array([int(vehicles["load_duration"].to_numpy().sum())], dtype=np.int64),
+        "total_duration": np.array([int(vehicles["total_duration"].to_numpy().sum())], dtype=np.int64),
+        "total_distance": np.array([float(vehicles["total_distance"].to_numpy().sum())], dtype=np.float64),
+    })
+
+    return {"vehicles": vehicles, "steps": steps_table, "legs": legs_table, "totals": totals}
+
+
+def write_plan_tables(tables: dict, directory: str, export_format: str) -> dict:
+    """Write each table to `directory` as Parquet or Arrow IPC, returns table -> file path."""
+    if export_format not in EXTENSIONS:
+        raise ValueError(f"Unsupported export format: {export_format}")
+
+    pa = _pyarrow()
+    os.makedirs(directory, exist_ok=True)
+
+    paths = {}
+    for name, table in tables.items():
+        path = os.path.join(directory, f"{name}.{EXTENSIONS[export_format]}")
+        if export_format == "parquet":
+            import pyarrow.parquet as pq
+            pq.write_table(table, path, compression="zstd")
+        else:
+            # Uncompressed so readers can memory-map the file without copying
+            import pyarrow.ipc as ipc
+            with pa.OSFile(path, "wb") as sink:
+                with ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+        paths[name] = path
+    return paths
@@ -0,0 +1,97 @@
+def parse_durations(values):
+    """Convert protobuf duration strings ("123s") to an int64 array of seconds."""
+    import numpy as np
+    if len(values) == 0:
+        return np.zeros(0, dtype=np.int64)
+    stripped = np.char.rstrip(np.asarray(values, dtype=str), "s")
+    return stripped.astype(np.float64).astype(np.int64)
+
+
+def parse_timestamps(values):
+    """Convert RFC 3339 UTC timestamps ("2024-04-01T08:00:00Z") to an int64 array of epoch seconds."""
+    import numpy as np
+    if len(values) == 0:
+        return np.zeros(0, dtype=np.int64)
+    stripped = np.char.rstrip(np.asarray(values, dtype=str), "Z")
+    return stripped.astype("datetime64[ms]").astype("datetime64[s]").astype(np.int64)
+
+
+def format_timestamps(epoch_seconds) -> list:
+    """Format epoch seconds back to "%Y-%m-%dT%H:%M:%SZ" strings."""
+    import numpy as np
+    if len(epoch_seconds) == 0:
+        return []
+    formatted = np.datetime_as_string(epoch_seconds.astype("datetime64[s]"), unit="s")
+    return np.char.add(formatted, "Z").tolist()
+
+
+class RouteColumns:
+    """
+    Visits and transitions of one optimized route loaded into flat arrays.
+
+    Transition `i` is the leg that ends at visit `i`, the first transition is zeroed the
+    same way the nested mapping always did (the vehicle starts at its first visit).
+    """
+
+    def __init__(self, route: dict):
+        import numpy as np
+        visits = route.get('visits', [])
+        transitions = route.get('transitions', [])
+
+        self.visit_count = len(visits)
+        self.shipment_labels = [visit.get('shipmentLabel', '') for visit in visits]
+        self.is_pickup = np.array([visit.get('isPickup', True) for visit in visits], dtype=bool)
+        self.visit_start_times = [visit.get('startTime', '') for visit in visits]
+        self.loads = [visit.get('demands', [{"value": ""}])[0].get('value', '') for visit in visits]
+
+        start_times = [transition['startTime'] for transition in transitions]
+        if start_times and visits:
+            start_times[0] = visits[0]['startTime']
+        self.transition_start_times = start_times
+
+        self.transition_starts = parse_timestamps(start_times)
+        self.travel_durations = parse_durations([t.get('travelDuration', '0s') for t in transitions])
+        self.wait_durations = parse_durations([t.get('waitDuration', '0s') for t in transitions])
+        self.distances = np.array([t.get('travelDistanceMeters', 0) for t in transitions], dtype=np.float64)
+
+        if len(transitions):
+            self.travel_durations[0] = 0
+            self.wait_durations[0] = 0
+            self.distances[0] = 0
+
+        # Arrival at visit i = start of transition i + its travel duration
+        self.arrival_times = self.transition_starts[:self.visit_count] + self.travel_durations[:self.visit_count]
+
+    def steps(self, order_locations: dict) -> list:
+        """Build the per-visit step dicts, only called when the plan is serialized."""
+        arrival_times = format_timestamps(self.arrival_times)
+        wait_durations = self.wait_durations.tolist()
+        distances = self.distances.tolist()
+        is_pickup = self.is_pickup.tolist()
+
+        steps = []
+        for i in range(self.visit_count):
+            action_type = 'pickup' if is_pickup[i] else 'dropoff'
+            order_name = self.shipment_labels[i]
+            order = order_locations.get(order_name, {})
+            location = order.get(action_type)
+            if not location:
+                continue
+
+            distance = distances[i]
+            steps.append({
+                'action_type': action_type,
+                'arrival_time': arrival_times[i],
+                'waiting_duration': wait_durations[i],
+                'checkin_time': self.visit_start_times[i],
+                'checkin_duration': int(order.get("check_in_time")),
+                'departure_time': self.transition_start_times[i + 1],
+                'load': int(self.loads[i]),
+                'order_name': order_name,
+                'lat': location['lat'],
+                'lng': location['lng'],
+                'customer': order.get("customer"),
+                'exclusive': order.get("exclusive"),
+                'distance': int(distance) if distance.is_integer() else distance,
+            })
+        return steps
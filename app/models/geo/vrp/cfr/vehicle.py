@@ -1,13 +1,10 @@
-import json
 import logging
 import re
-import copy
 
+from app.models.geo.vrp.cfr.compiled_template import compile_template, as_columns
 
-class Vehicle:
-    flattened_data_array = []
-    flattened_data_dict = {}
 
+class Vehicle:
     def __init__(self):
         self._data = None
         self._template = None
@@ -43,12 +40,6 @@ class Vehicle:
             print("No 'model' element found in the template.")
             return False
 
-    def get_flattened_data_array(self):
-        return self.flattened_data_array
-
-    def get_flattened_data_dict(self):
-        return self.flattened_data_dict
-
     def get_first_components(self, obj):
         first_components = set()
         if isinstance(obj, dict):
@@ -107,108 +98,15 @@ class Vehicle:
     def create_payload(self):
         payload = []
         if self._template and self._data:
-            for data_element in self._data:
-                # Merge the template with the current data element
-                payload_element = self._template[0]
-                payload.append(payload_element)
+            # Render every data element from columns with the compiled template, a record list
+            # is read column by column, a Fleet or frame-backed RecordColumns is used as it is
+            payload = compile_template(self._template[0]).render(as_columns(self._data), len(self._data))
         else:
             print("Template or data is missing.")
         self._payload = payload
 
-        self.flatten_data()
-        self.resolve_payload_placeholders()
-
         return self._payload
 
-    def flatten_data(self):
-        # Clear the previous flattened data
-        self.flattened_data_dict.clear()
-
-        data = self._data
-        for i, item in enumerate(data):
-            self.flatten_dict_recursive(item, str(i))
-
-        return self.flattened_data_dict
-
-    def flatten_dict_recursive(self, d, path):
-        for k, v in d.items():
-            new_path = f"{path}.{k}"
-            if isinstance(v, dict):
-                # If the value is a dictionary, recursively flatten it
-                self.flatten_dict_recursive(v, new_path)
-            else:
-                # If the value is not a dictionary, add it to the flattened data dictionary
-                self.flattened_data_dict[new_path] = v
-
-    def resolve_payload_placeholders(self):
-        resolved_payload = []
-        flattened_data_dict = self.get_flattened_data_dict()
-        # Iterate over each element in the _payload
-        for i, element in enumerate(self._payload):
-            # Convert the element to a string to apply regular expressions
-            element_str = json.dumps(element)
-            # Find all placeholders in the element
-            placeholders = re.findall(r'{{(.*?)}}', element_str)
-            # Iterate over each placeholder found
-            for placeholder in placeholders:
-                # Split the placeholder to get the path
-                path = placeholder.split('.')
-                # Remove the first element from the path (e.g., records)
-                path = '.'.join(path[1:])
-                # Replace * with the current payload index
-                path = path.replace('*', str(i))
-                # Check if the path exists in flattened_data_dict
-                if path in flattened_data_dict:
-                    # Replace the placeholder with the value from flattened_data_dict
-                    element_str = element_str.replace(f'{{{{{placeholder}}}}}', str(flattened_data_dict[path]))
-                else:
-                    print(f"Placeholder '{placeholder}' not found in flattened_data_dict.")
-            # Convert the resolved element back to JSON
-            resolved_element = json.loads(element_str)
-            # Convert string representations of numbers to numeric types
-            resolved_element = self.convert_string_to_number(resolved_element)
-            # Append the resolved element to the new array
-            resolved_payload.append(resolved_element)
-        # Update the _payload with the resolved values
-        self._payload = resolved_payload
-
-    def convert_string_to_number(self, element):
-        """
-        Recursively convert string representations of numbers to their corresponding numeric types.
-        """
-        if isinstance(element, dict):
-            for key, val in element.items():
-                element[key] = self.convert_string_to_number(val)
-        elif isinstance(element, list):
-            for i, item in enumerate(element):
-                element[i] = self.convert_string_to_number(item)
-        elif isinstance(element, str):
-            # Check if the string represents a float
-            try:
-                float_val = float(element)
-                if float_val.is_integer():  # Check if it's an integer
-                    element = int(float_val)
-                else:
-                    element = float_val
-            except ValueError:
-                pass  # If it's not a float, keep it as a string
-        return element
-
-    def replace_placeholder(self, element, placeholder, value):
-        """
-        Replace placeholder with value in the given element recursively.
-        """
-        if isinstance(element, dict):
-            for key, val in element.items():
-                if isinstance(val, (dict, list)):
-                    element[key] = self.replace_placeholder(val, placeholder, value)
-                elif isinstance(val, str):
-                    element[key] = val.replace(f'{{{{{placeholder}}}}}', str(value))
-        elif isinstance(element, list):
-            for i, item in enumerate(element):
-                element[i] = self.replace_placeholder(item, placeholder, value)
-        return element
-
     def get_payload(self):
         indexed_payload = []
         if self._payload is not None:
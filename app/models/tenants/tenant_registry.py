@@ -0,0 +1,200 @@
+import hashlib
+import json
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+from collections import Counter, OrderedDict
+from functools import lru_cache
+
+from app.models.cache.shared_storage import storage_path
+
+TENANTS_MANIFEST_PATH = os.getenv("TENANTS_MANIFEST_PATH", "app/storage/tenants/tenants.json")
+DEFAULT_TENANT = os.getenv("DEFAULT_TENANT", "silal")
+
+# Paths used when a tenant entry does not override them
+DEFAULT_CFR_TEMPLATE = "app/storage/cfr/silal_main_full.json"
+DEFAULT_PARSE_TEMPLATE = "app/storage/extract_templates/poc_template.json"
+DEFAULT_VEHICLE_PROFILE = "app/storage/profiles/vehicles/silal.json"
+
+# Request counts per tenant, one file per container, merged to pick the tenants to preload.
+# On shared storage a cold start preloads what the whole fleet uses most.
+TENANT_USAGE_DIR = os.getenv("TENANT_USAGE_DIR", storage_path("tenant_usage", "/tmp/tenant_usage"))
+# A container saves its counts at most this often
+TENANT_USAGE_SAVE_SECONDS = float(os.getenv("TENANT_USAGE_SAVE_SECONDS", "60"))
+# Files of containers that stopped saving this long ago are deleted
+TENANT_USAGE_MAX_AGE_SECONDS = float(os.getenv("TENANT_USAGE_MAX_AGE_SECONDS", str(7 * 24 * 3600)))
+# Most-used tenants preloaded next to the ones flagged `preload` in the manifest
+TENANT_PRELOAD_COUNT = int(os.getenv("TENANT_PRELOAD_COUNT", "8"))
+
+
+class UnknownTenantError(KeyError):
+    pass
+
+
+def _read_json(path):
+    with open(path, 'r') as file:
+        return json.load(file)
+
+
+class TenantProfile:
+    """Everything a request needs for one tenant, loaded and compiled once."""
+
+    def __init__(self, tenant_id, config):
+        self.tenant_id = tenant_id
+        self.cfr_template_path = config.get("cfr_template", DEFAULT_CFR_TEMPLATE)
+        self.parse_template_path = config.get("parse_template", DEFAULT_PARSE_TEMPLATE)
+        self.vehicle_profile_path = config.get("vehicle_profile", DEFAULT_VEHICLE_PROFILE)
+
+        # Templates are shared between requests and must be treated as read-only
+        self.cfr_template = _read_json(self.cfr_template_path)
+        self.parse_template = _read_json(self.parse_template_path)
+        self.vehicle_types = _read_json(self.vehicle_profile_path)
+
+        # Changes whenever one of the tenant's files changes, used to key derived caches
+        digest = hashlib.sha256()
+        for content in (self.cfr_template, self.parse_template, self.vehicle_types):
+            digest.update(json.dumps(content, sort_keys=True).encode("utf-8"))
+        self.version = digest.hexdigest()[:16]
+
+
+class TenantRegistry:
+    """
+    Tenant-keyed profiles loaded on demand and kept under a bounded LRU.
+
+    The manifest only lists paths, a tenant's files are read the first time it is
+    requested (or at preload) and then served from memory until evicted.
+
+    Requests are counted per tenant and saved to TENANT_USAGE_DIR, so the counts survive
+    cold starts and `preload` can load the most-used tenants. Without SHARED_STORAGE_DIR
+    the counts stay in the container's /tmp and a new Lambda container only preloads the
+    configured tenants.
+    """
+
+    def __init__(self, manifest_path=TENANTS_MANIFEST_PATH, max_tenants=None, usage_dir=None):
+        self.manifest = _read_json(manifest_path)
+        self.max_tenants = max_tenants or int(os.getenv("TENANT_CACHE_SIZE", "32"))
+        self.usage_dir = usage_dir if usage_dir is not None else TENANT_USAGE_DIR
+        # Written by this process only, no two writers share a file
+        self.usage_path = os.path.join(self.usage_dir, f"{socket.gethostname()}-{os.getpid()}.json") \
+            if self.usage_dir else None
+        self._profiles = OrderedDict()
+        self._hits = Counter()
+        self._saved_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def tenants(self):
+        return list(self.manifest.keys())
+
+    def get(self, tenant_id=None) -> TenantProfile:
+        tenant_id = tenant_id or DEFAULT_TENANT
+        if tenant_id not in self.manifest:
+            raise UnknownTenantError(tenant_id)
+
+        with self._lock:
+            self._hits[tenant_id] += 1
+            save = time.monotonic() - self._saved_at >= TENANT_USAGE_SAVE_SECONDS
+            if save:
+                self._saved_at = time.monotonic()
+        if save:
+            self.save_usage()
+        return self._load(tenant_id)
+
+    def _load(self, tenant_id) -> TenantProfile:
+        with self._lock:
+            profile = self._profiles.get(tenant_id)
+            if profile is not None:
+                self._profiles.move_to_end(tenant_id)
+                return profile
+
+        # Load outside the lock, a concurrent load of the same tenant is harmless
+        profile = TenantProfile(tenant_id, self.manifest[tenant_id])
+        logging.info(f"Loaded tenant profile '{tenant_id}' (version {profile.version})")
+
+        with self._lock:
+            self._profiles[tenant_id] = profile
+            self._profiles.move_to_end(tenant_id)
+            while len(self._profiles) > self.max_tenants:
+                evicted, _ = self._profiles.popitem(last=False)
+                logging.info(f"Evicted tenant profile '{evicted}'")
+        return profile
+
+    def preload(self, tenant_ids=None):
+        """
+        Load the given tenants, by default TENANT_PRELOAD, or else the ones flagged
+        `preload` in the manifest followed by the TENANT_PRELOAD_COUNT most-used ones.
+        Preloading is not counted as usage.
+        """
+        if tenant_ids is None:
+            configured = os.getenv("TENANT_PRELOAD")
+            if configured:
+                tenant_ids = [tenant.strip() for tenant in configured.split(",") if tenant.strip()]
+            else:
+                tenant_ids = [tenant for tenant, config in self.manifest.items() if config.get("preload")]
+                tenant_ids += [tenant for tenant, _ in self.most_used(TENANT_PRELOAD_COUNT)
+                               if tenant not in tenant_ids]
+
+        for tenant_id in tenant_ids[:self.max_tenants]:
+            if tenant_id not in self.manifest:
+                logging.error(f"Could not preload tenant '{tenant_id}': not in the manifest")
+                continue
+            try:
+                self._load(tenant_id)
+            except (OSError, ValueError) as exc:
+                logging.error(f"Could not preload tenant '{tenant_id}': {exc}")
+
+    def _saved_usage(self) -> Counter:
+        """Counts saved by the other containers, expired files are deleted."""
+        usage = Counter()
+        if not self.usage_dir or not os.path.isdir(self.usage_dir):
+            return usage
+        expired_before = time.time() - TENANT_USAGE_MAX_AGE_SECONDS
+        for entry in os.scandir(self.usage_dir):
+            if not entry.name.endswith(".json") or entry.path == self.usage_path:
+                continue
+            try:
+                if entry.stat().st_mtime < expired_before:
+                    os.remove(entry.path)
+                    continue
+                usage.update(_read_json(entry.path))
+            except (OSError, ValueError) as e:
+                logging.warning(f"Could not load tenant usage from {entry.path}: {e}")
+        return usage
+
+    def save_usage(self):
+        """Write this process's counts to its file in TENANT_USAGE_DIR."""
+        if not self.usage_path:
+            return
+        with self._lock:
+            hits = dict(self._hits)
+        try:
+            os.makedirs(self.usage_dir, exist_ok=True)
+            # Write then rename, readers never see a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=self.usage_dir, suffix=".tmp")
+            with os.fdopen(fd, 'w') as file:
+                json.dump(hits, file)
+            os.replace(tmp_path, self.usage_path)
+        except OSError as e:
+            logging.warning(f"Could not save tenant usage to {self.usage_path}: {e}")
+
+    def most_used(self, n=None):
+        """Tenants of the manifest by request count, over every container's saved counts and this one's."""
+        usage = self._saved_usage()
+        with self._lock:
+            usage.update(self._hits)
+        return [(tenant, count) for tenant, count in usage.most_common() if tenant in self.manifest][:n]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "loaded": list(self._profiles.keys()),
+                "max_tenants": self.max_tenants,
+                "hits": dict(self._hits),
+            }
+
+
+@lru_cache(maxsize=None)
+def get_tenant_registry() -> TenantRegistry:
+    return TenantRegistry()
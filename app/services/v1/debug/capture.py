@@ -0,0 +1,230 @@
+import copy
+import gzip
+import hashlib
+import json
+import logging
+import os
+import random
+import secrets
+import time
+import uuid
+
+from app.models.cache.shared_storage import storage_path
+from app.models.geo.eta.eta_cache import COORDINATE_DECIMALS
+from app.models.geo.vrp.cfr.exclusive_customers import GENERAL_SHIPMENT_TYPE
+from app.services.v1.debug.profiler import is_authorized
+
+# Share of optimize requests captured (0 disables sampling), a request with the profiling
+# token and `X-Capture: 1` is always captured
+CAPTURE_SAMPLE_RATE = float(os.getenv("CAPTURE_SAMPLE_RATE", "0"))
+CAPTURE_DIR = os.getenv("CAPTURE_DIR", storage_path("captures", "/tmp/captures"))
+# Oldest captures are deleted past this many
+CAPTURE_MAX_FILES = int(os.getenv("CAPTURE_MAX_FILES", "200"))
+# "off" keeps real coordinates and customer names, only for captures that never leave the account
+CAPTURE_ANONYMIZE = os.getenv("CAPTURE_ANONYMIZE", "on") != "off"
+# "south,west,north,east" of the box anonymized locations are placed in
+CAPTURE_SYNTHETIC_BOX = tuple(float(value) for value in os.getenv("CAPTURE_SYNTHETIC_BOX", "0,0,1,1").split(","))
+
+# Latitude/longitude keys of the same point, anonymized together
+COORDINATE_PAIRS = (("lat", "lng"), ("lat", "lon"), ("latitude", "longitude"), ("start_lat", "start_lng"),
+                    ("end_lat", "end_lng"), ("start_lat", "start_lon"), ("stop_lat", "stop_lon"))
+LAT_KEYS = {lat for lat, _ in COORDINATE_PAIRS}
+LNG_KEYS = {lng for _, lng in COORDINATE_PAIRS}
+NAME_KEYS = {"customer", "display_name"}
+# Exclusive customers become shipment types of the solver payload
+TYPE_KEYS = {"shipment_type", "shipmentType"}
+
+
+def should_capture(request) -> bool:
+    if request.headers.get("x-capture") == "1" and is_authorized(request.headers.get("x-profile-token", "")):
+        return True
+    return CAPTURE_SAMPLE_RATE > 0 and random.random() < CAPTURE_SAMPLE_RATE
+
+
+class Anonymizer:
+    """
+    Replaces every location of a capture with a synthetic point in CAPTURE_SYNTHETIC_BOX,
+    derived from a salted hash of the location (rounded like ETA cache keys), and customer
+    names with a salted hash of their normalized form. The same location gets the same
+    point everywhere in the capture, so the location structure (shared depots, repeat
+    customers, ETA legs) and exclusive customer matching replay unchanged. Distances and
+    directions between the points are not preserved, replays answer travel from the
+    captured ETA responses. The salt is random per capture and never stored.
+    """
+
+    def __init__(self, seed=None):
+        self.salt = random.Random(seed).getrandbits(128) if seed is not None else secrets.randbits(128)
+        self._points = {}
+
+    def _digest(self, value) -> bytes:
+        return hashlib.sha256(f"{self.salt}:{value}".encode("utf-8")).digest()
+
+    def _coordinate(self, value):
+        if isinstance(value, bool) or value is None:
+            return None
+        try:
+            return round(float(value), COORDINATE_DECIMALS)
+        except (TypeError, ValueError):
+            return None
+
+    def _point(self, lat, lng):
+        """Synthetic (lat, lng) of a location, None for a value that is not a coordinate pair."""
+        location = (self._coordinate(lat), self._coordinate(lng))
+        if None in location:
+            return None
+        point = self._points.get(location)
+        if point is None:
+            south, west, north, east = CAPTURE_SYNTHETIC_BOX
+            digest = self._digest(location)
+            point = self._points[location] = (self._spread(digest[:8], south, north),
+                                              self._spread(digest[8:16], west, east))
+        return point
+
+    def _lone(self, key, value):
+        # A latitude or longitude without its pair, hashed on its own
+        coordinate = self._coordinate(value)
+        if coordinate is None:
+            return value
+        south, west, north, east = CAPTURE_SYNTHETIC_BOX
+        low, high = (south, north) if key in LAT_KEYS else (west, east)
+        return self._spread(self._digest((key, coordinate))[:8], low, high)
+
+    def _spread(self, digest, low, high):
+        # Hash bytes to a coordinate between low and high, at the ETA cache key precision
+        scale = 10 ** COORDINATE_DECIMALS
+        return round(low + (high - low) * (int.from_bytes(digest, "big") % scale) / scale, COORDINATE_DECIMALS)
+
+    def _name(self, value):
+        if not isinstance(value, str):
+            return value
+        return f"anon_{self._digest(value.strip().lower()).hex()[:10]}"
+
+    def _type(self, value):
+        return value if value == GENERAL_SHIPMENT_TYPE else self._name(value)
+
+    def _locations(self, value: dict) -> dict:
+        """Synthetic values of the coordinate keys of `value`."""
+        replaced = {}
+        for lat_key, lng_key in COORDINATE_PAIRS:
+            if lat_key in value and lng_key in value and lat_key not in replaced:
+                point = self._point(value[lat_key], value[lng_key])
+                if point is not None:
+                    replaced[lat_key], replaced[lng_key] = point
+        for key, item in value.items():
+            if key not in replaced and (key in LAT_KEYS or key in LNG_KEYS):
+                replaced[key] = self._lone(key, item)
+        return replaced
+
+    def apply(self, value):
+        if isinstance(value, dict):
+            locations = self._locations(value)
+            result = {}
+            for key, item in value.items():
+                if key in locations:
+                    result[key] = locations[key]
+                elif key in NAME_KEYS:
+                    result[key] = self._name(item)
+                elif key in TYPE_KEYS:
+                    result[key] = self._type(item)
+                elif key == "shipmentTypeIncompatibilities" and isinstance(item, list):
+                    result[key] = [{**entry, "types": [self._type(name) for name in entry.get("types", [])]}
+                                   for entry in item]
+                elif key == "directions_data" and isinstance(item, str):
+                    # Some ETA responses carry their points as a JSON string
+                    result[key] = self.apply(json.loads(item))
+                else:
+                    result[key] = self.apply(item)
+            return result
+        if isinstance(value, list):
+            return [self.apply(item) for item in value]
+        return value
+
+
+class Capture:
+    """
+    What one optimize request saw: the request body (copied before CFR adds its tags),
+    the CFR template, the prepared solver payload, the solver response and every ETA
+    response, written as one gzipped JSON file for app/tools/replay_capture.py.
+    """
+
+    def __init__(self, request_body, template=None, tenant_id=None, params=None):
+        self.capture_id = uuid.uuid4().hex
+        self.captured_at = time.time()
+        self.tenant_id = tenant_id
+        self.params = params or {}
+        self.template = template
+        self.request = copy.deepcopy(request_body)
+        self.payload = None
+        self.response = None
+        self.directions = []
+
+    def record_payload(self, payload):
+        self.payload = copy.deepcopy(payload)
+
+    def record_response(self, response):
+        self.response = copy.deepcopy(response)
+
+    def record_directions(self, directions):
+        self.directions.extend(copy.deepcopy(list(directions)))
+
+    def to_dict(self) -> dict:
+        content = {
+            "request": self.request,
+            "payload": self.payload,
+            "response": self.response,
+            "directions": self.directions,
+        }
+        if CAPTURE_ANONYMIZE:
+            content = Anonymizer().apply(content)
+        return {
+            "capture_id": self.capture_id,
+            "captured_at": self.captured_at,
+            "tenant_id": self.tenant_id,
+            "params": self.params,
+            "template": self.template,
+            "anonymized": CAPTURE_ANONYMIZE,
+            **content,
+        }
+
+    def save(self, directory=None) -> str:
+        directory = directory or CAPTURE_DIR
+        os.makedirs(directory, exist_ok=True)
+        path = capture_path(self.capture_id, directory)
+        with gzip.open(path, "wt", encoding="utf-8") as file:
+            json.dump(self.to_dict(), file, default=str)
+        logging.info(f"Captured optimize request to {path}")
+        prune_captures(directory)
+        return path
+
+
+def capture_path(capture_id, directory=None) -> str:
+    return os.path.join(directory or CAPTURE_DIR, f"{capture_id}.json.gz")
+
+
+def list_captures(directory=None) -> list:
+    """Stored captures, newest first, without opening them."""
+    directory = directory or CAPTURE_DIR
+    if not os.path.isdir(directory):
+        return []
+    captures = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith(".json.gz"):
+            stat = entry.stat()
+            captures.append({"capture_id": entry.name[:-len(".json.gz")], "saved_at": stat.st_mtime,
+                             "bytes": stat.st_size})
+    return sorted(captures, key=lambda capture: capture["saved_at"], reverse=True)
+
+
+def prune_captures(directory):
+    captures = sorted((entry.stat().st_mtime, entry.path) for entry in os.scandir(directory)
+                      if entry.name.endswith(".json.gz"))
+    for _, path in captures[:max(0, len(captures) - CAPTURE_MAX_FILES)]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def load_capture(path) -> dict:
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        return json.load(file)
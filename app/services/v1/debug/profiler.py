@@ -0,0 +1,206 @@
+import hmac
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from app.models.cache.shared_storage import storage_path
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", storage_path("profiles", "/tmp/profiles"))
+PROFILE_INTERVAL_SECONDS = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+MAX_STACK_DEPTH = 128
+
+# Profiler of the request being handled, only set while a profiled request runs
+_active_profiler = ContextVar("active_profiler", default=None)
+
+
+class ProfilingForbidden(Exception):
+    pass
+
+
+def profiling_token():
+    # Profiling is disabled unless a token is configured
+    return os.getenv("PROFILING_TOKEN")
+
+
+def is_authorized(token: str) -> bool:
+    expected = profiling_token()
+    return bool(expected) and bool(token) and hmac.compare_digest(expected, token)
+
+
+def profile_path(profile_id: str) -> str:
+    return os.path.join(PROFILE_DIR, f"{profile_id}.speedscope.json")
+
+
+class RequestProfiler:
+    """
+    Sampling profiler scoped to the threads doing work for one request.
+
+    A background thread reads `sys._current_frames()` every PROFILE_INTERVAL_MS and keeps
+    the stacks of the registered threads only (the event loop, the solver thread running
+    callCFR and the ETA workers), so other requests running on the shared pools in the
+    meantime are not mixed in. Work other requests do on the event loop thread while it
+    is registered is still sampled.
+    """
+
+    def __init__(self, profile_id, name):
+        self.profile_id = profile_id
+        self.name = name
+        self._threads = Counter()  # thread ident -> number of active registrations
+        self._thread_names = {}
+        self._samples = Counter()  # (thread name, stack) -> sample count
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._run, name=f"profiler-{profile_id}", daemon=True)
+        self._started_at = None
+        self._duration = 0.0
+
+    def start(self):
+        self._started_at = time.perf_counter()
+        self._sampler.start()
+
+    def stop(self):
+        self._stop.set()
+        self._sampler.join()
+        self._duration = time.perf_counter() - self._started_at
+
+    def register_thread(self):
+        ident = threading.get_ident()
+        with self._lock:
+            self._threads[ident] += 1
+            self._thread_names[ident] = threading.current_thread().name
+        return ident
+
+    def unregister_thread(self, ident):
+        with self._lock:
+            self._threads[ident] -= 1
+            if self._threads[ident] <= 0:
+                del self._threads[ident]
+
+    def _run(self):
+        while not self._stop.wait(PROFILE_INTERVAL_SECONDS):
+            with self._lock:
+                threads = {ident: self._thread_names[ident] for ident in self._threads}
+            if not threads:
+                continue
+            frames = sys._current_frames()
+            for ident, thread_name in threads.items():
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                    code = frame.f_code
+                    stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                    frame = frame.f_back
+                stack.reverse()
+                self._samples[(thread_name, tuple(stack))] += 1
+
+    def to_speedscope(self) -> dict:
+        frames = []
+        frame_index = {}
+        profiles = {}
+
+        for (thread_name, stack), count in self._samples.items():
+            indexes = []
+            for frame in stack:
+                if frame not in frame_index:
+                    frame_index[frame] = len(frames)
+                    frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+                indexes.append(frame_index[frame])
+
+            profile = profiles.setdefault(thread_name, {
+                "type": "sampled",
+                "name": f"{self.name} [{thread_name}]",
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": self._duration,
+                "samples": [],
+                "weights": [],
+            })
+            profile["samples"].append(indexes)
+            profile["weights"].append(count * PROFILE_INTERVAL_SECONDS)
+
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": self.name,
+            "shared": {"frames": frames},
+            "profiles": list(profiles.values()),
+        }
+
+    def save(self) -> str:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = profile_path(self.profile_id)
+        with open(path, "w") as file:
+            json.dump(self.to_speedscope(), file)
+        return path
+
+
+class _ProfilingHandle:
+    def __init__(self, profiler=None):
+        self.profiler = profiler
+
+    def headers(self) -> dict:
+        if self.profiler is None:
+            return {}
+        return {"X-Profile-Id": self.profiler.profile_id}
+
+
+def profiling_requested(request) -> bool:
+    return (request.headers.get("x-profile") in ("1", "true")
+            or request.query_params.get("profile") in ("1", "true"))
+
+
+@contextmanager
+def profile_request(request):
+    """
+    Profile the enclosed block when the request opts in with `X-Profile: 1` or `?profile=1`
+    and carries a valid `X-Profile-Token`. Otherwise this only checks two headers.
+    """
+    if not profiling_requested(request):
+        yield _ProfilingHandle()
+        return
+
+    if not is_authorized(request.headers.get("x-profile-token", "")):
+        raise ProfilingForbidden()
+
+    profiler = RequestProfiler(uuid.uuid4().hex, f"{request.method} {request.url.path}")
+    token = _active_profiler.set(profiler)
+    ident = profiler.register_thread()
+    profiler.start()
+    try:
+        yield _ProfilingHandle(profiler)
+    finally:
+        profiler.unregister_thread(ident)
+        profiler.stop()
+        _active_profiler.reset(token)
+        path = profiler.save()
+        logging.info(f"Saved request profile {profiler.profile_id} to {path}")
+
+
+def profiled(fn):
+    """
+    Wrap `fn` so the thread that runs it is sampled by the current request's profiler.
+    Returns `fn` unchanged when the request is not being profiled.
+    """
+    profiler = _active_profiler.get()
+    if profiler is None:
+        return fn
+
+    def wrapper(*args, **kwargs):
+        # Executor threads do not inherit context, carry the profiler over explicitly
+        token = _active_profiler.set(profiler)
+        ident = profiler.register_thread()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profiler.unregister_thread(ident)
+            _active_profiler.reset(token)
+
+    return wrapper
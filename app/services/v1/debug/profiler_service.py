@@ -0,0 +1,55 @@
+import os
+import re
+
+from fastapi import APIRouter, HTTPException, Header
+from starlette.responses import FileResponse
+
+from app.services.v1.debug.capture import capture_path, list_captures
+from app.services.v1.debug.profiler import is_authorized, profile_path
+
+router = APIRouter()
+
+PROFILE_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+CAPTURE_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+@router.get("/api/v1/debug/profiles/{profile_id}")
+async def download_profile(profile_id: str, x_profile_token: str = Header(None)):
+    if not is_authorized(x_profile_token):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+    # Profile ids are generated by us, anything else must not reach the filesystem
+    if not PROFILE_ID_PATTERN.match(profile_id):
+        raise HTTPException(status_code=404, detail="Profile not found")
+
+    path = profile_path(profile_id)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Profile not found")
+
+    # Open with https://www.speedscope.app
+    return FileResponse(path, media_type="application/json", filename=os.path.basename(path))
+
+
+@router.get("/api/v1/debug/captures")
+async def get_captures(x_profile_token: str = Header(None)):
+    """Stored captures, newest first, on CAPTURE_DIR of this instance (or the shared storage)."""
+    if not is_authorized(x_profile_token):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return {"captures": list_captures()}
+
+
+@router.get("/api/v1/debug/captures/{capture_id}")
+async def download_capture(capture_id: str, x_profile_token: str = Header(None)):
+    if not is_authorized(x_profile_token):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+    # Capture ids are generated by us, anything else must not reach the filesystem
+    if not CAPTURE_ID_PATTERN.match(capture_id):
+        raise HTTPException(status_code=404, detail="Capture not found")
+
+    path = capture_path(capture_id)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Capture not found")
+
+    # Replay with python -m app.tools.replay_capture
+    return FileResponse(path, media_type="application/gzip", filename=os.path.basename(path))
@@ -1,18 +1,28 @@
-import math
-import random
+import asyncio
+import hashlib
+import os
+import shutil
+import tempfile
 import uuid
-from io import BytesIO
 from typing import List
 
-import pandas as pd
-from fastapi import FastAPI, UploadFile, File, HTTPException, APIRouter
+from fastapi import FastAPI, UploadFile, File, HTTPException, APIRouter, Request, Header, Query
 from fastapi.encoders import jsonable_encoder
+from starlette.concurrency import run_in_threadpool
 from starlette.responses import JSONResponse
 import logging
 import json
-import numpy as np
 from datetime import datetime, timedelta
 
+from app.models.geo.vrp.cfr.exclusive_customers import ExclusiveCustomerIndex
+from app.models.geo.vrp.cfr.fleet import Fleet
+from app.models.tenants.tenant_registry import get_tenant_registry, UnknownTenantError
+from app.services.v1.debug.profiler import profile_request, profiled, ProfilingForbidden
+from app.services.v1.files.uploads import open_upload, measure_memory
+from app.services.v1.files.parsers.parse_cache import get_parse_cache, hash_upload, parse_cache_key
+from app.services.v1.http.responses import FastJSONResponse, json_response
+from app.services.v1.workers.process_pool import get_process_pool
+
 # Initialize logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
@@ -21,13 +31,14 @@ logger = logging.getLogger(__name__)
 app = FastAPI()
 router = APIRouter()
 
-# Load the template from the specified file in the root directory
-template_file_path = 'app/storage/extract_templates/poc_template.json'
-with open(template_file_path, 'r') as template_file:
-    template = json.load(template_file)
+# Parse templates and vehicle profiles come from the tenant registry (app/storage/tenants/tenants.json)
+
 
+def dynamic_apply_template(df, template_actions, seed=None):
+    # pandas/numpy are only needed on the parse path, keep them out of the import graph
+    import numpy as np
+    import pandas as pd
 
-def dynamic_apply_template(df, template_actions):
     # Initially, create a set to keep track of all columns to retain
     columns_to_retain = set()
 
@@ -115,10 +126,17 @@ def dynamic_apply_template(df, template_actions):
         elif action["action"] == "concat_uuid":
             # Concatenate required_vehicle_type with a UUID
             for column_name in column_names:
-                df[field_name] = df.apply(
-                    lambda row: f"order_{row[column_name]}_{uuid.uuid4().hex[:8]}",
-                    axis=1
-                )
+                if seed is not None:
+                    # Deterministic mode, the suffix is derived from the workbook content and row
+                    df[field_name] = df.apply(
+                        lambda row: f"order_{row[column_name]}_{content_label(seed, field_name, row.name, row[column_name])}",
+                        axis=1
+                    )
+                else:
+                    df[field_name] = df.apply(
+                        lambda row: f"order_{row[column_name]}_{uuid.uuid4().hex[:8]}",
+                        axis=1
+                    )
         elif action["action"] == "minutes_to_seconds":
             for column_name in column_names:
                 df[field_name] = df[column_name] * 60
@@ -132,102 +150,100 @@ def dynamic_apply_template(df, template_actions):
     return df
 
 
+def content_label(seed, field_name, row_index, value):
+    return hashlib.sha1(f"{seed}:{field_name}:{row_index}:{value}".encode("utf-8")).hexdigest()[:8]
+
+
 def read_vehicle_types_from_file(file_path):
     with open(file_path, 'r') as file:
         vehicle_types = json.load(file)
     return vehicle_types
 
 
-# this function will be deleted ....
-def generate_nearby_location(lat, lng, max_distance_in_meters):
+def generate_fleet(shipments: List[dict], w: int, vehicle_types: List[dict] = None, seed: str = None) -> Fleet:
+    if vehicle_types is None:
+        file_path = 'app/storage/profiles/vehicles/silal.json'
+        vehicle_types = read_vehicle_types_from_file(file_path)
+
+    # Sized from the demand and placed near depots in proportion to their shipments, a seed
+    # gives the same fleet for the same workbook (deterministic mode)
+    return Fleet.generate(shipments, w, vehicle_types, seed)
+
+
+def generate_vehicle_locations(shipments: List[dict], w: int, vehicle_types: List[dict] = None,
+                               seed: str = None) -> List[dict]:
+    return generate_fleet(shipments, w, vehicle_types, seed).to_records()
+
+
+XLSX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+MAIN_SHEET = "Stock transfer & Delivery"
+EXCLUSIVE_SHEET = "Sheet2"
+
+
+def build_parse_result(processed_data, vehicle_types, seed=None):
+    result, _ = build_solve_request(processed_data, vehicle_types, seed)
+    return result
+
+
+def build_solve_request(processed_data, vehicle_types, seed=None):
     """
-    Generate a nearby location within a random distance up to a maximum distance in meters.
+    The parse result and the generated Fleet behind its vehicles, optimize-file hands the
+    Fleet to CFR so the solver vehicles are rendered from its columns. (None, None) when
+    the main sheet is missing.
     """
-    R = 6378.1  # Radius of the Earth in kilometers
-
-    # Generate a random distance up to the maximum distance
-    distance_in_meters = random.uniform(0, max_distance_in_meters)
-
-    # Convert distance to kilometers
-    distance_km = distance_in_meters / 1000
-
-    # Randomize bearing between 0 and 360 degrees
-    bearing = math.radians(random.randint(0, 360))
-
-    lat1 = math.radians(lat)
-    lon1 = math.radians(lng)
-
-    lat2 = math.asin(math.sin(lat1) * math.cos(distance_km / R) +
-                     math.cos(lat1) * math.sin(distance_km / R) * math.cos(bearing))
-    lon2 = lon1 + math.atan2(math.sin(bearing) * math.sin(distance_km / R) * math.cos(lat1),
-                             math.cos(distance_km / R) - math.sin(lat1) * math.sin(lat2))
-
-    new_lat = math.degrees(lat2)
-    new_lng = math.degrees(lon2)
-
-    return new_lat, new_lng
-
-
-def generate_vehicle_locations(shipments: List[dict], w: int) -> List[dict]:
-    vehicle_locations = []
-    # Extract pickup locations from shipments
-    pickup_locations = list(set((shipment['pickup']['lat'], shipment['pickup']['lng']) for shipment in shipments))
-    random.shuffle(pickup_locations)
-
-    file_path = 'app/storage/profiles/vehicles/silal.json'
-    vehicle_types = read_vehicle_types_from_file(file_path)
-
-    # Create all vehicles without assigning locations
-    vehicles = []
-    for vehicle_type in vehicle_types:
-        count = vehicle_type["demo_count"]
-        on_demand = vehicle_type["demo_count"] * 3
-        for _ in range(count):
-            vehicle_uuid = uuid.uuid4().hex[:8]
-            vehicle = {
-                'type': vehicle_type["name"],
-                'capacity': vehicle_type["capacity"],
-                'label': f"{vehicle_type['name']}_{vehicle_uuid}",
-                'display_name': f"vehicle_{vehicle_type['name']}_{vehicle_uuid}",
-                'on_demand': False,
-                'cost': 1
-            }
-            vehicles.append(vehicle)
-
-        for _ in range(on_demand):
-            vehicle_uuid = uuid.uuid4().hex[:8]
-            vehicle = {
-                'type': vehicle_type["name"],
-                'capacity': vehicle_type["capacity"],
-                'label': f"{vehicle_type['name']}_{vehicle_uuid}",
-                'display_name': f"vehicle_{vehicle_type['name']}_{vehicle_uuid}",
-                'on_demand': True,
-                'cost': 1000
-            }
-            vehicles.append(vehicle)
-
-    # Assign vehicles to pickup locations in a round-robin manner
-    pickup_index = 0
-    for vehicle in vehicles:
-        nearby_lat, nearby_lng = generate_nearby_location(pickup_locations[pickup_index][0],
-                                                          pickup_locations[pickup_index][1], w)
-        vehicle['lat'] = nearby_lat
-        vehicle['lng'] = nearby_lng
-        vehicle_locations.append(vehicle)
-
-        # Move to the next pickup location in a round-robin manner
-        pickup_index = (pickup_index + 1) % len(pickup_locations)
-
-    return vehicle_locations
-
-
-@router.post("/api/v1/files/parse")
-async def parse(file: UploadFile = File(...)):
-    try:
-        if file.content_type == "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet":
-            contents = await file.read()
-            data = BytesIO(contents)
+    # If only interested in "Stock transfer & Delivery", directly return its data
+    if MAIN_SHEET not in processed_data:
+        return None, None
+    records = processed_data[MAIN_SHEET]
+    fleet = generate_fleet(records, 150, vehicle_types, seed)
+    records = apply_exclusive_customers(records, processed_data[EXCLUSIVE_SHEET])
+    return {'records': records, 'vehicles': fleet.to_records(),
+            'exclusive_customers': processed_data[EXCLUSIVE_SHEET]}, fleet
+
 
+def frame_records(df) -> list:
+    """
+    Same records as `df.to_dict(orient='records')`, built from whole columns: each column
+    is converted to Python values once instead of boxing every cell row by row.
+    """
+    names = list(df.columns)
+    columns = [df.iloc[:, index].tolist() for index in range(len(names))]
+    return [dict(zip(names, row)) for row in zip(*columns)]
+
+
+def parse_sheet_file(path, sheet_name, template_actions, seed=None):
+    """Process pool task: read one sheet of a workbook on disk and apply its template actions."""
+    import pandas as pd
+
+    df = pd.read_excel(path, sheet_name=sheet_name)
+    return frame_records(dynamic_apply_template(df, template_actions, seed))
+
+
+def parse_workbook(file, profile, deterministic=False):
+    """
+    Parse an uploaded workbook with the tenant's template. Returns the processed sheets
+    (records per sheet name), the seed (content hash, deterministic mode only) and the
+    cache/memory headers of the parse.
+    """
+    import pandas as pd
+
+    template = profile.parse_template
+
+    # Deterministic mode: labels and fleet derive from the content hash, results are cached
+    seed = None
+    cache_key = None
+    processed_data = None
+    headers = {}
+    if deterministic:
+        seed = hash_upload(file.file)
+        cache_key = parse_cache_key(seed, profile)
+        processed_data = get_parse_cache().get(cache_key)
+        headers["X-Parse-Cache"] = "hit" if processed_data is not None else "miss"
+
+    if processed_data is None:
+        # Read the workbook straight from the spooled upload (memory-mapped when on disk)
+        with measure_memory(f"parse of {file.filename} ({file.size} bytes)") as memory, \
+                open_upload(file) as data:
             # Specify the sheet names directly from the template
             sheet_names = list(template.keys())  # Assume template might specify multiple sheets
             dfs = pd.read_excel(data, sheet_name=sheet_names)
@@ -235,33 +251,142 @@ async def parse(file: UploadFile = File(...)):
             processed_data = {}
             for sheet_name, df in dfs.items():
                 if sheet_name in template:
-                    df_processed = dynamic_apply_template(df, template[sheet_name])
-                    processed_data[sheet_name] = df_processed.to_dict(orient='records')
-
-            # If only interested in "Stock transfer & Delivery", directly return its data
-            if "Stock transfer & Delivery" in processed_data:
-                records = processed_data["Stock transfer & Delivery"]
-                vehicles = generate_vehicle_locations(records,
-                                                      150)
-                records = apply_exclusive_customers(records, processed_data['Sheet2'])
-                return {'records': records, 'vehicles': vehicles, 'exclusive_customers': processed_data['Sheet2']}
+                    processed_data[sheet_name] = frame_records(dynamic_apply_template(df, template[sheet_name], seed))
+            del dfs
+        headers.update(memory.headers())
+
+        if cache_key is not None:
+            get_parse_cache().set(cache_key, processed_data)
+
+    return processed_data, seed, headers
+
+
+@router.post("/api/v1/files/parse", response_class=FastJSONResponse)
+async def parse(request: Request, file: UploadFile = File(...), deterministic: bool = Query(False),
+                x_tenant_id: str = Header(None)):
+    try:
+        profile = get_tenant_registry().get(x_tenant_id)
+    except UnknownTenantError:
+        raise HTTPException(status_code=404, detail="Unknown tenant")
+
+    try:
+        # Opt-in sampling profiler, a no-op unless requested with a valid token
+        with profile_request(request) as profiling:
+            if file.content_type == XLSX_CONTENT_TYPE:
+                # pandas parsing and fleet generation are blocking, keep them off the event loop
+                processed_data, seed, headers = await run_in_threadpool(profiled(parse_workbook), file, profile,
+                                                                        deterministic)
+                headers.update(profiling.headers())
+
+                result = await run_in_threadpool(profiled(build_parse_result), processed_data,
+                                                 profile.vehicle_types, seed)
+                if result is not None:
+                    return json_response(result, request, headers=headers)
+                else:
+                    return JSONResponse(content={"error": "Specified sheet not found in the file"}, status_code=404)
             else:
-                return JSONResponse(content={"error": "Specified sheet not found in the file"}, status_code=404)
-        else:
-            raise HTTPException(status_code=400, detail="Unsupported file type")
+                raise HTTPException(status_code=400, detail="Unsupported file type")
+    except ProfilingForbidden:
+        raise HTTPException(status_code=403, detail="Profiling is not allowed")
     except Exception as e:
         logger.exception("An error occurred during file processing", exc_info=e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
-def apply_exclusive_customers(data, exclusive_customers):
-    # Iterate over each element in data
-    for element in data:
-        # Check if the customer exists in the exclusive_customers array
-        customer = element.get('customer')
-        if customer in (customer_info.get('customer') for customer_info in exclusive_customers):
-            element['exclusive'] = True  # Set flag to True if customer is exclusive
+@router.post("/api/v1/files/parse-bulk", response_class=FastJSONResponse)
+async def parse_bulk(request: Request, files: List[UploadFile] = File(...), merge: bool = Query(False),
+                     deterministic: bool = Query(False), x_tenant_id: str = Header(None)):
+    """
+    Parse many workbooks at once. Every (workbook, sheet) pair is parsed in parallel on the
+    process pool. Returns one result per file, or with `merge=true` a single record set
+    with the exclusive customers of all files applied across all records.
+    """
+    try:
+        profile = get_tenant_registry().get(x_tenant_id)
+    except UnknownTenantError:
+        raise HTTPException(status_code=404, detail="Unknown tenant")
+
+    template = profile.parse_template
+    loop = asyncio.get_running_loop()
+    pool = get_process_pool()
+    cache = get_parse_cache()
+
+    seeds = {}
+    processed = {}
+    with tempfile.TemporaryDirectory(prefix="parse_bulk_") as workdir:
+        # Workers open the workbooks by path, copy each spooled upload to the work directory
+        paths = {}
+        errors = {}
+        for index, upload in enumerate(files):
+            if upload.content_type != XLSX_CONTENT_TYPE:
+                errors[index] = "Unsupported file type"
+                continue
+            if deterministic:
+                seeds[index] = hash_upload(upload.file)
+                cached = cache.get(parse_cache_key(seeds[index], profile))
+                if cached is not None:
+                    processed[index] = cached
+                    continue
+            path = os.path.join(workdir, f"{index}.xlsx")
+            upload.file.seek(0)
+            with open(path, 'wb') as target:
+                shutil.copyfileobj(upload.file, target, 1024 * 1024)
+            paths[index] = path
+
+        tasks = {
+            (index, sheet_name): loop.run_in_executor(pool, parse_sheet_file, path, sheet_name,
+                                                      template[sheet_name], seeds.get(index))
+            for index, path in paths.items()
+            for sheet_name in template
+        }
+        outcomes = await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+    processed.update({index: {} for index in paths})
+    for (index, sheet_name), outcome in zip(tasks.keys(), outcomes):
+        if isinstance(outcome, Exception):
+            logger.error(f"Failed to parse sheet '{sheet_name}' of {files[index].filename}: {outcome}")
+            errors[index] = "File could not be parsed"
+        else:
+            processed[index][sheet_name] = outcome
+
+    if deterministic:
+        for index in paths:
+            if index not in errors:
+                cache.set(parse_cache_key(seeds[index], profile), processed[index])
+
+    if merge:
+        # One record set, exclusive customers of every file apply to every record
+        merged = {MAIN_SHEET: [], EXCLUSIVE_SHEET: []}
+        seen_customers = set()
+        for index in sorted(processed):
+            if index in errors:
+                continue
+            merged[MAIN_SHEET].extend(processed[index].get(MAIN_SHEET, []))
+            for customer_info in processed[index].get(EXCLUSIVE_SHEET, []):
+                if customer_info.get('customer') not in seen_customers:
+                    seen_customers.add(customer_info.get('customer'))
+                    merged[EXCLUSIVE_SHEET].append(customer_info)
+        merged_seed = hashlib.sha256("".join(sorted(seeds.values())).encode("utf-8")).hexdigest() \
+            if deterministic else None
+        result = build_parse_result(merged, profile.vehicle_types, merged_seed) if merged[MAIN_SHEET] else None
+        return json_response({
+            **(result or {'records': [], 'vehicles': [], 'exclusive_customers': []}),
+            'errors': [{'filename': files[index].filename, 'error': error} for index, error in sorted(errors.items())],
+        }, request)
+
+    results = []
+    for index, upload in enumerate(files):
+        if index in errors:
+            results.append({'filename': upload.filename, 'error': errors[index]})
+            continue
+        result = build_parse_result(processed[index], profile.vehicle_types, seeds.get(index))
+        if result is None:
+            results.append({'filename': upload.filename, 'error': "Specified sheet not found in the file"})
         else:
-            element['exclusive'] = False  # Set flag to False if customer is not exclusive
+            results.append({'filename': upload.filename, **result})
+    return json_response({'files': results}, request)
 
-    return data  # Return the modified data array
+
+def apply_exclusive_customers(data, exclusive_customers):
+    # One vectorized lookup against the normalized exclusive customer index
+    return ExclusiveCustomerIndex.for_customers(exclusive_customers).apply(data)
@@ -0,0 +1,29 @@
+import hashlib
+import os
+from functools import lru_cache
+
+from app.models.cache.tiered_cache import TieredCache
+
+PARSE_CACHE_MEMORY_BYTES = int(os.getenv("PARSE_CACHE_MEMORY_BYTES", str(64 * 1024 * 1024)))
+PARSE_CACHE_DIR = os.getenv("PARSE_CACHE_DIR", "/tmp/parse_cache")
+PARSE_CACHE_MAX_BYTES = int(os.getenv("PARSE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+
+@lru_cache(maxsize=None)
+def get_parse_cache() -> TieredCache:
+    return TieredCache("parse", PARSE_CACHE_MEMORY_BYTES, PARSE_CACHE_DIR, PARSE_CACHE_MAX_BYTES)
+
+
+def hash_upload(fileobj) -> str:
+    # Stream the spooled upload through sha256, then rewind it for the parser
+    digest = hashlib.sha256()
+    fileobj.seek(0)
+    for chunk in iter(lambda: fileobj.read(1024 * 1024), b""):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+def parse_cache_key(content_hash, profile) -> str:
+    # A new template or vehicle profile version invalidates every parsed workbook of the tenant
+    return f"{profile.tenant_id}:{profile.version}:{content_hash}"
@@ -0,0 +1,165 @@
+import io
+import logging
+import mmap
+import os
+import resource
+import tracemalloc
+from contextlib import contextmanager
+
+from starlette.formparsers import MultiPartParser
+from starlette.responses import JSONResponse
+
+# Uploads larger than this are rejected with 413 while they are being received
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+# Parts larger than this are spooled to a temp file on disk instead of memory
+UPLOAD_SPOOL_BYTES = int(os.getenv("UPLOAD_SPOOL_BYTES", str(1024 * 1024)))
+# tracemalloc gives exact Python/NumPy peaks but slows parsing down, off by default
+UPLOAD_MEMORY_TRACE = os.getenv("UPLOAD_MEMORY_TRACE", "0") in ("1", "true")
+
+MultiPartParser.max_file_size = UPLOAD_SPOOL_BYTES
+
+
+class UploadLimitMiddleware:
+    """Reject request bodies over MAX_UPLOAD_BYTES on the upload paths before they are fully read."""
+
+    def __init__(self, app, paths=("/api/v1/files/", "/api/v1/optimize-file"), max_bytes=None):
+        self.app = app
+        self.paths = tuple(paths)
+        self.max_bytes = max_bytes or MAX_UPLOAD_BYTES
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.paths):
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_bytes:
+            await self._reject(scope, receive, send)
+            return
+
+        # Chunked uploads have no length, count the bytes as they arrive
+        received = 0
+        too_large = False
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received, too_large
+            if too_large:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # The app sees the client going away, the 413 is sent from here. Raising
+                    # instead would be turned into a 400 by FastAPI's body parsing.
+                    too_large = True
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            nonlocal response_started
+            if too_large and not response_started:
+                # Whatever the app answers to the cut-off body is replaced by the 413
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not too_large or response_started:
+                raise
+        if too_large and not response_started:
+            await self._reject(scope, receive, send)
+
+    async def _reject(self, scope, receive, send):
+        response = JSONResponse({"detail": f"Upload exceeds {self.max_bytes} bytes"}, status_code=413)
+        await response(scope, receive, send)
+
+
+class MappedFile(io.RawIOBase):
+    """Seekable file object over an mmap (mmap itself has no `seekable()` before Python 3.13)."""
+
+    def __init__(self, mapped):
+        self._mapped = mapped
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._mapped.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self._mapped.seek(offset, whence)
+        return self._mapped.tell()
+
+    def tell(self):
+        return self._mapped.tell()
+
+
+@contextmanager
+def open_upload(upload):
+    """
+    Yield a readable, seekable view of an uploaded file without copying it into memory.
+
+    Parts larger than UPLOAD_SPOOL_BYTES were already spooled to disk by the multipart
+    parser, those are memory-mapped. Small parts are read from the in-memory spool.
+    """
+    spooled = upload.file
+    spooled.seek(0)
+
+    if not getattr(spooled, "_rolled", False):
+        yield spooled
+        return
+
+    mapped = mmap.mmap(spooled.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        yield MappedFile(mapped)
+    finally:
+        mapped.close()
+
+
+class MemoryUsage:
+    def __init__(self):
+        self.peak_kb = None
+        self.method = "tracemalloc" if UPLOAD_MEMORY_TRACE else "max_rss"
+
+    def headers(self) -> dict:
+        # Only the traced peak is reported to clients, max RSS growth is a process-wide figure
+        if self.peak_kb is None or self.method != "tracemalloc":
+            return {}
+        return {"X-Upload-Peak-Memory-Kb": str(self.peak_kb)}
+
+
+@contextmanager
+def measure_memory(label):
+    """
+    Peak memory while the enclosed block runs. With UPLOAD_MEMORY_TRACE it is the traced
+    allocation peak, sent as X-Upload-Peak-Memory-Kb. It includes whatever concurrent
+    requests allocate meanwhile, and a request that starts while another one is traced
+    gets no figure. Without it only the growth of the process max RSS is logged (a
+    high-water mark: 0 once an earlier request peaked higher), no header is sent.
+    """
+    usage = MemoryUsage()
+    tracing = UPLOAD_MEMORY_TRACE and not tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.start()
+    max_rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        yield usage
+    finally:
+        if tracing:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            usage.peak_kb = peak // 1024
+            logging.info(f"Peak memory for {label}: {usage.peak_kb} KB (tracemalloc)")
+        elif not UPLOAD_MEMORY_TRACE:
+            usage.peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - max_rss_before
+            logging.info(f"Process max RSS growth during {label}: {usage.peak_kb} KB")
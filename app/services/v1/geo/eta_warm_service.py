@@ -0,0 +1,33 @@
+import hmac
+import os
+
+from fastapi import APIRouter, HTTPException, Header, Query, BackgroundTasks
+from starlette.responses import JSONResponse
+
+from app.models.geo.eta.eta_cache import get_eta_cache
+from app.services.v1.scheduling.eta_warmer import get_eta_warmer
+
+router = APIRouter()
+
+
+def is_authorized(token: str) -> bool:
+    # Warming spends ETA quota, disabled unless ETA_WARM_TOKEN is configured
+    expected = os.getenv("ETA_WARM_TOKEN")
+    return bool(expected) and bool(token) and hmac.compare_digest(expected, token)
+
+
+@router.post("/api/v1/eta/warm")
+async def warm_eta_cache(background_tasks: BackgroundTasks, force: bool = Query(False),
+                         x_warm_token: str = Header(None)):
+    """Start a warming run after the response is sent, `force` runs it outside the off-peak window."""
+    if not is_authorized(x_warm_token):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    background_tasks.add_task(get_eta_warmer().run, force)
+    return JSONResponse(content={"status": "scheduled"}, status_code=202)
+
+
+@router.get("/api/v1/eta/warm")
+async def eta_warm_status(x_warm_token: str = Header(None)):
+    if not is_authorized(x_warm_token):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return {"last_run": get_eta_warmer().last_run, "cache": get_eta_cache().stats()}
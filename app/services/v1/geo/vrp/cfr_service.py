@@ -1,36 +1,208 @@
-from fastapi import APIRouter, HTTPException
+import time
+
+from fastapi import APIRouter, HTTPException, Request, Header, Query, UploadFile, File
+from starlette.concurrency import run_in_threadpool
 from app.models.geo.vrp.cfr.cfr import CFR  # Import CFR model
+from app.models.geo.vrp.cfr.offload import run_offloaded, CFR_PROCESS_OFFLOAD
+from app.services.v1.workers.process_pool import get_process_pool
+from app.models.geo.eta.route_geometry import route_geometry, read_geometry_token, InvalidGeometryToken, \
+    GEOMETRY_TOKEN_TTL_SECONDS, tokens_enabled
+from app.models.tenants.tenant_registry import get_tenant_registry, UnknownTenantError
+from app.services.v1.debug.profiler import profile_request, profiled, ProfilingForbidden
+from app.services.v1.debug.capture import Capture, should_capture
+from app.services.v1.http.responses import FastJSONResponse, json_response, encoded_response, server_timing
+from app.services.v1.files.parsers.files_parser_service import parse_workbook, build_solve_request, \
+    XLSX_CONTENT_TYPE
+from app.services.v1.files.uploads import measure_memory
+from app.services.v1.scheduling.solve_scheduler import get_scheduler, SchedulerSaturated
+from app.services.v1.scheduling.deadline import Deadline, DeadlineExceeded
+from app.services.v1.scheduling.solve_budget import get_tier, get_solve_budget_model, LATENCY_TIERS
+from app.services.v1.geo.vrp.plan_export_service import export_plan
+from app.services.v1.geo.vrp.plan_store_service import store_plan, PLAN_ID_QUERY_PATTERN
+from app.models.geo.vrp.cfr.plan_store import get_plan_store
 import logging
-from concurrent.futures import ThreadPoolExecutor
-import asyncio
 
 router = APIRouter()
 
+TIER_PATTERN = f"^({'|'.join(LATENCY_TIERS)})$"
+
 # Setup basic logging
 logging.basicConfig(level=logging.INFO)
 
-# Define a global executor
-executor = ThreadPoolExecutor(max_workers=10)
+
+def check_geometry(geometry):
+    # Lazy plans carry signed tokens, without a shared secret no instance could resolve them
+    if geometry == "lazy" and not tokens_enabled():
+        raise HTTPException(status_code=400, detail="geometry=lazy is not available, GEOMETRY_TOKEN_SECRET is not set")
+
+
+@router.post("/api/v1/optimize-route", response_class=FastJSONResponse)
+async def optimize_route(request_body: dict, request: Request, x_tenant_id: str = Header(None),
+                         export: str = Query(None, pattern="^(parquet|arrow)$"),
+                         consolidate: bool = Query(None), deadline: float = Query(None, gt=0),
+                         tier: str = Query(None, pattern=TIER_PATTERN), matrices: bool = Query(None),
+                         geometry: str = Query(None, pattern="^(full|lazy)$"),
+                         plan_id: str = Query(None, pattern=PLAN_ID_QUERY_PATTERN), store: bool = Query(False)):
+    check_geometry(geometry)
+    # The whole request shares one deadline (the tier's deadline at most), queueing included
+    request_deadline = Deadline.for_request(deadline, get_tier(tier).deadline_seconds)
+
+    # Templates come from the tenant's profile, loaded once and kept in memory
+    try:
+        profile = get_tenant_registry().get(x_tenant_id)
+    except UnknownTenantError:
+        raise HTTPException(status_code=404, detail="Unknown tenant")
+
+    cfr_model = CFR(profile.cfr_template_path, request_body, template_content=profile.cfr_template,
+                    eta_executor=get_scheduler().eta_executor, consolidate=consolidate, deadline=request_deadline,
+                    tier=tier, matrices=matrices, geometry=geometry)
+    result, headers = await solve(request, profile, cfr_model)
+    return await plan_response(result, request, profile, headers, export, plan_id, store)
+
+
+@router.post("/api/v1/optimize-file", response_class=FastJSONResponse)
+async def optimize_file(request: Request, file: UploadFile = File(...), x_tenant_id: str = Header(None),
+                        export: str = Query(None, pattern="^(parquet|arrow)$"), consolidate: bool = Query(None),
+                        deadline: float = Query(None, gt=0), deterministic: bool = Query(False),
+                        tier: str = Query(None, pattern=TIER_PATTERN), matrices: bool = Query(None),
+                        geometry: str = Query(None, pattern="^(full|lazy)$"),
+                        plan_id: str = Query(None, pattern=PLAN_ID_QUERY_PATTERN), store: bool = Query(False)):
+    """
+    Upload-and-optimize in one call: the workbook is parsed and solved in-process, the
+    records never go through a JSON response and back. Same result as posting the
+    `/api/v1/files/parse` response to `/api/v1/optimize-route`.
+    """
+    check_geometry(geometry)
+    # Parsing counts against the same deadline as the solve
+    request_deadline = Deadline.for_request(deadline, get_tier(tier).deadline_seconds)
+
+    try:
+        profile = get_tenant_registry().get(x_tenant_id)
+    except UnknownTenantError:
+        raise HTTPException(status_code=404, detail="Unknown tenant")
+
+    if file.content_type != XLSX_CONTENT_TYPE:
+        raise HTTPException(status_code=400, detail="Unsupported file type")
+
+    # Peak memory of the whole pipeline, comparable with the parse + optimize-route calls
+    with measure_memory(f"optimize of {file.filename} ({file.size} bytes)") as memory:
+        started = time.perf_counter()
+        try:
+            # pandas parsing is blocking, keep it off the event loop
+            processed_data, seed, parse_headers = await run_in_threadpool(parse_workbook, file, profile,
+                                                                          deterministic)
+            request_body, fleet = await run_in_threadpool(build_solve_request, processed_data,
+                                                          profile.vehicle_types, seed)
+        except Exception as e:
+            logging.exception("An error occurred during file processing", exc_info=e)
+            raise HTTPException(status_code=500, detail="File could not be parsed")
+        parse_seconds = time.perf_counter() - started
+
+        if request_body is None:
+            raise HTTPException(status_code=404, detail="Specified sheet not found in the file")
+
+        cfr_model = CFR(profile.cfr_template_path, request_body, template_content=profile.cfr_template,
+                        eta_executor=get_scheduler().eta_executor, consolidate=consolidate, deadline=request_deadline,
+                        tier=tier, matrices=matrices, geometry=geometry, fleet=fleet)
+        result, headers = await solve(request, profile, cfr_model, {"parse": parse_seconds})
+
+    headers.update(parse_headers)
+    headers.update(memory.headers())
+    return await plan_response(result, request, profile, headers, export, plan_id, store)
+
+
+async def plan_response(result, request, profile, headers, export=None, plan_id=None, store=False):
+    body = None
+    if plan_id or store:
+        # Kept as the next version of the plan (a new plan without plan_id), polled via /api/v1/plans
+        body = await run_in_threadpool(store_plan, result, profile.tenant_id, plan_id, headers)
+
+    # Export mode writes the plan as columnar tables and only returns where to fetch them
+    if export:
+        # Table building and file writes are blocking, keep them off the event loop
+        manifest = await run_in_threadpool(export_plan, result, export, profile.tenant_id)
+        return json_response(manifest, request, headers=headers)
+
+    if body is not None:
+        # Already serialized for the store
+        return encoded_response(body, request, headers=headers)
+    # Serialize directly (no jsonable_encoder walk) and compress large plans
+    return json_response(result, request, headers=headers)
+
+
+async def solve(request, profile, cfr_model, timings=None):
+    """Run the CFR solve on a solver slot, returns the mapped plan and the response headers."""
+    # The scheduler owns the solver slots and the shared ETA pool
+    scheduler = get_scheduler()
+
+    if should_capture(request):
+        # Copied before the solve adds its location tags, replayed by app/tools/replay_capture.py
+        cfr_model.capture = Capture(cfr_model.data, template=cfr_model.get_template_content(),
+                                    tenant_id=profile.tenant_id, params={
+                                        "tier": cfr_model.tier.name, "matrices": cfr_model.matrices,
+                                        "consolidate": cfr_model.consolidate,
+                                        "geometry": "lazy" if cfr_model.lazy_geometry else "full"})
+
+    try:
+        # Opt-in sampling profiler, a no-op unless requested with a valid token
+        with profile_request(request) as profiling:
+            # Run the blocking solve on a solver slot, rejected right away when the queue is full
+            if CFR_PROCESS_OFFLOAD:
+                # CPU-bound stages on the process pool, the solver thread only waits on I/O
+                solve_fn = lambda: run_offloaded(cfr_model, get_process_pool())
+            else:
+                solve_fn = lambda: cfr_model.callCFR(cfr_model.match_vehicles_types(cfr_model.prepare_payload()))
+            result = await scheduler.run(profile.tenant_id, profiled(solve_fn))
+    except ProfilingForbidden:
+        raise HTTPException(status_code=403, detail="Profiling is not allowed")
+    except SchedulerSaturated as exc:
+        raise HTTPException(status_code=503, detail=f"Solver is busy: {exc.reason}",
+                            headers={"Retry-After": str(exc.retry_after)})
+    except DeadlineExceeded as exc:
+        raise HTTPException(status_code=504, detail=f"Request deadline exceeded before {exc.stage}")
+
+    headers = dict(profiling.headers())
+    headers.update(server_timing({**(timings or {}), **cfr_model.timings}))
+    if cfr_model.degraded_legs:
+        # Directions of these legs are straight-line estimates
+        headers["X-Eta-Degraded-Legs"] = str(cfr_model.degraded_legs)
+    if cfr_model.matrix_status:
+        # Built (rows x columns), or why the solver used its own travel times
+        headers["X-Eta-Matrices"] = cfr_model.matrix_status
+    if cfr_model.capture is not None:
+        await run_in_threadpool(save_capture, cfr_model)
+    return result, headers
 
 
-@router.post("/api/v1/optimize-route")
-async def optimize_route(request_body: dict):
-    # Example path to template file
-    template_path = "app/storage/cfr/silal_main_full.json"
+def save_capture(cfr_model):
+    # A failed capture never fails the request
+    try:
+        cfr_model.capture.record_directions(cfr_model.leg_responses.values())
+        cfr_model.capture.save()
+    except Exception as exc:
+        logging.warning(f"Could not save the request capture: {exc}")
 
-    # Create an instance of CFR model
-    cfr_model = CFR(template_path, request_body)
 
-    # Get the current event loop
-    loop = asyncio.get_running_loop()
+@router.get("/api/v1/geometry/{token}", response_class=FastJSONResponse)
+async def route_geometry_by_token(token: str, request: Request):
+    """Polylines of one route of a plan solved with `geometry=lazy`, from the ETA cache when possible."""
+    try:
+        points, country = read_geometry_token(token)
+    except InvalidGeometryToken as exc:
+        raise HTTPException(status_code=404, detail=f"Invalid geometry token: {exc}")
 
-    # Run the blocking operation in a separate thread
-    # Assuming `callCFR` is the blocking call that you want to run in a thread
+    # Blocking ETA calls, on the shared ETA pool like the solve's directions
+    result = await run_in_threadpool(route_geometry, points, country, get_scheduler().eta_executor)
+    headers = {"Cache-Control": f"private, max-age={int(GEOMETRY_TOKEN_TTL_SECONDS)}"}
+    if result["degraded_legs"]:
+        # Straight-line estimates, the next request may get the real directions
+        headers["Cache-Control"] = "no-store"
+        headers["X-Eta-Degraded-Legs"] = str(result["degraded_legs"])
+    return json_response(result, request, headers=headers)
 
-    # return cfr_model.prepare_payload()
-    result = await loop.run_in_executor(
-        executor,
-        lambda: cfr_model.callCFR(cfr_model.match_vehicles_types(cfr_model.prepare_payload()))
-    )
 
-    return result
+@router.get("/api/v1/optimize-route/stats")
+async def optimize_route_stats():
+    # Queue depth and wait times of the solver scheduler, the solve budget model and the plan store
+    return {**get_scheduler().stats(), "solve_budget": get_solve_budget_model().stats(),
+            "plan_store": get_plan_store().stats()}
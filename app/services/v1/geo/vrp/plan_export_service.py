@@ -0,0 +1,95 @@
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+
+from fastapi import APIRouter, HTTPException, Header
+from starlette.responses import FileResponse
+
+from app.models.cache.shared_storage import storage_path
+from app.models.geo.vrp.cfr.plan_tables import build_plan_tables, write_plan_tables, TABLE_NAMES, EXTENSIONS
+from app.models.tenants.tenant_registry import get_tenant_registry, UnknownTenantError
+
+router = APIRouter()
+
+# Must be shared storage when more than one instance serves downloads (Lambda: SHARED_STORAGE_DIR on EFS)
+EXPORT_DIR = os.getenv("PLAN_EXPORT_DIR", storage_path("plan_exports", "/tmp/plan_exports"))
+# Exports are deleted once older than this, checked at most every EXPORT_CLEANUP_INTERVAL_SECONDS
+EXPORT_TTL_SECONDS = float(os.getenv("PLAN_EXPORT_TTL_SECONDS", str(24 * 3600)))
+EXPORT_CLEANUP_INTERVAL_SECONDS = float(os.getenv("PLAN_EXPORT_CLEANUP_INTERVAL_SECONDS", "600"))
+EXPORT_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+MEDIA_TYPES = {
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.file",
+}
+
+_cleanup_lock = threading.Lock()
+_last_cleanup = 0.0
+
+
+def export_plan(plan: dict, export_format: str, tenant_id: str) -> dict:
+    """Write the mapped plan as columnar tables and return a manifest with their download urls."""
+    cleanup_exports()
+    export_id = uuid.uuid4().hex
+    paths = write_plan_tables(build_plan_tables(plan), os.path.join(EXPORT_DIR, tenant_id, export_id),
+                              export_format)
+
+    return {
+        "export_id": export_id,
+        "format": export_format,
+        "expires_in": int(EXPORT_TTL_SECONDS),
+        "tables": {
+            name: {
+                "url": f"/api/v1/exports/{export_id}/{name}",
+                "bytes": os.path.getsize(path),
+            }
+            for name, path in paths.items()
+        }
+    }
+
+
+def cleanup_exports(force=False):
+    """Delete exports older than PLAN_EXPORT_TTL_SECONDS, of every tenant."""
+    global _last_cleanup
+    now = time.time()
+    with _cleanup_lock:
+        if not force and now - _last_cleanup < EXPORT_CLEANUP_INTERVAL_SECONDS:
+            return
+        _last_cleanup = now
+    if not os.path.isdir(EXPORT_DIR):
+        return
+    for tenant in os.scandir(EXPORT_DIR):
+        if not tenant.is_dir():
+            continue
+        for export in os.scandir(tenant.path):
+            try:
+                if export.is_dir() and now - export.stat().st_mtime > EXPORT_TTL_SECONDS:
+                    shutil.rmtree(export.path, ignore_errors=True)
+            except OSError as exc:
+                logging.warning(f"Could not clean up export {export.path}: {exc}")
+
+
+@router.get("/api/v1/exports/{export_id}/{table}")
+async def download_export(export_id: str, table: str, x_tenant_id: str = Header(None)):
+    if not EXPORT_ID_PATTERN.match(export_id) or table not in TABLE_NAMES:
+        raise HTTPException(status_code=404, detail="Export not found")
+    try:
+        tenant_id = get_tenant_registry().get(x_tenant_id).tenant_id
+    except UnknownTenantError:
+        raise HTTPException(status_code=404, detail="Unknown tenant")
+
+    # Only the tenant that exported the plan finds it
+    directory = os.path.join(EXPORT_DIR, tenant_id, export_id)
+    if not os.path.isdir(directory) or time.time() - os.path.getmtime(directory) > EXPORT_TTL_SECONDS:
+        raise HTTPException(status_code=404, detail="Export not found")
+
+    for export_format, extension in EXTENSIONS.items():
+        path = os.path.join(directory, f"{table}.{extension}")
+        if os.path.exists(path):
+            return FileResponse(path, media_type=MEDIA_TYPES[export_format], filename=os.path.basename(path),
+                                headers={"Cache-Control": "private"})
+
+    raise HTTPException(status_code=404, detail="Export not found")
@@ -0,0 +1,100 @@
+from fastapi import APIRouter, HTTPException, Request, Header, Query
+from starlette.concurrency import run_in_threadpool
+
+from app.models.geo.vrp.cfr.plan_store import get_plan_store, PlanVersionGone, PLAN_ID_PATTERN, \
+    PLAN_STORE_TTL_SECONDS
+from app.models.tenants.tenant_registry import get_tenant_registry, UnknownTenantError
+from app.services.v1.http.responses import FastJSONResponse, dumps, encoded_response, etag_matches, not_modified
+
+router = APIRouter()
+
+PLAN_ID_QUERY_PATTERN = PLAN_ID_PATTERN.pattern
+
+
+def plan_headers(head) -> dict:
+    return {"ETag": head["etag"], "X-Plan-Id": head["plan_id"], "X-Plan-Version": str(head["version"])}
+
+
+def store_plan(result, tenant_id, plan_id=None, headers=None) -> bytes:
+    """Serialize the mapped plan once, store it as the next version of `plan_id` and return the body."""
+    body = dumps(result)
+    head = get_plan_store().save(tenant_id, result, body, plan_id)
+    if headers is not None:
+        headers.update(plan_headers(head))
+    return body
+
+
+def get_head(x_tenant_id, plan_id):
+    try:
+        tenant_id = get_tenant_registry().get(x_tenant_id).tenant_id
+    except UnknownTenantError:
+        raise HTTPException(status_code=404, detail="Unknown tenant")
+    head = get_plan_store().head(tenant_id, plan_id)
+    if head is None:
+        raise HTTPException(status_code=404, detail="Plan not found")
+    return tenant_id, head
+
+
+@router.get("/api/v1/plans/{plan_id}", response_class=FastJSONResponse)
+async def get_plan(request: Request, plan_id: str, x_tenant_id: str = Header(None),
+                   if_none_match: str = Header(None), version: int = Query(None, ge=1)):
+    """
+    A stored plan, the latest version unless `version` is given. The ETag is a hash of
+    the plan, answers 304 without loading the plan when If-None-Match names the content
+    the client already has. Plans are stored in PLAN_STORE_DIR, without a directory
+    shared by every instance (SHARED_STORAGE_DIR on Lambda) a plan is 404 on instances
+    other than the one that stored it.
+    """
+    if not PLAN_ID_PATTERN.match(plan_id):
+        raise HTTPException(status_code=404, detail="Plan not found")
+    tenant_id, head = get_head(x_tenant_id, plan_id)
+
+    version = version or head["version"]
+    # The latest version must be revalidated, older versions never change
+    cache_control = "private, no-cache" if version == head["version"] else \
+        f"private, max-age={int(PLAN_STORE_TTL_SECONDS)}, immutable"
+    headers = {"X-Plan-Id": plan_id, "X-Plan-Version": str(version), "Cache-Control": cache_control}
+    etag = head["etags"].get(version)
+    if etag is not None and etag_matches(if_none_match, etag):
+        return not_modified(etag, {**headers, "ETag": etag})
+
+    try:
+        entry = await run_in_threadpool(get_plan_store().get, tenant_id, plan_id, version)
+    except PlanVersionGone:
+        raise HTTPException(status_code=404, detail=f"Version {version} of the plan is not available")
+    headers["ETag"] = entry["etag"]
+    if etag_matches(if_none_match, entry["etag"]):
+        return not_modified(entry["etag"], headers)
+    # Sent as stored, the plan is not serialized again
+    return encoded_response(entry["body"], request, headers=headers)
+
+
+@router.get("/api/v1/plans/{plan_id}/delta", response_class=FastJSONResponse)
+async def get_plan_delta(request: Request, plan_id: str, since: int = Query(..., ge=1),
+                         x_tenant_id: str = Header(None), if_none_match: str = Header(None)):
+    """
+    Vehicles added, removed and changed from version `since` to the latest version. A
+    changed vehicle carries the route fields that differ and one splice of its steps
+    (`steps[start:start + delete] = insert`). The ETag is the latest version's, a client
+    polling with the ETag of its current version gets 304 until the plan changes. 410
+    when `since` is no longer kept, the client then fetches the full plan. Like the full
+    plan, deltas need PLAN_STORE_DIR shared by every instance (SHARED_STORAGE_DIR on
+    Lambda), other instances answer 404 otherwise.
+    """
+    if not PLAN_ID_PATTERN.match(plan_id):
+        raise HTTPException(status_code=404, detail="Plan not found")
+    tenant_id, head = get_head(x_tenant_id, plan_id)
+
+    headers = {**plan_headers(head), "Cache-Control": "private, no-cache"}
+    if etag_matches(if_none_match, head["etag"]):
+        return not_modified(head["etag"], headers)
+    if since > head["version"]:
+        raise HTTPException(status_code=404, detail=f"Version {since} of the plan does not exist")
+    if since not in head["versions"]:
+        raise HTTPException(status_code=410, detail=f"Version {since} is no longer available, fetch the full plan")
+
+    try:
+        body = await run_in_threadpool(get_plan_store().delta_body, tenant_id, plan_id, since, head["version"])
+    except PlanVersionGone:
+        raise HTTPException(status_code=410, detail=f"Version {since} is no longer available, fetch the full plan")
+    return encoded_response(body, request, headers=headers)
@@ -0,0 +1,136 @@
+import gzip
+import json
+import logging
+import os
+
+from starlette.responses import Response
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, fall back to the stdlib encoder
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional, gzip is always available
+    zstandard = None
+
+# Responses smaller than this are sent uncompressed, compressing them costs more than it saves
+COMPRESSION_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESSION_MIN_BYTES", "1400"))
+GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", "5"))
+ZSTD_LEVEL = int(os.getenv("RESPONSE_ZSTD_LEVEL", "3"))
+
+if orjson is not None:
+    ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def _default(obj):
+    # pandas / numpy scalars and timestamps that slip through from the parser
+    if hasattr(obj, "item"):
+        return obj.item()
+    if hasattr(obj, "isoformat"):
+        return obj.isoformat()
+    return str(obj)
+
+
+def dumps(content) -> bytes:
+    """Serialize plain python data (dicts, lists, numpy values) to JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=ORJSON_OPTIONS)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def parse_accept_encoding(header: str) -> dict:
+    # Map every accepted coding to its q value, e.g. "gzip;q=0.8, zstd" -> {"gzip": 0.8, "zstd": 1.0}
+    accepted = {}
+    for part in header.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        coding, _, params = part.partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding.strip().lower()] = q
+    return accepted
+
+
+def choose_encoding(accept_encoding: str, size: int):
+    if size < COMPRESSION_MIN_BYTES or not accept_encoding:
+        return None
+
+    accepted = parse_accept_encoding(accept_encoding)
+    wildcard = accepted.get("*", 0.0)
+
+    # zstd is preferred when the client supports it, it is faster than gzip at a better ratio
+    candidates = ["zstd", "gzip"] if zstandard is not None else ["gzip"]
+    best, best_q = None, 0.0
+    for coding in candidates:
+        q = accepted.get(coding, wildcard)
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def server_timing(timings: dict) -> dict:
+    """Server-Timing header from stage durations in seconds, e.g. {"solve": 1.2} -> "solve;dur=1200.0"."""
+    if not timings:
+        return {}
+    return {"Server-Timing": ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items())}
+
+
+class FastJSONResponse(Response):
+    """JSON response rendered directly with orjson, skipping the jsonable_encoder walk."""
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def json_response(content, request, status_code: int = 200, headers: dict = None) -> Response:
+    """
+    Serialize `content` once and compress it with the best encoding the client accepts
+    (zstd, then gzip) when the body is larger than RESPONSE_COMPRESSION_MIN_BYTES.
+    """
+    return encoded_response(dumps(content), request, status_code, headers)
+
+
+def encoded_response(body: bytes, request, status_code: int = 200, headers: dict = None) -> Response:
+    """Like json_response for an already serialized JSON body (e.g. a stored plan)."""
+    headers = dict(headers or {})
+    headers["Vary"] = "Accept-Encoding"
+
+    encoding = choose_encoding(request.headers.get("accept-encoding", ""), len(body))
+    if encoding:
+        raw_size = len(body)
+        body = compress(body, encoding)
+        headers["Content-Encoding"] = encoding
+        logging.debug(f"Compressed response with {encoding}: {raw_size} -> {len(body)} bytes")
+
+    return Response(content=body, status_code=status_code, media_type="application/json", headers=headers)
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """True when an If-None-Match header names `etag` (weak comparison) or is `*`."""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag.removeprefix("W/"):
+            return True
+    return False
+
+
+def not_modified(etag: str, headers: dict = None) -> Response:
+    # No body, the client keeps using its copy
+    return Response(status_code=304, headers={**(headers or {}), "ETag": etag})
@@ -0,0 +1,68 @@
+import os
+import time
+
+# Upper bound on the time /optimize-route may take end to end, requests can only ask for less
+OPTIMIZE_DEADLINE_SECONDS = float(os.getenv("OPTIMIZE_DEADLINE_SECONDS", "110"))
+# Kept back from the solver for fetching directions after it returns
+ETA_RESERVE_SECONDS = float(os.getenv("ETA_RESERVE_SECONDS", "10"))
+# Longest solve ever requested, the previous hard-coded solver timeout
+MAX_SOLVER_SECONDS = float(os.getenv("MAX_SOLVER_SECONDS", "100"))
+# A solve shorter than this is not worth starting
+MIN_SOLVER_SECONDS = 1.0
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a stage cannot start (or usefully run) in the time that is left."""
+
+    def __init__(self, stage: str):
+        super().__init__(f"deadline exceeded before {stage}")
+        self.stage = stage
+
+
+class Deadline:
+    """
+    Point in time by which a request must be answered. Created when the request arrives
+    and handed down to every stage, each takes its budget from what is left.
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    @classmethod
+    def for_request(cls, seconds: float = None, limit: float = None):
+        # `limit` replaces OPTIMIZE_DEADLINE_SECONDS, e.g. the deadline of an overnight tier
+        limit = limit or OPTIMIZE_DEADLINE_SECONDS
+        if seconds is None or seconds <= 0:
+            return cls(limit)
+        return cls(min(seconds, limit))
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def check(self, stage: str):
+        if self.expired():
+            raise DeadlineExceeded(stage)
+
+    def budget(self, cap: float = None, reserve: float = 0.0) -> float:
+        """Time a stage may use: what is left minus `reserve` for later stages, at most `cap`."""
+        budget = max(0.0, self.remaining() - reserve)
+        return min(budget, cap) if cap is not None else budget
+
+    def stage(self, cap: float = None, reserve: float = 0.0) -> "Deadline":
+        """Deadline of a stage that may use `budget(cap, reserve)`, the later stages keep the rest."""
+        stage = Deadline(self.budget(cap=cap, reserve=reserve))
+        stage.expires_at = min(stage.expires_at, self.expires_at)
+        return stage
+
+    def solver_budget(self, cap: float = None) -> float:
+        # Leave ETA_RESERVE_SECONDS for directions, unless that would leave the solver nothing
+        budget = self.budget(cap=cap or MAX_SOLVER_SECONDS, reserve=ETA_RESERVE_SECONDS)
+        if budget < MIN_SOLVER_SECONDS:
+            budget = min(self.remaining(), MIN_SOLVER_SECONDS)
+        if budget < MIN_SOLVER_SECONDS:
+            raise DeadlineExceeded("solve")
+        return budget
@@ -0,0 +1,159 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+
+from app.models.geo.eta.eta_cache import get_eta_cache, leg_cache_key
+from app.models.geo.eta.eta_client import get_eta_client, chain_legs, chunk_route_legs, BatchUnsupported
+from app.models.geo.eta.leg_history import get_leg_history
+
+# Off-peak window in local time ("HH:MM-HH:MM", may wrap midnight), warming outside it needs force
+ETA_WARM_WINDOW = os.getenv("ETA_WARM_WINDOW", "01:00-05:00")
+# Hours from UTC of the window's clock, the depots are in the UAE
+ETA_WARM_UTC_OFFSET_HOURS = float(os.getenv("ETA_WARM_UTC_OFFSET_HOURS", "4"))
+# Legs requested from the ETA service per second, shared by all warming workers
+ETA_WARM_RATE = float(os.getenv("ETA_WARM_RATE", "5"))
+ETA_WARM_WORKERS = int(os.getenv("ETA_WARM_WORKERS", "2"))
+# Most frequent legs considered per run, and how many solves a leg must appear in
+ETA_WARM_MAX_LEGS = int(os.getenv("ETA_WARM_MAX_LEGS", "5000"))
+ETA_WARM_MIN_COUNT = int(os.getenv("ETA_WARM_MIN_COUNT", "2"))
+# A run stops after this long, a scheduled Lambda invocation has 15 minutes at most
+ETA_WARM_MAX_SECONDS = float(os.getenv("ETA_WARM_MAX_SECONDS", "780"))
+
+
+class RateLimiter:
+    """Spaces out work to `rate` units per second across threads."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, units=1):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + units * self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def in_window(window=None, now=None) -> bool:
+    start, _, end = (window or ETA_WARM_WINDOW).partition("-")
+    now = now or datetime.now(timezone.utc) + timedelta(hours=ETA_WARM_UTC_OFFSET_HOURS)
+    minutes = now.hour * 60 + now.minute
+    start_minutes, end_minutes = (int(part[:2]) * 60 + int(part[3:5]) for part in (start.strip(), end.strip()))
+    if start_minutes <= end_minutes:
+        return start_minutes <= minutes < end_minutes
+    return minutes >= start_minutes or minutes < end_minutes
+
+
+class EtaCacheWarmer:
+    """
+    Prefetches the directions of frequent legs (depot -> customer and customer ->
+    customer legs of recent plans, from the leg history) into the ETA cache, so the
+    first plans of the day are served from the cache. Runs off-peak and rate limited,
+    legs already cached are skipped. One run at a time per process.
+
+    The history and the cache live on SHARED_STORAGE_DIR when it is set. Without it the
+    scheduled run only sees the solves of the container it lands on and warms that
+    container's /tmp cache, which on Lambda rarely serves the next plans.
+    """
+
+    def __init__(self, rate=None, workers=None, max_legs=None, min_count=None, max_seconds=None):
+        self.rate = rate if rate is not None else ETA_WARM_RATE
+        self.workers = workers or ETA_WARM_WORKERS
+        self.max_legs = max_legs or ETA_WARM_MAX_LEGS
+        self.min_count = min_count if min_count is not None else ETA_WARM_MIN_COUNT
+        self.max_seconds = max_seconds or ETA_WARM_MAX_SECONDS
+        self._running = threading.Lock()
+        self.last_run = None
+
+    def candidates(self) -> list:
+        """Frequent legs not in the cache yet, most frequent first."""
+        cache = get_eta_cache()
+        legs = get_leg_history().frequent_legs(self.min_count, self.max_legs)
+        return [leg for leg, _ in legs if leg_cache_key(*leg) not in cache]
+
+    def run(self, force=False) -> dict:
+        if not force and not in_window():
+            return {"status": "skipped", "reason": f"outside the warming window {ETA_WARM_WINDOW}"}
+        if not self._running.acquire(blocking=False):
+            return {"status": "skipped", "reason": "already running"}
+        try:
+            summary = self._warm()
+        finally:
+            self._running.release()
+        self.last_run = summary
+        logging.info(f"ETA cache warming: {summary}")
+        return summary
+
+    def _warm(self) -> dict:
+        started = time.monotonic()
+        get_leg_history().compact()
+        legs = self.candidates()
+        summary = {"status": "done", "candidates": len(legs), "warmed": 0, "failed": 0}
+        if not legs:
+            summary["seconds"] = round(time.monotonic() - started, 1)
+            return summary
+
+        cache = get_eta_cache()
+        client = get_eta_client()
+        limiter = RateLimiter(self.rate)
+        stop_at = started + self.max_seconds
+        counts_lock = threading.Lock()
+
+        def count(name, value=1):
+            with counts_lock:
+                summary[name] += value
+
+        def fetch_leg(leg):
+            limiter.acquire()
+            try:
+                cache.set(leg_cache_key(*leg), client.leg(*leg))
+                count("warmed")
+            except Exception as exc:
+                logging.warning(f"ETA warming failed for leg {leg[:4]}: {exc}")
+                count("failed")
+
+        def fetch_chunk(waypoints, country):
+            if time.monotonic() > stop_at:
+                return
+            chunk_legs = [(*waypoints[k], *waypoints[k + 1], country) for k in range(len(waypoints) - 1)]
+            if client.batch_supported:
+                limiter.acquire(len(chunk_legs))
+                try:
+                    for leg, response in zip(chunk_legs, client.route(waypoints, country)):
+                        cache.set(leg_cache_key(*leg), response)
+                    count("warmed", len(chunk_legs))
+                    return
+                except BatchUnsupported:
+                    pass
+                except Exception as exc:
+                    logging.warning(f"ETA warming route request failed, retrying per leg: {exc}")
+            for leg in chunk_legs:
+                if time.monotonic() > stop_at:
+                    return
+                fetch_leg(leg)
+
+        # Chained into routes per country so they go out as few route requests
+        chunks = []
+        for country in sorted({leg[4] for leg in legs}):
+            routes = chain_legs([leg[:4] for leg in legs if leg[4] == country])
+            chunks.extend((waypoints, country) for route in routes for waypoints in chunk_route_legs(route))
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="eta-warm") as executor:
+            list(executor.map(lambda chunk: fetch_chunk(*chunk), chunks))
+
+        if time.monotonic() > stop_at:
+            summary["status"] = "stopped"
+        summary["seconds"] = round(time.monotonic() - started, 1)
+        return summary
+
+
+@lru_cache(maxsize=None)
+def get_eta_warmer() -> EtaCacheWarmer:
+    return EtaCacheWarmer()
@@ -0,0 +1,221 @@
+import json
+import logging
+import math
+import os
+import socket
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+
+from app.models.cache.shared_storage import storage_path, is_shared
+from app.services.v1.scheduling.deadline import OPTIMIZE_DEADLINE_SECONDS, MAX_SOLVER_SECONDS
+
+# Recorded solves, one JSON lines file per container, the budget model is refitted from
+# all of them. On shared storage every container learns from every other container's solves.
+SOLVE_STATS_DIR = os.getenv("SOLVE_STATS_DIR", storage_path("solve_stats", "/tmp/solve_stats"))
+# Files of containers that stopped recording this long ago are deleted
+SOLVE_STATS_MAX_AGE_SECONDS = float(os.getenv("SOLVE_STATS_MAX_AGE_SECONDS", str(14 * 24 * 3600)))
+# Most recent solves kept for fitting
+SOLVE_STATS_MAX = int(os.getenv("SOLVE_STATS_MAX", "2000"))
+# Converged solves needed before the fitted model replaces the prior
+SOLVE_MODEL_MIN_SAMPLES = int(os.getenv("SOLVE_MODEL_MIN_SAMPLES", "20"))
+# Refit after this many new solves
+SOLVE_MODEL_REFIT_EVERY = int(os.getenv("SOLVE_MODEL_REFIT_EVERY", "10"))
+# Predicted solve time is multiplied by this, the fit is a central estimate
+SOLVE_BUDGET_HEADROOM = float(os.getenv("SOLVE_BUDGET_HEADROOM", "1.5"))
+DEFAULT_LATENCY_TIER = os.getenv("DEFAULT_LATENCY_TIER", "standard")
+
+# log(seconds) = a + b * log(shipments + 1) + c * log(vehicles + 1), used until enough solves are recorded
+PRIOR_COEFFICIENTS = (math.log(0.05), 1.0, 0.3)
+
+
+class LatencyTier:
+    def __init__(self, name, min_seconds, max_seconds, deadline_seconds, search_mode, headroom):
+        self.name = name
+        self.min_seconds = min_seconds
+        self.max_seconds = max_seconds
+        # End to end limit of requests in this tier (queueing, solve and directions)
+        self.deadline_seconds = deadline_seconds
+        self.search_mode = search_mode
+        self.headroom = headroom
+
+
+def _tier(name, min_seconds, max_seconds, deadline_seconds, search_mode, headroom):
+    prefix = f"TIER_{name.upper()}"
+    return LatencyTier(
+        name,
+        float(os.getenv(f"{prefix}_MIN_SECONDS", str(min_seconds))),
+        float(os.getenv(f"{prefix}_MAX_SECONDS", str(max_seconds))),
+        float(os.getenv(f"{prefix}_DEADLINE_SECONDS", str(deadline_seconds))),
+        os.getenv(f"{prefix}_SEARCH_MODE", search_mode),
+        float(os.getenv(f"{prefix}_HEADROOM", str(headroom))),
+    )
+
+
+# interactive: answer in seconds, the solver stops as soon as it stops improving
+# standard: the previous behaviour for large plans (up to 100 s), small plans return early
+# overnight: the solver searches the whole budget, large plans get up to the Lambda limit
+LATENCY_TIERS = {
+    tier.name: tier for tier in (
+        _tier("interactive", 2, 15, 25, "RETURN_FAST", 1.0),
+        _tier("standard", 5, MAX_SOLVER_SECONDS, OPTIMIZE_DEADLINE_SECONDS, "RETURN_FAST", SOLVE_BUDGET_HEADROOM),
+        _tier("overnight", 300, 830, 840, "CONSUME_ALL_AVAILABLE_TIME", 10.0),
+    )
+}
+
+
+class UnknownLatencyTier(Exception):
+    pass
+
+
+def get_tier(name=None) -> LatencyTier:
+    tier = LATENCY_TIERS.get(name or DEFAULT_LATENCY_TIER)
+    if tier is None:
+        raise UnknownLatencyTier(name)
+    return tier
+
+
+class SolveBudgetModel:
+    """
+    Predicts how long a solve needs from its shipment and vehicle counts.
+
+    Every solve is recorded with its size, timeout, wall time and objective. Solves that
+    returned before their timeout converged (RETURN_FAST stops when the search stops
+    improving), their wall time is what a plan of that size needs. A least-squares fit of
+    log(seconds) on log(shipments) and log(vehicles) over those solves replaces the prior
+    once SOLVE_MODEL_MIN_SAMPLES of them are recorded. Solves cut off by their timeout
+    or without an objective are kept for the stats but not fitted.
+
+    The objective only tells whether a solve found a solution, it does not change the
+    budget: objective values of different plans are not comparable, so there is no
+    "good enough" objective a plan size could be fitted to. `stats` reports it per tier
+    for monitoring.
+
+    Each container appends to its own file in SOLVE_STATS_DIR and a refit reloads every
+    file there, so with SHARED_STORAGE_DIR set the fit covers the solves of the whole
+    fleet. Without it the stats live in the container's /tmp and every new container
+    starts from the prior.
+    """
+
+    def __init__(self, directory=None, max_samples=None):
+        self.directory = directory if directory is not None else SOLVE_STATS_DIR
+        # Appended by this process only, no two writers share a file
+        self.path = os.path.join(self.directory, f"{socket.gethostname()}-{os.getpid()}.jsonl") \
+            if self.directory else None
+        self.samples = deque(maxlen=max_samples or SOLVE_STATS_MAX)
+        self.coefficients = PRIOR_COEFFICIENTS
+        self.fitted = False
+        self._since_fit = 0
+        self._lock = threading.Lock()
+        self._load()
+        self.fit()
+
+    def _load(self):
+        """Replace the samples with the most recent ones recorded by any container."""
+        if not self.directory or not os.path.isdir(self.directory):
+            return
+        samples = []
+        expired_before = time.time() - SOLVE_STATS_MAX_AGE_SECONDS
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".jsonl"):
+                continue
+            try:
+                if entry.stat().st_mtime < expired_before:
+                    os.remove(entry.path)
+                    continue
+                with open(entry.path, 'r') as file:
+                    samples.extend(json.loads(line) for line in file if line.strip())
+            except (OSError, ValueError) as e:
+                logging.warning(f"Could not load solve stats from {entry.path}: {e}")
+        samples.sort(key=lambda sample: sample.get("at", 0))
+        with self._lock:
+            self.samples = deque(samples, maxlen=self.samples.maxlen)
+
+    def predict(self, shipments: int, vehicles: int) -> float:
+        a, b, c = self.coefficients
+        return math.exp(a + b * math.log(shipments + 1) + c * math.log(vehicles + 1))
+
+    def plan(self, tier: LatencyTier, shipments: int, vehicles: int) -> float:
+        """Solver timeout in seconds for a plan of this size in `tier`."""
+        # With CONSUME_ALL_AVAILABLE_TIME the solver uses all of it, the large headroom of the
+        # overnight tier (10x the converged time) gives big plans the full budget
+        seconds = self.predict(shipments, vehicles) * tier.headroom
+        return max(tier.min_seconds, min(tier.max_seconds, seconds))
+
+    def record(self, tier, shipments, vehicles, timeout, seconds, objective):
+        sample = {
+            "at": round(time.time(), 3),
+            "tier": tier,
+            "shipments": shipments,
+            "vehicles": vehicles,
+            "timeout": round(timeout, 3),
+            "seconds": round(seconds, 3),
+            "objective": objective,
+        }
+        with self._lock:
+            self.samples.append(sample)
+            self._since_fit += 1
+            refit = self._since_fit >= SOLVE_MODEL_REFIT_EVERY
+            if self.path:
+                try:
+                    os.makedirs(self.directory, exist_ok=True)
+                    with open(self.path, 'a') as file:
+                        file.write(json.dumps(sample) + "\n")
+                except OSError as e:
+                    logging.warning(f"Could not record solve stats to {self.path}: {e}")
+        if refit:
+            # Picks up what the other containers recorded since the last fit
+            self._load()
+            self.fit()
+
+    def converged(self):
+        # Returned before the timeout with a solution, the wall time is what the plan needed
+        return [sample for sample in list(self.samples)
+                if sample["objective"] is not None and sample["seconds"] > 0
+                and sample["seconds"] < 0.95 * sample["timeout"]]
+
+    def fit(self):
+        import numpy as np
+
+        samples = self.converged()
+        with self._lock:
+            self._since_fit = 0
+        if len(samples) < SOLVE_MODEL_MIN_SAMPLES:
+            return
+
+        design = np.array([[1.0, math.log(s["shipments"] + 1), math.log(s["vehicles"] + 1)] for s in samples])
+        target = np.log([s["seconds"] for s in samples])
+        coefficients, _, rank, _ = np.linalg.lstsq(design, target, rcond=None)
+        if rank < 3 or not np.all(np.isfinite(coefficients)):
+            # All recorded plans had the same size (or vehicle count), keep the previous model
+            return
+        self.coefficients = tuple(float(value) for value in coefficients)
+        self.fitted = True
+        logging.info(f"Solve budget model refitted on {len(samples)} solves: {self.coefficients}")
+
+    def stats(self) -> dict:
+        samples = list(self.samples)
+        per_tier = {}
+        for sample in samples:
+            tier = per_tier.setdefault(sample["tier"], {"solves": 0, "capped": 0, "objective_per_shipment": []})
+            tier["solves"] += 1
+            if sample["seconds"] >= 0.95 * sample["timeout"]:
+                tier["capped"] += 1
+            if sample["objective"] is not None and sample["shipments"]:
+                tier["objective_per_shipment"].append(sample["objective"] / sample["shipments"])
+        for tier in per_tier.values():
+            values = tier.pop("objective_per_shipment")
+            tier["mean_objective_per_shipment"] = sum(values) / len(values) if values else None
+        return {
+            "shared": is_shared(),
+            "fitted": self.fitted,
+            "coefficients": self.coefficients,
+            "samples": len(samples),
+            "tiers": per_tier,
+        }
+
+
+@lru_cache(maxsize=None)
+def get_solve_budget_model() -> SolveBudgetModel:
+    return SolveBudgetModel()
@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+
+class SchedulerSaturated(Exception):
+    """Raised when a request cannot be queued, `retry_after` is a hint in seconds."""
+
+    def __init__(self, retry_after: int, reason: str):
+        super().__init__(reason)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class SolveScheduler:
+    """
+    Owns the solver slots and the ETA concurrency budget of the process.
+
+    Requests wait in per-tenant queues, a free slot is handed to tenants in round-robin
+    order so one tenant's burst cannot starve the others. When the total queue (or the
+    tenant's share of it) is full the request is rejected immediately with a Retry-After
+    estimate instead of waiting without bound.
+
+    Admission state is only touched from the event loop thread.
+    """
+
+    def __init__(self, solver_slots=None, eta_workers=None, max_queue=None, max_queue_per_tenant=None):
+        self.solver_slots = solver_slots or int(os.getenv("SOLVER_SLOTS", "4"))
+        self.eta_workers = eta_workers or int(os.getenv("ETA_WORKERS", "16"))
+        self.max_queue = max_queue if max_queue is not None else int(os.getenv("SOLVER_MAX_QUEUE", "32"))
+        self.max_queue_per_tenant = max_queue_per_tenant if max_queue_per_tenant is not None else int(
+            os.getenv("SOLVER_MAX_QUEUE_PER_TENANT", str(max(1, self.max_queue // 2))))
+
+        self._solver_executor = ThreadPoolExecutor(max_workers=self.solver_slots, thread_name_prefix="solver")
+        # Shared by every request, replaces the per-request ETA pools
+        self.eta_executor = ThreadPoolExecutor(max_workers=self.eta_workers, thread_name_prefix="eta")
+
+        self._queues = OrderedDict()  # tenant -> deque of waiting tickets
+        self._queued = 0
+        self._active = 0
+
+        self._stats_lock = threading.Lock()
+        self._completed = 0
+        self._rejected = 0
+        self._avg_service_seconds = None
+        self._avg_wait_seconds = 0.0
+        self._max_wait_seconds = 0.0
+
+    async def run(self, tenant_id, fn):
+        """Run the blocking `fn` on a solver slot once one is free for `tenant_id`."""
+        loop = asyncio.get_running_loop()
+        tenant_id = tenant_id or "default"
+
+        if self._active >= self.solver_slots:
+            if self._queued >= self.max_queue:
+                self._reject("solver queue is full")
+            if len(self._queues.get(tenant_id, ())) >= self.max_queue_per_tenant:
+                self._reject(f"solver queue share of tenant '{tenant_id}' is full")
+
+        ticket = loop.create_future()
+        self._queues.setdefault(tenant_id, deque()).append(ticket)
+        self._queued += 1
+        enqueued_at = time.monotonic()
+        self._dispatch()
+
+        try:
+            await ticket
+        except asyncio.CancelledError:
+            # Client went away while waiting, give the slot back if it was already granted
+            if ticket.done() and not ticket.cancelled():
+                self._release()
+            else:
+                ticket.cancel()
+            raise
+
+        self._record_wait(time.monotonic() - enqueued_at)
+
+        started = time.monotonic()
+        future = self._solver_executor.submit(fn)
+
+        def finished(_):
+            # The slot is held until the solver thread is done, even when the request was cancelled
+            self._record_service(time.monotonic() - started)
+            try:
+                loop.call_soon_threadsafe(self._release)
+            except RuntimeError:
+                # Event loop already closed (shutdown), nothing left to admit
+                pass
+
+        future.add_done_callback(finished)
+        return await asyncio.wrap_future(future, loop=loop)
+
+    def _dispatch(self):
+        # Grant free slots, one tenant at a time in round-robin order
+        while self._active < self.solver_slots and self._queues:
+            tenant_id, queue = next(iter(self._queues.items()))
+            ticket = queue.popleft()
+            self._queued -= 1
+
+            # Move the tenant to the back of the rotation, or drop it once empty
+            del self._queues[tenant_id]
+            if queue:
+                self._queues[tenant_id] = queue
+
+            if ticket.cancelled():
+                continue
+            self._active += 1
+            ticket.set_result(None)
+
+    def _release(self):
+        self._active -= 1
+        self._dispatch()
+
+    def _reject(self, reason):
+        with self._stats_lock:
+            self._rejected += 1
+        retry_after = self.retry_after()
+        logging.warning(f"Rejecting solve request, {reason} (retry after {retry_after}s)")
+        raise SchedulerSaturated(retry_after, reason)
+
+    def retry_after(self) -> int:
+        # Time for the work ahead of us to drain through the solver slots
+        service = self._avg_service_seconds or 10.0
+        return max(1, math.ceil((self._queued + self._active) * service / self.solver_slots))
+
+    def _record_wait(self, seconds):
+        with self._stats_lock:
+            self._avg_wait_seconds = 0.9 * self._avg_wait_seconds + 0.1 * seconds
+            self._max_wait_seconds = max(self._max_wait_seconds, seconds)
+
+    def _record_service(self, seconds):
+        with self._stats_lock:
+            self._completed += 1
+            if self._avg_service_seconds is None:
+                self._avg_service_seconds = seconds
+            else:
+                self._avg_service_seconds = 0.9 * self._avg_service_seconds + 0.1 * seconds
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "solver_slots": self.solver_slots,
+                "active": self._active,
+                "queue_depth": self._queued,
+                "queue_depth_per_tenant": {tenant: len(queue) for tenant, queue in self._queues.items()},
+                "max_queue": self.max_queue,
+                "eta_workers": self.eta_workers,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "avg_wait_seconds": round(self._avg_wait_seconds, 3),
+                "max_wait_seconds": round(self._max_wait_seconds, 3),
+                "avg_service_seconds": round(self._avg_service_seconds or 0.0, 3),
+            }
+
+
+@lru_cache(maxsize=None)
+def get_scheduler() -> SolveScheduler:
+    return SolveScheduler()
@@ -0,0 +1,25 @@
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+
+PROCESS_POOL_WORKERS = int(os.getenv("PROCESS_POOL_WORKERS", str(os.cpu_count() or 1)))
+# forkserver avoids forking a process that already runs the event loop and executor threads
+PROCESS_POOL_START_METHOD = os.getenv("PROCESS_POOL_START_METHOD", "forkserver")
+
+
+@lru_cache(maxsize=None)
+def get_process_pool():
+    """
+    Shared pool for CPU-bound work that should not hold the GIL of the serving process.
+
+    AWS Lambda has no /dev/shm, so multiprocessing cannot create its queues there. In that
+    case a thread pool of the same size is returned and the work runs in-process.
+    """
+    try:
+        context = multiprocessing.get_context(PROCESS_POOL_START_METHOD)
+        return ProcessPoolExecutor(max_workers=PROCESS_POOL_WORKERS, mp_context=context)
+    except (OSError, NotImplementedError, ValueError) as exc:
+        logging.warning(f"Process pool unavailable ({exc}), falling back to threads")
+        return ThreadPoolExecutor(max_workers=PROCESS_POOL_WORKERS, thread_name_prefix="cpu")
@@ -0,0 +1,147 @@
+"""
+Compare per-leg ETA calls with batched route requests against a local stub ETA service.
+
+The stub answers both the per-leg GET and the route POST after a fixed latency (plus a
+small cost per leg for routes), so the numbers show what the round trips cost.
+
+    python -m app.tools.bench_eta --routes 20 --stops 40 --latency-ms 40 --workers 16
+    python -m app.tools.bench_eta --no-batch-server   # service without route support
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from app.models.geo.eta.eta_client import EtaClient, chunk_route_legs, BatchUnsupported
+
+
+def leg_geometry(start, stop, points=8):
+    return [{'lat': start[0] + (stop[0] - start[0]) * i / (points - 1),
+             'lng': start[1] + (stop[1] - start[1]) * i / (points - 1)} for i in range(points)]
+
+
+def make_handler(latency, per_leg_latency, batch_supported):
+    class StubEtaHandler(BaseHTTPRequestHandler):
+        # Keep-alive, like the real service behind its load balancer
+        protocol_version = "HTTP/1.1"
+        requests_served = 0
+        lock = threading.Lock()
+
+        def log_message(self, *args):
+            pass
+
+        def _reply(self, status, payload):
+            with StubEtaHandler.lock:
+                StubEtaHandler.requests_served += 1
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query)
+            start = (float(query['start_lat'][0]), float(query['start_lon'][0]))
+            stop = (float(query['stop_lat'][0]), float(query['stop_lon'][0]))
+            time.sleep(latency)
+            self._reply(200, {'directions_data': leg_geometry(start, stop)})
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            if not batch_supported:
+                self._reply(404, {'error': 'unknown action'})
+                return
+            waypoints = [(point['lat'], point['lng']) for point in body['waypoints']]
+            time.sleep(latency + per_leg_latency * (len(waypoints) - 1))
+            points = []
+            waypoint_indexes = [0]
+            for start, stop in zip(waypoints, waypoints[1:]):
+                # Consecutive legs share their joining point
+                points.extend(leg_geometry(start, stop)[1 if points else 0:])
+                waypoint_indexes.append(len(points) - 1)
+            self._reply(200, {'directions_data': points, 'waypoint_indexes': waypoint_indexes})
+
+    return StubEtaHandler
+
+
+def make_routes(count, stops, seed=0):
+    rng = random.Random(seed)
+    routes = []
+    for _ in range(count):
+        points = [(25.0 + rng.random() * 0.3, 55.0 + rng.random() * 0.3) for _ in range(stops)]
+        routes.append([(*start, *stop) for start, stop in zip(points, points[1:])])
+    return routes
+
+
+def run_per_leg(client, routes, workers):
+    legs = [leg for route in routes for leg in route]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        responses = list(executor.map(lambda leg: client.leg(*leg, "uae"), legs))
+    return dict(zip(legs, responses))
+
+
+def run_batched(client, routes, workers):
+    chunks = [chunk for route in routes for chunk in chunk_route_legs(route)]
+
+    def fetch(waypoints):
+        try:
+            responses = client.route(waypoints, "uae")
+        except BatchUnsupported:
+            return waypoints, None
+        return waypoints, responses
+
+    results = {}
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for waypoints, responses in executor.map(fetch, chunks):
+            legs = [(*waypoints[k], *waypoints[k + 1]) for k in range(len(waypoints) - 1)]
+            if responses is None:
+                # Same as CFR.fetch_directions: rejected chunks are retried as parallel per-leg calls
+                failed.extend(legs)
+            else:
+                results.update(zip(legs, responses))
+        results.update(zip(failed, executor.map(lambda leg: client.leg(*leg, "uae"), failed)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--routes", type=int, default=20)
+    parser.add_argument("--stops", type=int, default=40)
+    parser.add_argument("--latency-ms", type=float, default=40)
+    parser.add_argument("--per-leg-ms", type=float, default=1)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--no-batch-server", action="store_true")
+    args = parser.parse_args()
+
+    handler = make_handler(args.latency_ms / 1000, args.per_leg_ms / 1000, not args.no_batch_server)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = f"http://127.0.0.1:{server.server_address[1]}/eta"
+
+    routes = make_routes(args.routes, args.stops)
+    leg_count = sum(len(route) for route in routes)
+    print(f"{args.routes} routes, {leg_count} legs, {args.latency_ms:.0f} ms per call, {args.workers} workers")
+
+    results = {}
+    for name, run, batch_mode in (("per-leg", run_per_leg, "off"), ("batched", run_batched, "auto")):
+        client = EtaClient(endpoint, batch_mode=batch_mode)
+        handler.requests_served = 0
+        started = time.perf_counter()
+        results[name] = run(client, routes, args.workers)
+        elapsed = time.perf_counter() - started
+        print(f"{name:<10} {elapsed * 1000:8.1f} ms  {handler.requests_served:5d} requests")
+
+    same = all(results["per-leg"][leg]['directions_data'] == results["batched"][leg]['directions_data']
+               for leg in results["per-leg"])
+    print(f"per-leg geometry identical: {same}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
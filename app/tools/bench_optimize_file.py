@@ -0,0 +1,70 @@
+"""
+Compare the two-call flow (parse, then post the parsed JSON to optimize-route) with the
+single optimize-file call against a running service.
+
+    python -m app.tools.bench_optimize_file --url http://localhost:8000 --file orders.xlsx --tenant silal
+
+Reports wall time, bytes sent/received and the peak memory header of each call (only sent
+when the service runs with UPLOAD_MEMORY_TRACE=1). Use --deterministic so both flows
+solve the same records.
+"""
+import argparse
+import json
+import time
+
+XLSX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def post_file(session, url, path, params, headers):
+    with open(path, "rb") as workbook:
+        return session.post(url, files={"file": (path, workbook, XLSX_CONTENT_TYPE)}, params=params,
+                            headers=headers)
+
+
+def describe(name, elapsed, sent, responses):
+    received = sum(len(response.content) for response in responses)
+    memory = [response.headers.get("X-Upload-Peak-Memory-Kb", "-") for response in responses]
+    timing = [response.headers.get("Server-Timing", "") for response in responses]
+    print(f"{name:<10} {elapsed * 1000:9.1f} ms  sent {sent / 1024:9.1f} KB  received {received / 1024:9.1f} KB  "
+          f"peak memory KB {'/'.join(memory)}")
+    for line in timing:
+        if line:
+            print(f"{'':<10} {line}")
+
+
+def main():
+    import os
+    import requests
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--file", required=True)
+    parser.add_argument("--tenant", default=None)
+    parser.add_argument("--deterministic", action="store_true")
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    headers = {"X-Tenant-Id": args.tenant} if args.tenant else {}
+    params = {"deterministic": "true"} if args.deterministic else {}
+    file_size = os.path.getsize(args.file)
+    session = requests.Session()
+
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        parsed = post_file(session, f"{args.url}/api/v1/files/parse", args.file, params, headers)
+        parsed.raise_for_status()
+        # The client decodes the parsed JSON and sends it back, like the web app does
+        body = json.dumps(parsed.json()).encode("utf-8")
+        optimized = session.post(f"{args.url}/api/v1/optimize-route", data=body,
+                                 headers={**headers, "Content-Type": "application/json"})
+        optimized.raise_for_status()
+        describe("two-call", time.perf_counter() - started, file_size + len(body), [parsed, optimized])
+
+        started = time.perf_counter()
+        single = post_file(session, f"{args.url}/api/v1/optimize-file", args.file, params, headers)
+        single.raise_for_status()
+        describe("one-shot", time.perf_counter() - started, file_size, [single])
+
+
+if __name__ == "__main__":
+    main()
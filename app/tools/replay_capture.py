@@ -0,0 +1,166 @@
+"""
+Replay captured optimize requests (see app/services/v1/debug/capture.py) through the
+CPU-side stages of a solve, with the solver and the ETA service answered from the
+capture, to catch regressions in payload building and response mapping.
+
+Captures are listed by GET /api/v1/debug/captures and downloaded from
+/api/v1/debug/captures/{capture_id}, both with the profiling token in X-Profile-Token.
+
+    python -m app.tools.replay_capture /tmp/captures --repeat 5
+    python -m app.tools.replay_capture /tmp/captures --save-baseline baseline.json
+    python -m app.tools.replay_capture /tmp/captures --baseline baseline.json --tolerance 0.2
+
+Per capture it reports the median milliseconds of each stage (prepare: payload building
+and vehicle type matching, directions: leg planning and lookups, map: response mapping),
+whether the rebuilt payload matches the captured one and how many legs were missing from
+the capture. Anonymized captures replay the same way, each location became one synthetic
+point, so the legs still match the recorded ETA responses. With --baseline, stages slower
+than the baseline by more than --tolerance are listed and the exit status is 1.
+"""
+import argparse
+import copy
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+
+from app.models.geo.eta.eta_cache import COORDINATE_DECIMALS
+from app.services.v1.debug.capture import load_capture
+
+STAGES = ("prepare", "directions", "map")
+
+
+class RecordedEta:
+    """ETA client answering from a capture's directions, per leg only."""
+
+    batch_supported = False
+
+    def __init__(self, directions):
+        self.responses = {self.key(direction["start_lat"], direction["start_lng"],
+                                   direction["end_lat"], direction["end_lng"]): direction["response"]
+                          for direction in directions}
+
+    def key(self, *leg):
+        return tuple(round(float(value), COORDINATE_DECIMALS) for value in leg)
+
+    def leg(self, start_lat, start_lon, stop_lat, stop_lon, country, timeout=None):
+        response = self.responses.get(self.key(start_lat, start_lon, stop_lat, stop_lon))
+        if response is None:
+            # Filled with a straight-line estimate and counted as missing
+            raise KeyError("leg not in the capture")
+        return copy.deepcopy(response)
+
+    def route(self, waypoints, country, timeout=None):
+        from app.models.geo.eta.eta_client import BatchUnsupported
+        raise BatchUnsupported()
+
+
+def capture_paths(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            yield from sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(".json.gz"))
+        else:
+            yield path
+
+
+def replay(capture, repeat) -> dict:
+    from app.models.geo.vrp.cfr import cfr as cfr_module
+
+    eta = RecordedEta(capture.get("directions") or [])
+    cfr_module.get_eta_client = lambda: eta
+    params = capture.get("params", {})
+
+    timings = {stage: [] for stage in STAGES}
+    payload_match = None
+    missing_legs = 0
+    for _ in range(repeat):
+        cfr = cfr_module.CFR(None, copy.deepcopy(capture["request"]), template_content=capture["template"],
+                             consolidate=params.get("consolidate"), tier=params.get("tier"),
+                             matrices=params.get("matrices"), geometry=params.get("geometry"))
+        response = copy.deepcopy(capture["response"])
+
+        started = time.perf_counter()
+        payload = cfr.match_vehicles_types(cfr.prepare_payload())
+        timings["prepare"].append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        directions = None if cfr.lazy_geometry else cfr.prepare_directions(response, cfr.data)
+        timings["directions"].append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        cfr.map_optimization_response(response, cfr.data, directions)
+        timings["map"].append(time.perf_counter() - started)
+
+        if payload_match is None:
+            # Timed after the first run, the comparison is not part of any stage
+            payload_match = capture.get("payload") is None or json.loads(json.dumps(payload)) == capture["payload"]
+            missing_legs = cfr.degraded_legs - sum(1 for direction in capture.get("directions") or []
+                                                   if direction["response"].get("degraded"))
+
+    return {
+        "ms": {stage: round(statistics.median(values) * 1000, 2) for stage, values in timings.items()},
+        "payload_match": payload_match,
+        "missing_legs": max(0, missing_legs),
+        "shipments": len(capture["request"].get("records", [])),
+        "vehicles": len(capture["request"].get("vehicles", [])),
+    }
+
+
+def regressions(results, baseline, tolerance) -> list:
+    found = []
+    for capture_id, result in results.items():
+        before = baseline.get(capture_id)
+        if before is None:
+            continue
+        for stage in STAGES:
+            # Stages under a millisecond are noise
+            if before["ms"][stage] >= 1 and result["ms"][stage] > before["ms"][stage] * (1 + tolerance):
+                found.append(f"{capture_id} {stage}: {before['ms'][stage]:.1f} ms -> {result['ms'][stage]:.1f} ms")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("captures", nargs="+", help="capture files or directories of captures")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--baseline", default=None, help="results of an earlier run to compare with")
+    parser.add_argument("--save-baseline", default=None, help="write this run's results here")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown per stage, 0.2 = 20%%")
+    args = parser.parse_args()
+
+    # Replays must not touch the ETA cache or the leg history of this machine
+    from app.models.geo.vrp.cfr import cfr as cfr_module
+    from app.models.geo.eta.leg_history import get_leg_history
+    cfr_module.ETA_CACHE = False
+    get_leg_history().path = None
+    # Lazy captures map with geometry tokens, nobody resolves the replayed ones
+    from app.models.geo.eta import route_geometry
+    route_geometry.GEOMETRY_TOKEN_SECRET = route_geometry.GEOMETRY_TOKEN_SECRET or "replay"
+    logging.disable(logging.WARNING)
+
+    results = {}
+    for path in capture_paths(args.captures):
+        capture = load_capture(path)
+        result = results[capture["capture_id"]] = replay(capture, args.repeat)
+        stages = "  ".join(f"{stage} {result['ms'][stage]:8.1f} ms" for stage in STAGES)
+        print(f"{capture['capture_id'][:12]}  {result['shipments']:5d} shipments {result['vehicles']:4d} vehicles  "
+              f"{stages}  payload {'ok' if result['payload_match'] else 'CHANGED'}  "
+              f"missing legs {result['missing_legs']}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            found = regressions(results, json.load(file), args.tolerance)
+        for line in found:
+            print(f"REGRESSION {line}")
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
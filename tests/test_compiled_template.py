@@ -0,0 +1,113 @@
+import json
+import re
+
+from app.models.geo.vrp.cfr.compiled_template import CompiledTemplate, RecordColumns
+from app.models.geo.vrp.cfr.fleet import Fleet
+from app.models.geo.vrp.cfr.location_table import LocationTable
+
+CFR_TEMPLATE = "app/storage/cfr/silal_main_full.json"
+
+
+def string_resolver(element, records):
+    """The placeholder resolver Shipment/Vehicle used before templates were compiled."""
+    flattened = {}
+
+    def flatten(item, path):
+        for key, value in item.items():
+            if isinstance(value, dict):
+                flatten(value, f"{path}.{key}")
+            else:
+                flattened[f"{path}.{key}"] = value
+
+    for index, record in enumerate(records):
+        flatten(record, str(index))
+
+    def convert(value):
+        if isinstance(value, dict):
+            return {key: convert(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [convert(item) for item in value]
+        if isinstance(value, str):
+            try:
+                number = float(value)
+                return int(number) if number.is_integer() else number
+            except ValueError:
+                pass
+        return value
+
+    resolved = []
+    for index in range(len(records)):
+        element_str = json.dumps(element)
+        for placeholder in re.findall(r'{{(.*?)}}', element_str):
+            path = '.'.join(placeholder.split('.')[1:]).replace('*', str(index))
+            if path in flattened:
+                element_str = element_str.replace(f'{{{{{placeholder}}}}}', str(flattened[path]))
+        resolved.append(convert(json.loads(element_str)))
+    return resolved
+
+
+def as_json(payload):
+    # NaN never equals itself, compare the serialized form
+    return json.dumps(payload, sort_keys=True)
+
+
+def cfr_template():
+    with open(CFR_TEMPLATE) as file:
+        return json.load(file)["model"]
+
+
+def make_records():
+    return [
+        {"label": "order_8T_1", "shipment_type": "general", "required_vehicle_type": "8T", "check_in_time": 600,
+         "pickup": {"lat": 24.4539, "lng": 54.3773}, "dropoff": {"lat": 25.2048, "lng": 55.2708},
+         "pickup_location": "loc_0", "dropoff_location": "loc_1", "capacity": 2.5,
+         "time_window": {"from": "2024-04-01T06:00:00Z", "to": "2024-04-01T18:00:00Z"}},
+        {"label": "order_3T_2", "shipment_type": "anon_abc", "required_vehicle_type": "3T", "check_in_time": "900",
+         "pickup": {"lat": "24.5", "lng": 54}, "dropoff": {"lat": 25.0, "lng": 55.1},
+         "pickup_location": "loc_2", "dropoff_location": "loc_1", "capacity": None,
+         "time_window": {"from": "2024-04-01T06:00:00Z", "to": "2024-04-02T02:00:00Z"}},
+        # Missing fields keep their placeholder
+        {"label": "order_8T_3", "required_vehicle_type": "8T", "check_in_time": 1.5,
+         "pickup": {"lat": 24.1, "lng": 54.2}, "dropoff": {"lat": 25.3},
+         "capacity": "12", "time_window": {"from": "2024-04-01T06:00:00Z"}},
+    ]
+
+
+def test_shipments_match_string_resolver():
+    element = cfr_template()["shipments"][0]
+    records = make_records()
+    assert as_json(CompiledTemplate(element).render(RecordColumns(records), len(records))) == \
+        as_json(string_resolver(element, records))
+
+
+def test_vehicles_match_string_resolver():
+    element = cfr_template()["vehicles"][0]
+    vehicles = [{"type": "8T", "label": "8T_0001", "cost": 1, "capacity": 24, "lat": 24.45, "lng": 54.37,
+                 "start_location": "loc_0"},
+                {"type": "3T", "label": "3T_0002", "cost": 1000, "capacity": 9, "lat": "25", "lng": 55.5}]
+    assert as_json(CompiledTemplate(element).render(RecordColumns(vehicles), len(vehicles))) == \
+        as_json(string_resolver(element, vehicles))
+
+
+def test_literals_and_mixed_strings_match_string_resolver():
+    element = {"nan": "NaN", "inf": "Infinity", "negative": "-Infinity", "exponent": "1e3", "flag": True,
+               "none": None, "text": "plain", "mixed": "{{records.*.label}}-{{records.*.capacity}}",
+               "numeric_mix": "{{records.*.check_in_time}}0", "first": "{{records.0.label}}",
+               "beyond": "{{records.9.label}}", "short": "{{records.*}}", "nested": "{{records.*.pickup}}",
+               "list": [{"at": ["{{records.*.pickup.lat}}", 3, "4.0"]}]}
+    records = make_records()
+    assert as_json(CompiledTemplate(element).render(RecordColumns(records), len(records))) == \
+        as_json(string_resolver(element, records))
+
+
+def test_fleet_columns_match_vehicle_records():
+    element = cfr_template()["vehicles"][0]
+    shipments = [{"pickup": {"lat": 24.45, "lng": 54.37}, "required_vehicle_type": "8T", "capacity": 4}] * 30
+    fleet = Fleet.generate(shipments, 150, [{"name": "8T", "capacity": 24, "demo_count": 5}],
+                           seed="workbook")
+    vehicles = fleet.to_records()
+    # Tags the vehicle dicts, the fleet then gets the same tags from the same table
+    table = LocationTable.from_data({"vehicles": vehicles})
+    fleet.tag_locations(table)
+    assert as_json(CompiledTemplate(element).render(fleet, len(fleet))) == \
+        as_json(string_resolver(element, vehicles))
@@ -0,0 +1,53 @@
+from app.models.geo.vrp.cfr import cfr as cfr_module
+from app.models.geo.vrp.cfr.cfr import CFR
+
+CFR_TEMPLATE = "app/storage/cfr/silal_main_full.json"
+
+
+class FixedEta:
+    """ETA client answering every leg with the same travel time, per leg only."""
+
+    batch_supported = False
+
+    def leg(self, start_lat, start_lon, stop_lat, stop_lon, country, timeout=None):
+        return {"duration_seconds": 600, "distance_meters": 5000}
+
+
+def make_data():
+    records = [
+        {"label": f"order_8T_{index}", "display_name": f"order_8T_{index}", "required_vehicle_type": "8T",
+         "customer": f"customer_{index % 2}", "capacity": 2, "check_in_time": 600, "exclusive": False,
+         "pickup": {"lat": 24.45, "lng": 54.37}, "dropoff": {"lat": 25.2 + index / 100, "lng": 55.27},
+         "time_window": {"from": "2024-04-01T06:00:00Z", "to": "2024-04-01T18:00:00Z"}}
+        for index in range(3)]
+    vehicles = [{"type": "8T", "label": f"8T_{index:04d}", "cost": 1, "capacity": 24, "lat": 24.45, "lng": 54.37}
+                for index in range(2)]
+    return {"records": records, "vehicles": vehicles, "exclusive_customers": []}
+
+
+def prepare(monkeypatch, matrices):
+    monkeypatch.setattr(cfr_module, "get_eta_client", lambda: FixedEta())
+    monkeypatch.setattr(cfr_module, "ETA_CACHE", False)
+    cfr = CFR(CFR_TEMPLATE, make_data(), consolidate=False, matrices=matrices)
+    return cfr, cfr.match_vehicles_types(cfr.prepare_payload())["model"]
+
+
+def test_matrix_payload_has_no_locations(monkeypatch):
+    cfr, model = prepare(monkeypatch, matrices=True)
+    assert cfr.matrix_status.startswith("built")
+    assert model["durationDistanceMatrices"]
+    for shipment in model["shipments"]:
+        for visit in shipment["pickups"] + shipment["deliveries"]:
+            assert visit["tags"]
+            assert not set(visit) & {"arrivalLocation", "arrivalWaypoint"}
+    for vehicle in model["vehicles"]:
+        assert vehicle["startTags"]
+        assert not set(vehicle) & {"startLocation", "startWaypoint", "endLocation", "endWaypoint"}
+
+
+def test_payload_without_matrices_keeps_locations(monkeypatch):
+    _, model = prepare(monkeypatch, matrices=False)
+    assert "durationDistanceMatrices" not in model
+    assert all("arrivalLocation" in visit for shipment in model["shipments"]
+               for visit in shipment["pickups"] + shipment["deliveries"])
+    assert all("startLocation" in vehicle for vehicle in model["vehicles"])